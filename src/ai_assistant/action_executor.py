@@ -6,7 +6,8 @@ particularly calendar and booking-related operations.
 """
 
 import logging
-from typing import Dict, Any, List, Optional
+import threading
+from typing import Dict, Any, List, Optional, Iterable
 from datetime import datetime, timedelta
 from django.db import transaction, models
 from django.utils import timezone
@@ -15,21 +16,213 @@ from django.core.exceptions import ValidationError
 from calendar_mgmt.services import CalendarManagementService
 from service_catalog.services import ServiceCatalogService
 from customer.models import Customer
-from calendar_mgmt.models import Booking
+from calendar_mgmt.models import Booking, CalendarSettings
 from service_catalog.models import Service, ServiceCategory
+from service_catalog.search import get_service_index, SUGGESTION_THRESHOLD
 from users.authentication import SupabaseUser
 
 logger = logging.getLogger(__name__)
 
+# Actions that only read tenant data and can be safely repeated
+READ_ONLY_ACTIONS = frozenset({
+    'check_service_exists',
+    'check_availability',
+    'search_customer',
+})
+
+
+class TurnLookupCache:
+    """
+    Lookups shared by all actions of one chat turn.
+    
+    Services, customers, categories and calendar settings are resolved once
+    per turn and reused by every action; service names are resolved through
+    the tenant's service name index and loaded in one batched query. Reads of
+    a turn may run on several threads, so the lookups are only read and
+    stored under a lock; queries run outside it, and when two threads load
+    the same entry the first one stored wins. Write actions invalidate what
+    they change.
+    """
+    
+    _MISSING = object()
+    
+    def __init__(self, user_id: str):
+        self.user_id = str(user_id)
+        self._lock = threading.Lock()
+        self._services_by_name = {}
+        self._services_by_id = {}
+        self._customers_by_email = {}
+        self._categories = None
+        self._calendar_settings = self._MISSING
+    
+    def prefetch_services(self, names: Iterable[str]):
+        """Resolve several service names like ``resolve_service``, then load them in one query."""
+        names = {name.strip().lower() for name in names if name and name.strip()}
+        with self._lock:
+            pending = names - self._services_by_name.keys()
+        if not pending:
+            return
+        
+        index = get_service_index(self.user_id)
+        matches = {name: index.best_match(name) for name in pending}
+        services = self.get_services(service_id for service_id in matches.values() if service_id)
+        
+        with self._lock:
+            for name, service_id in matches.items():
+                self._services_by_name.setdefault(name, services.get(service_id) if service_id else None)
+    
+    def resolve_service(self, name: str) -> Optional[Service]:
+        """
+        Active service ``name`` resolves to, or None.
+
+        Uses ``ServiceNameIndex.best_match``: the name must equal or contain,
+        or be contained in, the service's name or "brand model" as whole
+        words, or be a close typo of one keeping its model words. Names that
+        are merely similar, like "Sony A7S" for "Sony FX3", resolve to None.
+        """
+        key = (name or '').strip().lower()
+        if not key:
+            return None
+        with self._lock:
+            if key in self._services_by_name:
+                return self._services_by_name[key]
+        self.prefetch_services([key])
+        with self._lock:
+            return self._services_by_name.get(key)
+    
+    def get_services(self, service_ids: Iterable[str]) -> Dict[str, Service]:
+        """Services by id, loading the ones not resolved yet in one query."""
+        service_ids = [str(service_id) for service_id in service_ids]
+        with self._lock:
+            missing = [sid for sid in service_ids if sid not in self._services_by_id]
+        if missing:
+            loaded = list(Service.objects.filter(
+                id__in=missing, user_id=self.user_id
+            ).select_related('category'))
+            with self._lock:
+                for service in loaded:
+                    self._services_by_id.setdefault(str(service.id), service)
+        with self._lock:
+            return {
+                sid: self._services_by_id[sid]
+                for sid in service_ids if sid in self._services_by_id
+            }
+    
+    def get_customer_by_email(self, email: str) -> Optional[Customer]:
+        key = (email or '').strip().lower()
+        if not key:
+            return None
+        with self._lock:
+            if key in self._customers_by_email:
+                return self._customers_by_email[key]
+        customer = Customer.objects.filter(user_id=self.user_id, email__iexact=key).first()
+        with self._lock:
+            return self._customers_by_email.setdefault(key, customer)
+    
+    def get_category_by_name(self, name: str) -> Optional[ServiceCategory]:
+        with self._lock:
+            categories = self._categories
+        if categories is None:
+            categories = {
+                category.name.lower(): category
+                for category in ServiceCategory.objects.filter(user_id=self.user_id)
+            }
+            with self._lock:
+                if self._categories is None:
+                    self._categories = categories
+                categories = self._categories
+        return categories.get((name or '').lower())
+    
+    def get_calendar_settings(self) -> Optional[CalendarSettings]:
+        with self._lock:
+            if self._calendar_settings is not self._MISSING:
+                return self._calendar_settings
+        calendar_settings = CalendarSettings.objects.filter(user_id=self.user_id).first()
+        with self._lock:
+            if self._calendar_settings is self._MISSING:
+                self._calendar_settings = calendar_settings
+            return self._calendar_settings
+    
+    def invalidate(self, action_type: str):
+        """Forget lookups a write action may have changed."""
+        with self._lock:
+            if action_type in ('create_service', 'update_service'):
+                self._services_by_name.clear()
+                self._services_by_id.clear()
+                self._categories = None
+            elif action_type in ('create_customer', 'update_customer', 'create_booking'):
+                self._customers_by_email.clear()
+
 
 class ActionExecutor:
-    """Executes AI-identified actions for calendar and booking operations."""
+    """
+    Executes AI-identified actions for calendar and booking operations.
     
-    def __init__(self):
+    One executor serves all actions of a turn; its TurnLookupCache is
+    created for the first user it sees and shared across those actions.
+    """
+    
+    def __init__(self, lookups: TurnLookupCache = None):
         self.calendar_service = CalendarManagementService()
         self.service_catalog = ServiceCatalogService()
+        self.lookups = lookups
+    
+    def prefetch(self, actions: List[Dict[str, Any]], user_id: str):
+        """Batch the service lookups of all actions of a turn."""
+        names = []
+        for action in actions:
+            parameters = action.get('parameters') or {}
+            action_type = action.get('action')
+            if action_type == 'check_availability':
+                names.extend(name for name in parameters.get('services', []) if isinstance(name, str))
+            elif action_type == 'check_service_exists':
+                names.append(parameters.get('service_name', ''))
+            elif action_type == 'create_booking':
+                names.extend(self._booking_service_name(service) for service in parameters.get('services', []))
+        
+        self._get_lookups(user_id).prefetch_services(name for name in names if name)
+    
+    def _get_lookups(self, user_id: str) -> TurnLookupCache:
+        if self.lookups is None or self.lookups.user_id != str(user_id):
+            self.lookups = TurnLookupCache(user_id)
+        return self.lookups
     
-    def execute_action(self, action_type: str, parameters: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+    def prepare_action(self, action_type: str, parameters: Dict[str, Any], user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Do the read-only part of an action ahead of its confirmation.
+        
+        Args:
+            action_type: Type of action awaiting confirmation
+            parameters: Action parameters
+            user_id: User ID the action belongs to
+        
+        Returns:
+            Prepared data to pass to ``execute_action``, or None if the
+            action type has nothing worth preparing or preparation failed
+        """
+        if action_type != 'create_booking':
+            return None
+        
+        try:
+            user = SupabaseUser({'sub': user_id})
+            self._get_lookups(user_id)
+            
+            prepared = self.calendar_service.prepare_booking_from_ai(
+                user, self._extract_booking_data(parameters)
+            )
+            return prepared if prepared['success'] else None
+        
+        except Exception as e:
+            logger.error(f"Error preparing action {action_type}: {e}")
+            return None
+    
+    def execute_action(
+        self, 
+        action_type: str, 
+        parameters: Dict[str, Any], 
+        user_id: str,
+        prepared: Dict[str, Any] = None
+    ) -> Dict[str, Any]:
         """
         Execute an action based on its type and parameters.
         
@@ -37,6 +230,7 @@ class ActionExecutor:
             action_type: Type of action to execute
             parameters: Action parameters
             user_id: User ID executing the action
+            prepared: Still valid result of ``prepare_action``
         
         Returns:
             Dictionary with execution result
@@ -44,12 +238,16 @@ class ActionExecutor:
         try:
             # Create SupabaseUser object
             user = SupabaseUser({'sub': user_id})
+            self._get_lookups(user_id)
+            
+            if action_type not in READ_ONLY_ACTIONS:
+                self.lookups.invalidate(action_type)
             
             # Route to appropriate handler
             if action_type == 'check_service_exists':
                 return self._handle_check_service_exists(user, parameters)
             elif action_type == 'create_booking':
-                return self._handle_create_booking(user, parameters)
+                return self._handle_create_booking(user, parameters, prepared)
             elif action_type == 'update_booking':
                 return self._handle_update_booking(user, parameters)
             elif action_type == 'cancel_booking':
@@ -80,11 +278,16 @@ class ActionExecutor:
             }
     
     @transaction.atomic
-    def _handle_create_booking(self, user: SupabaseUser, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    def _handle_create_booking(
+        self, 
+        user: SupabaseUser, 
+        parameters: Dict[str, Any], 
+        prepared: Dict[str, Any] = None
+    ) -> Dict[str, Any]:
         """Handle booking creation from AI."""
         try:
-            # Extract and validate booking parameters
-            booking_data = self._extract_booking_data(parameters)
+            # Extract and validate booking parameters; prepared bookings have their services resolved
+            booking_data = self._extract_booking_data(parameters, resolve_services=prepared is None)
             
             # Use calendar service to create booking
             result = self.calendar_service.create_booking_from_ai(
@@ -92,7 +295,9 @@ class ActionExecutor:
                 booking_data=booking_data,
                 ai_session_id=parameters.get('ai_session_id'),
                 ai_message_id=parameters.get('ai_message_id'),
-                confidence_score=parameters.get('confidence_score', 0.8)
+                confidence_score=parameters.get('confidence_score', 0.8),
+                calendar_settings=self.lookups.get_calendar_settings(),
+                prepared=prepared
             )
             
             if result['success']:
@@ -153,6 +358,7 @@ class ActionExecutor:
                 setattr(booking, field, value)
             
             booking.save()
+            self.calendar_service.publish_booking_update('booking.updated', booking)
             
             # Log the update
             logger.info(f"AI updated booking {booking_id} for user {user.id}")
@@ -188,6 +394,7 @@ class ActionExecutor:
                 booking.status = 'cancelled'
                 booking.notes += f"\nCancelled by AI on {timezone.now().isoformat()}"
                 booking.save()
+                self.calendar_service.publish_booking_update('booking.cancelled', booking)
                 
                 logger.info(f"AI cancelled booking {booking_id} for user {user.id}")
                 
@@ -221,15 +428,12 @@ class ActionExecutor:
             service_names = parameters.get('services', [])
             
             # Find services by name
+            self.lookups.prefetch_services(service_names)
             service_ids = []
             for service_name in service_names:
-                services = Service.objects.filter(
-                    user_id=user.id,
-                    name__icontains=service_name,
-                    is_active=True
-                )
-                if services.exists():
-                    service_ids.append(str(services.first().id))
+                service = self.lookups.resolve_service(service_name)
+                if service:
+                    service_ids.append(str(service.id))
             
             if not service_ids:
                 return {
@@ -245,9 +449,10 @@ class ActionExecutor:
             # Format response
             available_services = []
             unavailable_services = []
+            services = self.lookups.get_services(availability.keys())
             
             for service_id, avail_data in availability.items():
-                service = Service.objects.get(id=service_id)
+                service = services[service_id]
                 service_info = {
                     'name': service.name,
                     'category': service.category.name,
@@ -377,10 +582,7 @@ class ActionExecutor:
                     pass
             
             if not customer and email:
-                try:
-                    customer = Customer.objects.get(email=email, user_id=user.id)
-                except Customer.DoesNotExist:
-                    pass
+                customer = self.lookups.get_customer_by_email(email)
             
             if not customer:
                 return {
@@ -437,12 +639,14 @@ class ActionExecutor:
             elif phone:
                 customers = customers.filter(phone__icontains=phone)
             elif query:
-                customers = customers.filter(
-                    models.Q(first_name__icontains=query) |
-                    models.Q(last_name__icontains=query) |
-                    models.Q(company__icontains=query) |
-                    models.Q(email__icontains=query)
-                )
+                # Every word must match, so "Maria Santos" finds first + last name
+                for term in query.split():
+                    customers = customers.filter(
+                        models.Q(first_name__icontains=term) |
+                        models.Q(last_name__icontains=term) |
+                        models.Q(company__icontains=term) |
+                        models.Q(email__icontains=term)
+                    )
             
             customers = customers[:10]  # Limit results
             
@@ -481,15 +685,8 @@ class ActionExecutor:
         try:
             # Get or create category first
             category_name = parameters.get('category', 'General')
-            category_result = self.service_catalog.get_categories(user.id)
-            
-            category_id = None
-            if category_result['success']:
-                # Find existing category
-                for cat in category_result['categories']:
-                    if cat['name'].lower() == category_name.lower():
-                        category_id = cat['id']
-                        break
+            category = self.lookups.get_category_by_name(category_name)
+            category_id = str(category.id) if category else None
             
             # Create category if not found
             if not category_id:
@@ -600,14 +797,9 @@ class ActionExecutor:
                 }
             
             # Search for service by name (case-insensitive)
-            services = Service.objects.filter(
-                user_id=user.id,
-                is_active=True,
-                name__icontains=service_name
-            )
+            service = self.lookups.resolve_service(service_name)
             
-            if services.exists():
-                service = services.first()
+            if service:
                 return {
                     'success': True,
                     'exists': True,
@@ -643,18 +835,16 @@ class ActionExecutor:
     def _get_similar_services(self, user: SupabaseUser, service_name: str) -> List[str]:
         """Get similar service names for suggestions."""
         try:
-            # Get all active services for the user
-            services = Service.objects.filter(
-                user_id=user.id,
-                is_active=True
-            ).values_list('name', flat=True)[:5]
-            
-            return list(services)
+            matches = get_service_index(user.id).search(
+                service_name, limit=5, min_score=SUGGESTION_THRESHOLD
+            )
+            return [match['name'] for match in matches]
         except Exception:
             return []
     
-    def _extract_booking_data(self, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    def _extract_booking_data(self, parameters: Dict[str, Any], resolve_services: bool = True) -> Dict[str, Any]:
         """Extract and validate booking data from AI parameters."""
+        services = parameters.get('services', [])
         booking_data = {
             'title': parameters.get('title', parameters.get('name', '')),
             'description': parameters.get('description', ''),
@@ -663,11 +853,28 @@ class ActionExecutor:
             'all_day': parameters.get('all_day', False),
             'notes': parameters.get('notes', ''),
             'customer': parameters.get('customer', {}),
-            'services': parameters.get('services', [])
+            'services': [self._resolve_booking_service(service) for service in services] if resolve_services else services
         }
         
         return booking_data
     
+    def _booking_service_name(self, service: Any) -> str:
+        """Service name of a booking line; the AI sends ``service_name``."""
+        if isinstance(service, str):
+            return service
+        if isinstance(service, dict):
+            return service.get('service_name') or service.get('name') or ''
+        return ''
+    
+    def _resolve_booking_service(self, service: Any) -> Dict[str, Any]:
+        """Booking line with the service id resolved from the turn cache."""
+        service_data = dict(service) if isinstance(service, dict) else {'name': self._booking_service_name(service)}
+        if not service_data.get('id'):
+            resolved = self.lookups.resolve_service(self._booking_service_name(service))
+            if resolved:
+                service_data['id'] = str(resolved.id)
+        return service_data
+    
     def _parse_datetime(self, datetime_str: str) -> datetime:
         """Parse datetime string with timezone awareness."""
         if isinstance(datetime_str, datetime):
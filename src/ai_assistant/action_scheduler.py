@@ -0,0 +1,265 @@
+"""
+Action Scheduler
+
+Runs the actions parsed from one AI reply according to a small dependency
+graph. Write actions keep their original order, and a read that touches
+data an earlier write changes waits for that write. Reads that wait for no
+write run concurrently on a thread pool ahead of the turn's transaction;
+everything else runs in order inside it. Reads requested by tool calls of a
+streamed reply can start before the reply has finished.
+"""
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Any, List, Callable, Set, Optional
+from django.conf import settings
+from django.db import connections
+
+from .action_executor import ActionExecutor, READ_ONLY_ACTIONS
+
+logger = logging.getLogger(__name__)
+
+# Data each action type reads or writes
+ACTION_RESOURCES = {
+    'check_service_exists': {'service'},
+    'check_availability': {'service', 'booking'},
+    'search_customer': {'customer'},
+    'create_booking': {'booking', 'service', 'customer'},
+    'update_booking': {'booking', 'service'},
+    'cancel_booking': {'booking'},
+    'reschedule_booking': {'booking'},
+    'create_customer': {'customer'},
+    'update_customer': {'customer'},
+    'create_service': {'service'},
+    'update_service': {'service'},
+}
+
+
+def _resources(action_type: str) -> Set[str]:
+    # Unknown actions are treated as touching everything
+    return ACTION_RESOURCES.get(action_type, {'*'})
+
+
+def _overlaps(first: Set[str], second: Set[str]) -> bool:
+    return '*' in first or '*' in second or bool(first & second)
+
+
+def build_dependencies(action_types: List[str]) -> List[Set[int]]:
+    """
+    Return, for every action, the indexes of earlier actions it must wait for.
+
+    Writes wait for the previous write and for earlier reads of the same
+    data; reads only wait for earlier writes of the data they read.
+    """
+    dependencies = []
+    last_write = None
+
+    for index, action_type in enumerate(action_types):
+        is_write = action_type not in READ_ONLY_ACTIONS
+        resources = _resources(action_type)
+        depends_on = set()
+
+        for earlier in range(index):
+            earlier_type = action_types[earlier]
+            earlier_is_write = earlier_type not in READ_ONLY_ACTIONS
+            if not (is_write or earlier_is_write):
+                continue
+            if _overlaps(resources, _resources(earlier_type)):
+                depends_on.add(earlier)
+
+        if is_write:
+            if last_write is not None:
+                depends_on.add(last_write)
+            last_write = index
+
+        dependencies.append(depends_on)
+
+    return dependencies
+
+
+def independent_reads(action_types: List[str]) -> List[int]:
+    """Indexes of the read-only actions that wait for no other action."""
+    return [
+        index for index, depends_on in enumerate(build_dependencies(action_types))
+        if action_types[index] in READ_ONLY_ACTIONS and not depends_on
+    ]
+
+
+class ActionScheduler:
+    """
+    Executes a turn's actions in dependency order, concurrently where allowed.
+
+    Each task runs on its own thread with its own database connection, which
+    is closed when the task finishes. Tasks must therefore not rely on an
+    enclosing transaction of the calling thread.
+    """
+
+    def __init__(self, max_workers: int = None):
+        self.max_workers = max_workers or settings.AI_ASSISTANT_SETTINGS.get("action_concurrency", 4)
+
+    def run(self, action_types: List[str], tasks: List[Callable[[], Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Run ``tasks`` (one per entry of ``action_types``) and return their
+        results in the original order.
+        """
+        dependencies = build_dependencies(action_types)
+
+        # Fully sequential graphs gain nothing from threads
+        sequential = all(deps == {i - 1} for i, deps in enumerate(dependencies) if i)
+        if len(tasks) <= 1 or self.max_workers <= 1 or sequential:
+            return [task() for task in tasks]
+
+        results = [None] * len(tasks)
+        pending = set(range(len(tasks)))
+        done = set()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ai-action") as pool:
+            running = {}
+
+            while pending or running:
+                for index in sorted(pending):
+                    if dependencies[index] <= done:
+                        pending.discard(index)
+                        running[pool.submit(self._run_task, tasks[index])] = index
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index = running.pop(future)
+                    results[index] = future.result()
+                    done.add(index)
+
+        return results
+
+    def run_reads(self, user_id: str, actions: List[Dict[str, Any]], executor: ActionExecutor) -> List[Dict[str, Any]]:
+        """
+        Run the independent reads of a reply and attach their results.
+
+        Reads already run while the reply streamed, reads awaiting
+        confirmation and reads that fail are left for the turn to run.
+        Returns ``actions`` with ``precomputed_result`` set on the reads
+        that ran.
+        """
+        indexes = [
+            index for index in independent_reads([action.get("action", "") for action in actions])
+            if not actions[index].get("requires_confirmation")
+            and "precomputed_result" not in actions[index]
+        ]
+        if not indexes:
+            return actions
+
+        reads = [actions[index] for index in indexes]
+        executor.prefetch(reads, user_id)
+
+        def make_task(action):
+            def task():
+                try:
+                    return executor.execute_action(action["action"], dict(action.get("parameters") or {}), user_id)
+                except Exception as e:
+                    logger.error(f"Read {action['action']} failed, running it with the turn: {e}")
+                    return None
+            return task
+
+        results = self.run([action["action"] for action in reads], [make_task(action) for action in reads])
+
+        actions = list(actions)
+        for index, result in zip(indexes, results):
+            if result is not None:
+                actions[index] = {**actions[index], "precomputed_result": result}
+        return actions
+
+    def _run_task(self, task: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        try:
+            return task()
+        finally:
+            # Worker threads get their own connections; don't leak them
+            connections.close_all()
+
+
+class EagerReadRunner:
+    """
+    Runs read-only actions while the reply that requested them is streaming.
+
+    A read starts as soon as its tool call is complete, unless an earlier
+    write of the same reply touches its data; those are left to the turn.
+    Results are attached to the reply's actions as
+    ``precomputed_result`` so they are recorded instead of run again.
+    """
+
+    def __init__(self, user_id: str, max_workers: int = None):
+        self.user_id = str(user_id) if user_id else None
+        self.max_workers = max_workers or settings.AI_ASSISTANT_SETTINGS.get("action_concurrency", 4)
+        self._pool = None
+        self._executor = None
+        self._futures = {}
+        self._written = set()
+
+    def submit(self, action: Dict[str, Any]):
+        """Start ``action`` if it is a read that can run ahead of the reply."""
+        action_type = action.get("action")
+        if action_type not in READ_ONLY_ACTIONS:
+            self._written |= _resources(action_type)
+            return
+        if (not self.user_id or action.get("requires_confirmation")
+                or not action.get("tool_call_id") or _overlaps(_resources(action_type), self._written)):
+            return
+
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ai-eager-read")
+            # Shared so the reads of one reply reuse each other's lookups
+            self._executor = ActionExecutor()
+        self._futures[action["tool_call_id"]] = self._pool.submit(
+            self._run, action_type, dict(action.get("parameters") or {})
+        )
+
+    def collect(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        """Wait for the started reads and attach their results to ``response``."""
+        try:
+            return self._attach(response, {
+                call_id: self._result(future) for call_id, future in self._futures.items()
+            })
+        finally:
+            self._shutdown()
+
+    async def acollect(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        """Async counterpart of ``collect``."""
+        try:
+            results = {}
+            for call_id, future in self._futures.items():
+                try:
+                    results[call_id] = await asyncio.wrap_future(future)
+                except Exception as e:
+                    logger.error(f"Eager read failed, running it with the turn: {e}")
+            return self._attach(response, results)
+        finally:
+            self._shutdown()
+
+    def _run(self, action_type: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            return self._executor.execute_action(action_type, parameters, self.user_id)
+        finally:
+            connections.close_all()
+
+    def _result(self, future) -> Optional[Dict[str, Any]]:
+        try:
+            return future.result()
+        except Exception as e:
+            logger.error(f"Eager read failed, running it with the turn: {e}")
+            return None
+
+    def _attach(self, response: Dict[str, Any], results: Dict[str, Any]) -> Dict[str, Any]:
+        if not response.get("success") or not any(result is not None for result in results.values()):
+            return response
+
+        actions = []
+        for action in response.get("actions") or []:
+            result = results.get(action.get("tool_call_id"))
+            if result is not None:
+                action = {**action, "precomputed_result": result}
+            actions.append(action)
+        return {**response, "actions": actions}
+
+    def _shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
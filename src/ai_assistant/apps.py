@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class AiAssistantConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "ai_assistant"
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .limits import check_backend
+
+        check_backend()
@@ -0,0 +1,376 @@
+"""
+AI Response Cache
+
+Tenant-scoped cache for OpenRouter completions. Keys are built from a
+normalized prompt, a small slice of the conversation, the conversation
+summary and per-tenant data versions, so a cached reply is dropped as soon as the catalog or customer
+list it may describe changes. Identical requests that are still in flight
+are coalesced by SingleFlight.
+"""
+
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from typing import Dict, Any, Optional, Iterable
+from django.conf import settings
+from django.core.cache import cache
+
+from service_catalog.search import catalog_version_key
+from .action_executor import READ_ONLY_ACTIONS
+from .metrics import MetricsBatch
+
+logger = logging.getLogger(__name__)
+
+# Tenant data that AI replies can depend on; bumped by ai_assistant.signals,
+# the catalog by service_catalog.signals
+TENANT_VERSION_SCOPES = ("catalog", "customer")
+
+# Prepared actions also depend on the calendar (bookings and business hours)
+PREPARED_ACTION_SCOPES = ("catalog", "customer", "booking")
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION_RE = re.compile(r"[\s?!.,;:]+$")
+
+
+def _version_key(user_id: str, scope: str) -> str:
+    # One catalog version for the service name indexes and cached replies
+    if scope == "catalog":
+        return catalog_version_key(user_id)
+    return f"ai_tenant_version:{scope}:{user_id}"
+
+
+def get_tenant_versions(user_id: str, scopes: Iterable[str] = TENANT_VERSION_SCOPES) -> Dict[str, int]:
+    """Return the current data versions of a tenant, one per scope."""
+    keys = {scope: _version_key(user_id, scope) for scope in scopes}
+    stored = cache.get_many(list(keys.values()))
+    return {scope: stored.get(key, 0) for scope, key in keys.items()}
+
+
+def bump_tenant_version(user_id: str, scope: str):
+    """Invalidate cached AI replies that depend on ``scope`` data of a tenant."""
+    key = _version_key(user_id, scope)
+    try:
+        # Versions never expire; a lost key would only cost cache misses
+        cache.add(key, 0, None)
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+    except Exception as e:
+        logger.error(f"Failed to bump {scope} version for tenant {user_id}: {e}")
+
+
+def normalize_prompt(text: str) -> str:
+    """Collapse case, whitespace and trailing punctuation of a prompt."""
+    text = _WHITESPACE_RE.sub(" ", text.strip().lower())
+    return _TRAILING_PUNCTUATION_RE.sub("", text)
+
+
+class AIResponseCache:
+    """
+    Tenant-scoped cache for AI completions.
+    
+    Only replies without actions, or with read-only actions, are stored: the
+    actions of a cached reply are executed again on every hit, so a replayed
+    reply never repeats a write.
+    """
+    
+    def __init__(self):
+        self.settings = settings.AI_ASSISTANT_SETTINGS
+        self.ttl = self.settings["response_cache_ttl"]
+    
+    def build_key(
+        self, 
+        prompt: str, 
+        context: Dict[str, Any] = None,
+        system_prompt: str = None,
+        model: str = None
+    ) -> Optional[str]:
+        """
+        Build the cache key for a prompt, or None when it cannot be cached.
+        
+        Replies are only cached for turns that belong to a tenant.
+        """
+        context = context or {}
+        user_id = context.get("user_id")
+        if not user_id or not self.ttl:
+            return None
+        
+        key_data = {
+            "prompt": normalize_prompt(prompt),
+            "context": self._context_slice(prompt, context),
+            "versions": get_tenant_versions(user_id),
+            "system_prompt": hashlib.md5((system_prompt or "").encode()).hexdigest(),
+            "model": model,
+            "temperature": self.settings["temperature"],
+            "max_tokens": self.settings["max_tokens"]
+        }
+        digest = hashlib.sha256(
+            json.dumps(key_data, sort_keys=True, default=str).encode()
+        ).hexdigest()
+        return f"ai_response:{user_id}:{digest}"
+    
+    def _context_slice(self, prompt: str, context: Dict[str, Any]) -> Dict[str, Any]:
+        """The part of the conversation that can change the meaning of a prompt."""
+        history = list(context.get("message_history") or [])
+        
+        # The history already ends with the prompt being answered
+        if history and history[-1].get("sender_type") == "user" and history[-1].get("content") == prompt:
+            history = history[:-1]
+        
+        size = self.settings.get("response_cache_context_messages", 2)
+        recent = history[-size:] if size else []
+        
+        return {
+            "messages": [
+                [msg.get("sender_type"), normalize_prompt(msg.get("content", ""))]
+                for msg in recent
+            ],
+            # Older turns reach the prompt through the summary
+            "summary": hashlib.md5((context.get("conversation_summary") or "").encode()).hexdigest(),
+            "workflow": context.get("active_workflow")
+        }
+    
+    def is_cacheable(self, result: Dict[str, Any]) -> bool:
+        """Whether a generated reply may be stored."""
+        if not result.get("success"):
+            return False
+        return all(
+            action.get("action") in READ_ONLY_ACTIONS
+            for action in result.get("actions", [])
+        )
+    
+    def get(self, key: Optional[str], metrics: MetricsBatch = None) -> Optional[Dict[str, Any]]:
+        if not key:
+            return None
+        return self._record(cache.get(key), metrics)
+    
+    def set(self, key: Optional[str], result: Dict[str, Any]):
+        if key and self.is_cacheable(result):
+            cache.set(key, result, self.ttl)
+    
+    async def aget(self, key: Optional[str], metrics: MetricsBatch = None) -> Optional[Dict[str, Any]]:
+        if not key:
+            return None
+        return self._record(await cache.aget(key), metrics)
+    
+    async def aset(self, key: Optional[str], result: Dict[str, Any]):
+        if key and self.is_cacheable(result):
+            await cache.aset(key, result, self.ttl)
+    
+    def _record(self, cached: Optional[Dict[str, Any]], metrics: MetricsBatch = None) -> Optional[Dict[str, Any]]:
+        """
+        Count a lookup and mark hits so callers can tell them apart.
+        
+        The count is added to ``metrics`` when given and written with the
+        call's other metrics; otherwise it is written right away.
+        """
+        batch = metrics or MetricsBatch()
+        batch.inc("ai_response_cache_lookups_total", result="hit" if cached else "miss")
+        if metrics is None:
+            batch.flush()
+        if cached:
+            cached = {**cached, "cached": True}
+        return cached
+
+
+class PreparedActionCache:
+    """
+    Work done ahead of time for actions awaiting user confirmation.
+    
+    When an action is proposed its expensive checks (conflicts, price quote,
+    resolved ids) are stored together with the tenant data versions they
+    were computed against. On confirmation the entry is only reused if none
+    of those versions changed, which costs a single cache round trip.
+    """
+    
+    KEY = "ai_prepared_action:{}"
+    
+    def __init__(self):
+        self.ttl = settings.AI_ASSISTANT_SETTINGS.get("prepared_action_ttl", 900)
+    
+    def versions(self, user_id: str) -> Dict[str, int]:
+        return get_tenant_versions(user_id, PREPARED_ACTION_SCOPES)
+    
+    def store(self, action_id: str, user_id: str, prepared: Dict[str, Any], versions: Dict[str, int]):
+        """
+        Store a prepared action.
+        
+        ``versions`` must be read before preparing, so a change made while
+        preparing invalidates the entry instead of being missed.
+        """
+        if not self.ttl:
+            return
+        try:
+            cache.set(self.KEY.format(action_id), {
+                "user_id": str(user_id),
+                "versions": versions,
+                "prepared": prepared
+            }, self.ttl)
+        except Exception as e:
+            logger.error(f"Failed to store prepared action {action_id}: {e}")
+    
+    def load(self, action_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """The prepared data of an action, or None if missing or stale."""
+        try:
+            entry = cache.get(self.KEY.format(action_id))
+        except Exception as e:
+            logger.error(f"Failed to load prepared action {action_id}: {e}")
+            return None
+        
+        if not entry or entry["user_id"] != str(user_id):
+            return None
+        if entry["versions"] != self.versions(user_id):
+            logger.info(f"Prepared action {action_id} is stale, revalidating in full")
+            return None
+        return entry["prepared"]
+    
+    def discard(self, action_id: str):
+        try:
+            cache.delete(self.KEY.format(action_id))
+        except Exception as e:
+            logger.debug(f"Failed to discard prepared action {action_id}: {e}")
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight OpenRouter requests across processes.
+    
+    The first caller for a request fingerprint takes a lock and makes the
+    upstream call; duplicates (double clicks, retries after a reconnect, the
+    HTTP and WebSocket paths at once) poll for its result instead. If the
+    leader fails or the wait times out, followers make their own call.
+    
+    Followers get the leader's reply without its write actions: the
+    leader's turn runs those, and running them again from a double send
+    would create a second booking or customer.
+    """
+    
+    LOCK_KEY = "ai_inflight:{}"
+    RESULT_KEY = "ai_inflight_result:{}"
+    
+    # Followers poll quickly at first, then back off
+    POLL_INITIAL = 0.05
+    POLL_MAX = 0.5
+    
+    # Long enough for every follower to see the result once the lock is gone
+    RESULT_TTL = 30
+    
+    def __init__(self):
+        self.settings = settings.AI_ASSISTANT_SETTINGS
+        self.timeout = self.settings.get("single_flight_timeout", 60)
+    
+    def fingerprint(self, payload: Dict[str, Any], user_id: str = None) -> Optional[str]:
+        """
+        Fingerprint of a completion request, or None when coalescing is off.
+        
+        Streaming options are left out so streamed and plain requests for
+        the same messages share one upstream call.
+        """
+        if not self.timeout:
+            return None
+        
+        key_data = {key: value for key, value in payload.items() if key not in ("stream", "usage")}
+        key_data["user_id"] = user_id
+        return hashlib.sha256(
+            json.dumps(key_data, sort_keys=True, default=str).encode()
+        ).hexdigest()
+    
+    def acquire(self, fingerprint: Optional[str]) -> bool:
+        """Whether this caller should make the upstream call itself."""
+        if not fingerprint:
+            return True
+        try:
+            return cache.add(self.LOCK_KEY.format(fingerprint), 1, self.timeout)
+        except Exception as e:
+            logger.error(f"Failed to take in-flight lock: {e}")
+            return True
+    
+    async def aacquire(self, fingerprint: Optional[str]) -> bool:
+        if not fingerprint:
+            return True
+        try:
+            return await cache.aadd(self.LOCK_KEY.format(fingerprint), 1, self.timeout)
+        except Exception as e:
+            logger.error(f"Failed to take in-flight lock: {e}")
+            return True
+    
+    def wait(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """Wait for the leader's result; None means the caller should call upstream."""
+        deadline = time.monotonic() + self.timeout
+        delay = self.POLL_INITIAL
+        
+        while time.monotonic() < deadline:
+            time.sleep(delay)
+            try:
+                found = cache.get_many(self._keys(fingerprint))
+            except Exception as e:
+                logger.error(f"Failed to poll in-flight request: {e}")
+                return None
+            
+            result = self._result(fingerprint, found)
+            if result is not None or self.LOCK_KEY.format(fingerprint) not in found:
+                return result
+            delay = min(delay * 2, self.POLL_MAX)
+        
+        return None
+    
+    async def await_result(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """Async counterpart of ``wait``."""
+        deadline = time.monotonic() + self.timeout
+        delay = self.POLL_INITIAL
+        
+        while time.monotonic() < deadline:
+            await asyncio.sleep(delay)
+            try:
+                found = await cache.aget_many(self._keys(fingerprint))
+            except Exception as e:
+                logger.error(f"Failed to poll in-flight request: {e}")
+                return None
+            
+            result = self._result(fingerprint, found)
+            if result is not None or self.LOCK_KEY.format(fingerprint) not in found:
+                return result
+            delay = min(delay * 2, self.POLL_MAX)
+        
+        return None
+    
+    def publish(self, fingerprint: Optional[str], result: Optional[Dict[str, Any]]):
+        """Hand a successful result to waiting followers and release the lock."""
+        if not fingerprint:
+            return
+        try:
+            if result and result.get("success"):
+                cache.set(self.RESULT_KEY.format(fingerprint), result, self.RESULT_TTL)
+            cache.delete(self.LOCK_KEY.format(fingerprint))
+        except Exception as e:
+            logger.error(f"Failed to publish in-flight result: {e}")
+    
+    async def apublish(self, fingerprint: Optional[str], result: Optional[Dict[str, Any]]):
+        if not fingerprint:
+            return
+        try:
+            if result and result.get("success"):
+                await cache.aset(self.RESULT_KEY.format(fingerprint), result, self.RESULT_TTL)
+            await cache.adelete(self.LOCK_KEY.format(fingerprint))
+        except Exception as e:
+            logger.error(f"Failed to publish in-flight result: {e}")
+    
+    def _keys(self, fingerprint: str):
+        return [self.LOCK_KEY.format(fingerprint), self.RESULT_KEY.format(fingerprint)]
+    
+    def _result(self, fingerprint: str, found: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        result = found.get(self.RESULT_KEY.format(fingerprint))
+        if result is not None:
+            logger.info("Joined an identical in-flight AI request")
+            actions = result.get("actions") or []
+            read_only = [action for action in actions if action.get("action") in READ_ONLY_ACTIONS]
+            result = {
+                **result,
+                "actions": read_only,
+                "coalesced": True,
+                "skipped_write_actions": len(actions) - len(read_only)
+            }
+        return result
@@ -0,0 +1,130 @@
+"""
+Model Cascade
+
+Picks the cheapest tier that can answer a turn. The intent router answers
+simple reads without any model; the local entity extractor then decides
+whether the rest of the turn needs action planning. Only turns that do are
+sent to ``OPENROUTER_MODEL``; conversational turns ("thanks!", "what do you
+mean?") go to ``OPENROUTER_LIGHT_MODEL`` with a short system prompt. The
+light model hands a turn up by replying with ``ESCALATE_TOKEN`` alone.
+"""
+
+import re
+from typing import Dict, Any, List, Optional, Tuple
+from django.conf import settings
+
+TIER_ROUTER = "router"
+TIER_LIGHT = "light"
+TIER_FULL = "full"
+
+ESCALATE_TOKEN = "ESCALATE"
+
+LIGHT_SYSTEM_PROMPT = f"""You are the assistant of a service-based and equipment scheduling business, answering the owner in a chat.
+
+Reply briefly and naturally to greetings, thanks, acknowledgements and questions about what was just said. You cannot look anything up or change anything.
+
+If the message asks for or depends on anything in the calendar, bookings, customers, services, equipment or prices, or gives details for such a change, reply with exactly {ESCALATE_TOKEN} and nothing else."""
+
+# Messages that are nothing but a greeting, thanks or acknowledgement
+_SMALLTALK_RE = re.compile(
+    r"^(?:(?:hi|hello|hey|thanks|thank\s+you|thx|ty|cheers|ok|okay|k|cool|great|nice|"
+    r"perfect|awesome|got\s+it|sounds\s+good|good\s+(?:morning|afternoon|evening)|"
+    r"bye|goodbye|see\s+you|no\s+problem|np)[\s,.!]*)+(?:so\s+much|a\s+lot|again)?[\s.!]*$",
+    re.IGNORECASE
+)
+# Entity types that always mean the turn is about an action. Person names are
+# checked after small talk, since capitalized words like "Thanks" match them
+_PLANNING_ENTITY_TYPES = {"action", "date", "equipment"}
+# Prices, times, quantities and phone numbers are details for an action
+_DETAIL_RE = re.compile(r"\d|@|\$|€|£")
+
+
+class TurnClassifier:
+    """
+    Decides with local rules whether a turn needs the full model.
+
+    Conservative by design: a turn goes to the light tier only when it is
+    small talk, or has no entities, no details and no workflow in progress.
+    Replies to a question of the assistant always go to the full model
+    ("ok" to "Shall I book it?" must reach the planner).
+    """
+
+    def __init__(self):
+        self.settings = settings.AI_ASSISTANT_SETTINGS
+        self.enabled = self.settings.get("cascade_enabled", True) and bool(self.light_model)
+        self.max_words = self.settings.get("cascade_light_max_words", 12)
+
+    @property
+    def light_model(self) -> Optional[str]:
+        return getattr(settings, "OPENROUTER_LIGHT_MODEL", None)
+
+    def classify(
+        self,
+        message_content: str,
+        entities: List[Dict[str, Any]],
+        context: Dict[str, Any] = None
+    ) -> Tuple[str, str]:
+        """
+        Choose the tier of an LLM turn.
+
+        Args:
+            message_content: User's message content
+            entities: Output of EntityExtractionService for the message
+            context: Conversation context of the turn
+
+        Returns:
+            Tuple of (tier, reason)
+        """
+        context = context or {}
+
+        if not self.enabled:
+            return TIER_FULL, "cascade_disabled"
+        if context.get("active_workflow"):
+            return TIER_FULL, "active_workflow"
+        if any(entity["type"] in _PLANNING_ENTITY_TYPES for entity in entities):
+            return TIER_FULL, "entities"
+        if self._answers_question(context):
+            return TIER_FULL, "answers_question"
+        if _SMALLTALK_RE.match(message_content.strip()):
+            return TIER_LIGHT, "smalltalk"
+        if entities:
+            return TIER_FULL, "entities"
+        if _DETAIL_RE.search(message_content):
+            return TIER_FULL, "details"
+        if len(message_content.split()) > self.max_words:
+            return TIER_FULL, "long_message"
+        return TIER_LIGHT, "no_action_entities"
+
+    def _answers_question(self, context: Dict[str, Any]) -> bool:
+        """Whether the previous AI message asked the user something."""
+        for message in reversed(context.get("message_history") or []):
+            if message.get("sender_type") == "ai":
+                return message.get("content", "").rstrip().endswith("?")
+        return False
+
+
+def needs_escalation(light_response: Dict[str, Any]) -> bool:
+    """Whether a light tier reply hands the turn to the full model."""
+    if not light_response.get("success") or light_response.get("actions"):
+        return True
+    text = light_response.get("response_text", "").strip()
+    return not text or text.upper().startswith(ESCALATE_TOKEN)
+
+
+def annotate_routing(
+    response: Dict[str, Any],
+    tier: str,
+    reason: str,
+    tier_latency_ms: Dict[str, int],
+    escalated_tokens: int = 0
+) -> Dict[str, Any]:
+    """Copy of ``response`` carrying the routing decision of the turn."""
+    return {
+        **response,
+        "tokens_used": (response.get("tokens_used") or 0) + escalated_tokens,
+        "routing": {
+            "tier": tier,
+            "reason": reason,
+            "tier_latency_ms": tier_latency_ms
+        }
+    }
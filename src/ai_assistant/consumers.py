@@ -2,22 +2,24 @@
 WebSocket Consumer for AI Assistant Chat
 
 This module handles real-time WebSocket connections for the AI assistant chat functionality,
-including authentication, message processing, and real-time communication.
+including authentication, message processing, and real-time communication. Frames follow
+the protocol version negotiated at connect time (see ``ai_assistant.protocol``).
 """
 
-import json
 import logging
-from typing import Dict, Any, Optional
+import itertools
+from typing import Dict, Any, List, Optional
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
 from django.conf import settings
 from django.utils import timezone
-import jwt
 
-from users.authentication import SupabaseUser
-from .services import AIAssistantService
+from users.authentication import SupabaseUser, authenticate_token
+from .services import AIAssistantService, chat_group_name, parse_confirmation
+from .history import load_history
 from .models import ChatSession, ChatMessage
+from .protocol import FrameCodec, FrameDecodeError
 
 logger = logging.getLogger(__name__)
 
@@ -34,35 +36,45 @@ class ChatConsumer(AsyncWebsocketConsumer):
         self.session_id = None
         self.ai_service = AIAssistantService()
         self.authenticated = False
+        self.group_name = None
+        self.codec = FrameCodec()
         
     async def connect(self):
         """Handle WebSocket connection."""
         # Get session ID from URL if provided
         self.session_id = self.scope.get('url_route', {}).get('kwargs', {}).get('session_id')
         
+        # Pick the frame protocol from the subprotocols the client offered
+        self.codec = FrameCodec.negotiate(self.scope.get('subprotocols', []))
+        
         # Accept connection first (authentication happens after)
-        await self.accept()
+        await self.accept(subprotocol=self.codec.subprotocol)
         
         # Send connection confirmation
-        await self.send(text_data=json.dumps({
+        await self._send_event({
             'type': 'connection.established',
             'message': 'Connected to AI Assistant. Please authenticate.',
+            'protocol': self.codec.version,
+            'encoding': self.codec.encoding,
             'timestamp': timezone.now().isoformat()
-        }))
+        })
         
         logger.info(f"WebSocket connection established from {self.scope.get('client', ['unknown'])[0]}")
     
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection."""
+        if self.group_name and self.channel_layer:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        
         if self.authenticated and self.user:
             logger.info(f"WebSocket disconnected for user {self.user.id}, code: {close_code}")
         else:
             logger.info(f"Unauthenticated WebSocket disconnected, code: {close_code}")
     
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         """Handle incoming WebSocket messages."""
         try:
-            data = json.loads(text_data)
+            data = FrameCodec.decode(text_data, bytes_data)
             message_type = data.get('type', 'unknown')
             
             # Handle different message types
@@ -79,8 +91,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
             else:
                 await self._send_error(f"Unknown message type: {message_type}")
                 
-        except json.JSONDecodeError:
-            await self._send_error("Invalid JSON format")
+        except FrameDecodeError:
+            await self._send_error("Invalid message format")
         except Exception as e:
             logger.error(f"Error processing WebSocket message: {e}")
             await self._send_error("Internal server error")
@@ -101,13 +113,18 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 self.user = user
                 self.authenticated = True
                 
-                await self.send(text_data=json.dumps({
+                # Queued turns are delivered to every socket of the user through this group
+                if self.channel_layer and not self.group_name:
+                    self.group_name = chat_group_name(user.id)
+                    await self.channel_layer.group_add(self.group_name, self.channel_name)
+                
+                await self._send_event({
                     'type': 'authentication.success',
                     'message': 'Successfully authenticated',
                     'user_id': user.id,
                     'session_id': self.session_id,
                     'timestamp': timezone.now().isoformat()
-                }))
+                })
                 
                 logger.info(f"WebSocket authenticated for user {user.id}")
             else:
@@ -128,92 +145,129 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self._send_error("Message content cannot be empty")
             return
         
+        # Stream tokens unless the client opted out
+        stream = data.get('stream', settings.AI_ASSISTANT_SETTINGS.get('stream_responses', True))
+        
+        if settings.AI_ASSISTANT_SETTINGS.get('execution_mode') == 'celery':
+            await self._enqueue_ai_message(message_content, stream)
+            return
+        
         # Send typing indicator
-        await self.send(text_data=json.dumps({
-            'type': 'ai.typing',
-            'status': True,
-            'timestamp': timezone.now().isoformat()
-        }))
+        await self._send_typing(True)
         
         try:
             # Process message with AI service
-            result = await self._process_ai_message(message_content)
+            result = await self._process_ai_message(message_content, stream)
             
-            # Send typing indicator off
-            await self.send(text_data=json.dumps({
-                'type': 'ai.typing',
-                'status': False,
-                'timestamp': timezone.now().isoformat()
-            }))
-            
-            if result['success']:
-                # Send AI response
-                await self.send(text_data=json.dumps({
-                    'type': 'chat.response',
-                    'message': result['response_text'],
-                    'user_message_id': result['user_message_id'],
-                    'ai_message_id': result['ai_message_id'],
-                    'session_id': result['session_id'],
-                    'timestamp': timezone.now().isoformat(),
-                    'metadata': {
-                        'processing_time_ms': result.get('processing_time_ms', 0),
-                        'entities': result.get('entities', []),
-                        'actions_count': len(result.get('actions', []))
-                    }
-                }))
-                
-                # Send action feedback if any actions were performed
-                if result.get('actions'):
-                    for action in result['actions']:
-                        await self.send(text_data=json.dumps({
-                            'type': 'action.feedback',
-                            'action_id': action.get('action_id'),
-                            'status': action.get('status'),
-                            'message': action.get('message', ''),
-                            'result': action.get('result'),
-                            'timestamp': timezone.now().isoformat()
-                        }))
-                        
-                        # Send ai.action.completed event for successful actions
-                        if action.get('status') == 'completed':
-                            await self.send(text_data=json.dumps({
-                                'type': 'ai.action.completed',
-                                'action_id': action.get('action_id'),
-                                'action_type': action.get('action_type'),
-                                'result': action.get('result'),
-                                'timestamp': timezone.now().isoformat()
-                            }))
-                        
-                        # Send ai.action.failed event for failed actions
-                        elif action.get('status') == 'failed':
-                            await self.send(text_data=json.dumps({
-                                'type': 'ai.action.failed',
-                                'action_id': action.get('action_id'),
-                                'action_type': action.get('action_type'),
-                                'error': action.get('message', 'Action failed'),
-                                'timestamp': timezone.now().isoformat()
-                            }))
-            else:
-                await self._send_error(result.get('error', 'Failed to process message'))
+            # Typing indicator off goes out with the result
+            await self._send_turn_result(result)
                 
         except Exception as e:
             logger.error(f"Error processing chat message: {e}")
             
-            # Send typing indicator off
-            await self.send(text_data=json.dumps({
-                'type': 'ai.typing',
-                'status': False,
-                'timestamp': timezone.now().isoformat()
-            }))
+            await self._send_events([
+                self._typing_event(False),
+                self._error_event("Failed to process your message. Please try again.")
+            ])
+    
+    async def _enqueue_ai_message(self, message_content: str, stream: bool):
+        """Hand the turn to the ai_processing queue; the reply arrives via the chat group."""
+        result = await database_sync_to_async(self.ai_service.enqueue_message)(
+            self.user, message_content, self.session_id, stream=stream
+        )
+        
+        if not result['success']:
+            await self._send_error(result.get('error', 'Failed to process message'))
+            return
+        
+        await self._send_event({
+            'type': 'chat.queued',
+            'user_message_id': result['user_message_id'],
+            'session_id': result['session_id'],
+            'task_id': result['task_id'],
+            'timestamp': timezone.now().isoformat()
+        })
+        await self._send_typing(True)
+    
+    async def _send_event(self, event: Dict[str, Any]):
+        """Send a single event frame in the connection's encoding."""
+        await self.send(**self.codec.encode(event))
+    
+    async def _send_events(self, events: List[Dict[str, Any]]):
+        """Send the events of one turn; batched into one frame from protocol version 2."""
+        for frame in self.codec.frames(events):
+            await self.send(**frame)
+    
+    def _typing_event(self, status: bool) -> Dict[str, Any]:
+        return {'type': 'ai.typing', 'status': status}
+    
+    def _error_event(self, error_message: str) -> Dict[str, Any]:
+        return {'type': 'error', 'error': error_message}
+    
+    async def _send_typing(self, status: bool):
+        """Send the AI typing indicator."""
+        await self._send_events([self._typing_event(status)])
+    
+    async def _send_turn_result(self, result: Dict[str, Any]):
+        """Send the outcome of a chat turn with per-action feedback, ending the typing indicator."""
+        events = [self._typing_event(False)]
+        
+        if not result['success']:
+            events.append(self._error_event(result.get('error', 'Failed to process message')))
+            await self._send_events(events)
+            return
+        
+        # AI response
+        events.append({
+            'type': 'chat.response',
+            'message': result['response_text'],
+            'user_message_id': result['user_message_id'],
+            'ai_message_id': result['ai_message_id'],
+            'session_id': result['session_id'],
+            'metadata': {
+                'processing_time_ms': result.get('processing_time_ms', 0),
+                'phase_ms': result.get('phase_ms', {}),
+                'entities': result.get('entities', []),
+                'actions_count': len(result.get('actions', []))
+            }
+        })
+        
+        # Action feedback for every action performed
+        for action in result.get('actions') or []:
+            events.append({
+                'type': 'action.feedback',
+                'action_id': action.get('action_id'),
+                'status': action.get('status'),
+                'message': action.get('message', ''),
+                'result': action.get('result')
+            })
+            
+            # ai.action.completed event for successful actions
+            if action.get('status') == 'completed':
+                events.append({
+                    'type': 'ai.action.completed',
+                    'action_id': action.get('action_id'),
+                    'action_type': action.get('action_type'),
+                    'result': action.get('result')
+                })
             
-            await self._send_error("Failed to process your message. Please try again.")
+            # ai.action.failed event for failed actions
+            elif action.get('status') == 'failed':
+                events.append({
+                    'type': 'ai.action.failed',
+                    'action_id': action.get('action_id'),
+                    'action_type': action.get('action_type'),
+                    'error': action.get('message', 'Action failed')
+                })
+        
+        await self._send_events(events)
     
     async def _handle_ping(self, data: Dict[str, Any]):
         """Handle ping messages for keepalive."""
-        await self.send(text_data=json.dumps({
+        await self._send_event({
             'type': 'pong',
             'timestamp': timezone.now().isoformat()
-        }))
+        })
     
     async def _handle_get_history(self, data: Dict[str, Any]):
         """Handle chat history requests."""
@@ -224,16 +278,19 @@ class ChatConsumer(AsyncWebsocketConsumer):
         try:
             limit = min(data.get('limit', 50), 100)  # Max 100 messages
             session_id = data.get('session_id', self.session_id)
+            before_id = data.get('before_id')  # Older pages: id of the oldest message held
             
-            history = await self._get_chat_history(self.user.id, session_id, limit)
+            history, has_more = await self._get_chat_history(self.user.id, session_id, limit, before_id)
             
-            await self.send(text_data=json.dumps({
+            await self._send_event({
                 'type': 'chat.history',
                 'messages': history,
                 'session_id': session_id,
                 'count': len(history),
+                'has_more': has_more,
+                'next_before_id': history[0]['id'] if has_more and history else None,
                 'timestamp': timezone.now().isoformat()
-            }))
+            })
             
         except Exception as e:
             logger.error(f"Error retrieving chat history: {e}")
@@ -246,23 +303,37 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return
         
         action_id = data.get('action_id')
-        confirmed = data.get('confirmed', False)
         
         if not action_id:
             await self._send_error("Action ID required for confirmation")
             return
         
         try:
-            # TODO: Implement action confirmation logic
-            # This would involve finding the pending action and executing it if confirmed
+            confirmed = parse_confirmation(data.get('confirmed'))
+        except ValueError:
+            await self._send_error("confirmed must be true or false")
+            return
+        
+        try:
+            result = await database_sync_to_async(self.ai_service.confirm_action)(
+                self.user, action_id, confirmed
+            )
+            
+            if not result.get('success') and not result.get('status'):
+                await self._send_error(result.get('error', 'Failed to process action confirmation'))
+                return
             
-            await self.send(text_data=json.dumps({
+            await self._send_event({
                 'type': 'action.confirmed',
                 'action_id': action_id,
                 'confirmed': confirmed,
-                'message': f"Action {'confirmed' if confirmed else 'cancelled'}",
+                'success': result['success'],
+                'status': result['status'],
+                'message': result.get('message', f"Action {'confirmed' if confirmed else 'cancelled'}"),
+                'result': result.get('result'),
+                'error': result.get('error'),
                 'timestamp': timezone.now().isoformat()
-            }))
+            })
             
         except Exception as e:
             logger.error(f"Error handling action confirmation: {e}")
@@ -270,81 +341,71 @@ class ChatConsumer(AsyncWebsocketConsumer):
     
     async def _authenticate_token(self, token: str) -> Optional[SupabaseUser]:
         """Authenticate user using Supabase JWT token."""
-        try:
-            # Decode JWT token
-            jwt_secret = settings.SUPABASE_JWT_SECRET
-            if not jwt_secret:
-                logger.error("Supabase JWT secret not configured")
-                return None
-            
-            payload = jwt.decode(
-                token,
-                jwt_secret,
-                algorithms=['HS256'],
-                audience='authenticated',
-                options={
-                    'verify_signature': True,
-                    'verify_exp': True,
-                    'verify_aud': True,
-                    'require_exp': True,
-                    'require_iat': True,
-                    'require_sub': True
-                }
-            )
-            
-            # Create SupabaseUser instance
-            user = SupabaseUser(payload)
-            return user
-            
-        except jwt.ExpiredSignatureError:
-            logger.warning("Expired JWT token in WebSocket authentication")
-            return None
-        except jwt.InvalidTokenError as e:
-            logger.warning(f"Invalid JWT token in WebSocket authentication: {e}")
-            return None
-        except Exception as e:
-            logger.error(f"Unexpected error in WebSocket authentication: {e}")
-            return None
+        return authenticate_token(token)
     
-    @database_sync_to_async
-    def _process_ai_message(self, message_content: str) -> Dict[str, Any]:
-        """Process message through AI service (database sync to async)."""
-        return self.ai_service.process_message(
+    async def _process_ai_message(self, message_content: str, stream: bool = False) -> Dict[str, Any]:
+        """Process message through the async AI pipeline."""
+        delta_index = itertools.count()
+        
+        async def on_delta(text: str):
+            await self._send_delta(text, next(delta_index))
+        
+        return await self.ai_service.aprocess_message(
             self.user, 
             message_content, 
-            self.session_id
+            self.session_id,
+            on_delta=on_delta if stream else None
         )
     
+    async def _send_delta(self, text: str, index: int):
+        """Forward a chunk of streamed AI response text to the client."""
+        await self._send_event({
+            'type': 'chat.delta',
+            'delta': text,
+            'index': index,
+            'timestamp': timezone.now().isoformat()
+        })
+    
     @database_sync_to_async
-    def _get_chat_history(self, user_id: str, session_id: str = None, limit: int = 50) -> list:
-        """Get chat history (database sync to async)."""
-        return self.ai_service.get_chat_history(user_id, session_id, limit)
+    def _get_chat_history(self, user_id: str, session_id: str = None, limit: int = 50, before_id: int = None) -> tuple:
+        """Get a page of chat history and whether older messages exist (database sync to async)."""
+        return load_history(user_id, session_id, limit=limit, before_id=before_id)
     
     async def _send_error(self, error_message: str):
         """Send error message to client."""
-        await self.send(text_data=json.dumps({
-            'type': 'error',
-            'error': error_message,
-            'timestamp': timezone.now().isoformat()
-        }))
+        await self._send_events([self._error_event(error_message)])
     
     # Group messaging methods (for future use with multiple users)
     
     async def chat_message(self, event):
         """Handle chat message from group."""
-        await self.send(text_data=json.dumps({
+        await self._send_event({
             'type': 'chat.message',
             'message': event['message'],
             'sender': event.get('sender', 'system'),
             'timestamp': event.get('timestamp', timezone.now().isoformat())
-        }))
+        })
+    
+    async def chat_turn_delta(self, event):
+        """Forward a streamed chunk of a queued turn from the worker."""
+        await self._send_event({
+            'type': 'chat.delta',
+            'delta': event['delta'],
+            'index': event['index'],
+            'user_message_id': event['user_message_id'],
+            'timestamp': timezone.now().isoformat()
+        })
+    
+    async def chat_turn_result(self, event):
+        """Forward the final result of a queued turn from the worker."""
+        await self._send_turn_result(event['result'])
     
     async def notification(self, event):
         """Handle notification from group."""
-        await self.send(text_data=json.dumps({
+        await self._send_event({
             'type': 'notification',
             'title': event.get('title', 'Notification'),
             'message': event['message'],
             'level': event.get('level', 'info'),
             'timestamp': event.get('timestamp', timezone.now().isoformat())
-        }))
\ No newline at end of file
+        })
\ No newline at end of file
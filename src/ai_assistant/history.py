@@ -0,0 +1,303 @@
+"""
+Chat History
+
+Recent messages of every active session are kept in a bounded Redis ring
+buffer, written by ``ai_assistant.signals`` when a message is saved. History
+reads for context building, the history endpoints and the WebSocket
+``get_history`` handler are answered from the buffer when it holds the
+requested page, and fall back to a keyset-paginated (``before_id``) query
+otherwise. A session's buffer is seeded from the database on the first read
+that misses it.
+
+Each buffer records a floor: every message of the session with an id at or
+above it is in the buffer. Pages that reach below the floor go to the
+database. Buffers expire with the session's inactivity.
+"""
+
+import json
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+from django.conf import settings
+
+from .models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "ai_history"
+
+# Shared by writes and seeds: drop the oldest entries over capacity and
+# raise the floor to the oldest remaining id
+_TRIM = """
+local excess = redis.call('ZCARD', KEYS[1]) - capacity
+if excess > 0 then
+    local dropped = redis.call('ZRANGE', KEYS[1], 0, excess - 1)
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, excess - 1)
+    redis.call('HDEL', KEYS[2], unpack(dropped))
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0)[1]
+    if oldest and redis.call('EXISTS', KEYS[3]) == 1 then
+        local floor = tonumber(redis.call('HGET', KEYS[3], 'floor') or '0')
+        if tonumber(oldest) > floor then
+            redis.call('HSET', KEYS[3], 'floor', oldest)
+        end
+    end
+end
+for i = 1, 3 do
+    redis.call('EXPIRE', KEYS[i], ttl)
+end
+"""
+
+# Writes always apply, so a message committed while a reader seeds the
+# buffer is never lost; seeds never overwrite what writes stored
+WRITE_SCRIPT = """
+local capacity, ttl = tonumber(ARGV[3]), tonumber(ARGV[4])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+redis.call('ZADD', KEYS[1], tonumber(ARGV[1]), ARGV[1])
+""" + _TRIM
+
+SEED_SCRIPT = """
+local capacity, ttl = tonumber(ARGV[3]), tonumber(ARGV[4])
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    return 0
+end
+for i = 5, #ARGV, 2 do
+    if redis.call('HSETNX', KEYS[2], ARGV[i], ARGV[i + 1]) == 1 then
+        redis.call('ZADD', KEYS[1], tonumber(ARGV[i]), ARGV[i])
+    end
+end
+redis.call('HSET', KEYS[3], 'floor', ARGV[1], 'user_id', ARGV[2])
+""" + _TRIM + """
+return 1
+"""
+
+# Returns floor, owner and the newest limit + 1 entries in [min_id, max_id)
+READ_SCRIPT = """
+local meta = redis.call('HMGET', KEYS[3], 'floor', 'user_id')
+if not meta[1] then
+    return nil
+end
+local floor = tonumber(meta[1])
+local min_id = math.max(floor, tonumber(ARGV[1]))
+local max_id = ARGV[2] == '+inf' and '+inf' or '(' .. ARGV[2]
+local ids = redis.call('ZREVRANGEBYSCORE', KEYS[1], max_id, min_id, 'LIMIT', 0, tonumber(ARGV[3]) + 1)
+for i = 1, 3 do
+    redis.call('EXPIRE', KEYS[i], tonumber(ARGV[4]))
+end
+local entries = {}
+if #ids > 0 then
+    entries = redis.call('HMGET', KEYS[2], unpack(ids))
+end
+return {meta[1], meta[2], entries}
+"""
+
+_scripts = {}
+_scripts_lock = threading.Lock()
+
+
+def _get_redis():
+    from django_redis import get_redis_connection
+    return get_redis_connection("default")
+
+
+def _script(client, source: str):
+    with _scripts_lock:
+        key = (id(client), source)
+        script = _scripts.get(key)
+        if script is None:
+            script = _scripts[key] = client.register_script(source)
+        return script
+
+
+def serialize_message(message: ChatMessage) -> Dict[str, Any]:
+    """History entry of a message, as stored in the buffer."""
+    return {
+        "id": message.id,
+        "session_id": str(message.session_id) if message.session_id else None,
+        "sender_type": message.sender_type,
+        "content": message.content,
+        "status": message.status,
+        "timestamp": message.timestamp.isoformat(),
+        "entities": message.entities_extracted,
+        "metadata": message.metadata
+    }
+
+
+class SessionHistoryBuffer:
+    """
+    Bounded per-session buffer of recent chat messages in Redis.
+
+    All operations fail open: when Redis is unavailable writes are skipped
+    and reads return None so callers use the database.
+    """
+
+    def __init__(self):
+        self.settings = settings.AI_ASSISTANT_SETTINGS
+        self.capacity = self.settings.get("history_buffer_size", 50)
+        self.ttl = self.settings.get("history_buffer_ttl", 86400)
+
+    def _keys(self, session_id: str) -> List[str]:
+        return [
+            f"{KEY_PREFIX}:{session_id}:ids",
+            f"{KEY_PREFIX}:{session_id}:messages",
+            f"{KEY_PREFIX}:{session_id}:meta",
+        ]
+
+    def record(self, message: ChatMessage):
+        """Store a saved message, replacing an earlier version of it."""
+        if not message.session_id or self.capacity <= 0:
+            return
+        keys = self._keys(message.session_id)
+        try:
+            client = _get_redis()
+            _script(client, WRITE_SCRIPT)(
+                keys=keys,
+                args=[message.id, json.dumps(serialize_message(message)), self.capacity, self.ttl],
+                client=client
+            )
+        except Exception as e:
+            logger.error(f"Failed to buffer message {message.id} of session {message.session_id}: {e}")
+            # A buffer missing a committed message must not answer reads
+            self.drop_session(message.session_id)
+
+    def forget(self, message: ChatMessage):
+        """Remove a deleted message."""
+        if not message.session_id:
+            return
+        ids_key, messages_key, _ = self._keys(message.session_id)
+        try:
+            client = _get_redis()
+            pipeline = client.pipeline()
+            pipeline.zrem(ids_key, message.id)
+            pipeline.hdel(messages_key, message.id)
+            pipeline.execute()
+        except Exception as e:
+            logger.error(f"Failed to remove message {message.id} from its history buffer: {e}")
+            self.drop_session(message.session_id)
+
+    def start_session(self, session_id: str, user_id: str):
+        """Create the empty buffer of a new session, so it never needs seeding."""
+        self.seed(session_id, user_id, [], floor=0)
+
+    def seed(self, session_id: str, user_id: str, entries: List[Dict[str, Any]], floor: int) -> bool:
+        """
+        Create a session's buffer from database rows, unless it already exists.
+
+        ``floor`` must be the lowest id from which ``entries`` hold every
+        message of the session (0 when they are the whole session).
+        """
+        if self.capacity <= 0:
+            return False
+        args = [floor, str(user_id), self.capacity, self.ttl]
+        for entry in entries:
+            args.extend([entry["id"], json.dumps(entry)])
+        try:
+            client = _get_redis()
+            return bool(_script(client, SEED_SCRIPT)(keys=self._keys(session_id), args=args, client=client))
+        except Exception as e:
+            logger.error(f"Failed to seed history buffer of session {session_id}: {e}")
+            return False
+
+    def drop_session(self, session_id: str):
+        """Delete a session's buffer."""
+        try:
+            _get_redis().delete(*self._keys(session_id))
+        except Exception as e:
+            logger.error(f"Failed to drop history buffer of session {session_id}: {e}")
+
+    def read(
+        self,
+        session_id: str,
+        user_id: str,
+        limit: int,
+        after_id: int = 0,
+        before_id: int = None
+    ) -> Optional[Tuple[List[Dict[str, Any]], bool]]:
+        """
+        The newest ``limit`` messages with ``after_id < id < before_id``.
+
+        Returns:
+            Tuple of (messages oldest first, whether older messages exist),
+            or None when the buffer is missing or does not hold the page
+        """
+        if self.capacity <= 0:
+            return None
+        try:
+            client = _get_redis()
+            result = _script(client, READ_SCRIPT)(
+                keys=self._keys(session_id),
+                args=[after_id + 1, before_id if before_id else "+inf", limit, self.ttl],
+                client=client
+            )
+        except Exception as e:
+            logger.error(f"Failed to read history buffer of session {session_id}: {e}")
+            return None
+
+        if result is None:
+            return None
+
+        floor, owner, raw_entries = result
+        floor = int(floor)
+        if isinstance(owner, bytes):
+            owner = owner.decode()
+        if owner != str(user_id):
+            # The database would not return another user's session either
+            return [], False
+
+        entries = [json.loads(entry) for entry in raw_entries if entry]
+        reaches_floor = floor <= after_id + 1
+        if len(entries) < limit and not reaches_floor:
+            return None
+
+        has_more = len(entries) > limit or not reaches_floor
+        page = entries[:limit]
+        page.reverse()
+        return page, has_more
+
+
+def load_history(
+    user_id: str,
+    session_id: str = None,
+    limit: int = 50,
+    before_id: int = None,
+    after_id: int = 0
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    A page of chat history, newest ``limit`` messages before ``before_id``.
+
+    Session pages come from the session's history buffer when it holds
+    them; other pages are read with a keyset query. A session read that
+    finds no buffer seeds it.
+
+    Returns:
+        Tuple of (messages oldest first, whether older messages exist)
+    """
+    buffer = SessionHistoryBuffer()
+
+    if session_id:
+        buffered = buffer.read(session_id, user_id, limit, after_id, before_id)
+        if buffered is not None:
+            return buffered
+
+    query = ChatMessage.objects.filter(user_id=user_id)
+    if session_id:
+        query = query.filter(session_id=session_id)
+    if after_id:
+        query = query.filter(id__gt=after_id)
+    if before_id:
+        query = query.filter(id__lt=before_id)
+
+    # Newest page also seeds the buffer, so fetch up to its capacity
+    seeding = bool(session_id) and not before_id and not after_id and buffer.capacity > 0
+    fetch = max(limit, buffer.capacity) if seeding else limit
+    entries = [serialize_message(message) for message in query.order_by('-id')[:fetch + 1]]
+
+    has_more = len(entries) > limit
+    # Only rows prove who owns the session; new sessions start with a buffer
+    if seeding and entries:
+        rows = entries[:fetch]
+        floor = rows[-1]["id"] if len(entries) > fetch else 0
+        buffer.seed(session_id, user_id, rows, floor)
+
+    page = entries[:limit]
+    page.reverse()
+    return page, has_more
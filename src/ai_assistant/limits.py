@@ -0,0 +1,447 @@
+"""
+LLM Limits
+
+Redis-backed admission control in front of OpenRouter. Every upstream call
+takes a lease that enforces:
+
+- a per-tenant concurrency cap and a rolling token budget, both set by the
+  tenant's ``UserProfile.subscription_plan``;
+- a global cap on concurrent provider calls, shared through a fair queue:
+  waiting requests are ordered by start-time fair queueing, so a tenant
+  with many queued requests cannot starve tenants with few.
+
+Admission is decided atomically by Lua scripts. Leases and queue entries
+expire on their own, so a crashed worker never holds capacity for long.
+Queue waits are recorded for the limits endpoint.
+
+The scripts run on the django-redis connection of the default cache. With
+any other cache backend the limiter is off; ``check_backend`` says so once
+at startup.
+"""
+
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from typing import Dict, Any, Optional, Tuple
+from django.conf import settings
+from django.core.cache import cache
+from channels.db import database_sync_to_async
+from asgiref.sync import sync_to_async
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "ai_llm"
+
+# Upper bounds (ms) of the queue-wait histogram
+WAIT_BUCKETS_MS = (10, 100, 500, 1000, 5000, 15000)
+
+# Tenant without a user id, e.g. background summaries
+SYSTEM_TENANT = "system"
+
+ACQUIRE_SCRIPT = """
+local member, tenant = ARGV[1], ARGV[2]
+local now = tonumber(ARGV[3])
+local lease_until = now + tonumber(ARGV[4])
+local tenant_cap = tonumber(ARGV[5])
+local global_cap = tonumber(ARGV[6])
+local budget = tonumber(ARGV[7])
+local window_start = tonumber(ARGV[8])
+local start = tonumber(ARGV[10])
+
+local function leave()
+    redis.call('ZREM', KEYS[1], member)
+    redis.call('ZREM', KEYS[3], member)
+    redis.call('HDEL', KEYS[4], member)
+end
+
+-- Rolling token budget, kept as per-bucket sums
+if budget >= 0 then
+    local used = 0
+    local buckets = redis.call('HGETALL', KEYS[7])
+    for i = 1, #buckets, 2 do
+        if tonumber(buckets[i]) < window_start then
+            redis.call('HDEL', KEYS[7], buckets[i])
+        else
+            used = used + tonumber(buckets[i + 1])
+        end
+    end
+    if used >= budget then
+        leave()
+        return {-1, used, start}
+    end
+end
+
+-- Stage 1: the tenant needs a free slot, but only takes it on admission, so
+-- a queued waiter never holds its tenant's capacity
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if tenant_cap >= 0 and redis.call('ZCARD', KEYS[1]) >= tenant_cap then
+    leave()
+    return {0, 0, start}
+end
+
+if global_cap < 0 then
+    redis.call('ZADD', KEYS[1], lease_until, member)
+    return {1, 0, start}
+end
+
+-- Stage 2: fair queue for the shared provider capacity; a waiter that had
+-- to step out for its tenant's cap comes back at its earlier start
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+if not redis.call('ZSCORE', KEYS[3], member) then
+    if start < 0 then
+        start = math.max(
+            tonumber(redis.call('HGET', KEYS[6], tenant) or 0),
+            tonumber(redis.call('GET', KEYS[5]) or 0)
+        )
+        redis.call('HSET', KEYS[6], tenant, start + 1)
+    end
+    redis.call('ZADD', KEYS[3], start, member)
+end
+redis.call('HSET', KEYS[4], member, now + tonumber(ARGV[9]))
+
+-- Drop waiters ahead of us that stopped polling
+local free = global_cap - redis.call('ZCARD', KEYS[2])
+for _, head in ipairs(redis.call('ZRANGE', KEYS[3], 0, math.max(free, 0) + 10)) do
+    if tonumber(redis.call('HGET', KEYS[4], head) or 0) < now then
+        redis.call('ZREM', KEYS[3], head)
+        redis.call('HDEL', KEYS[4], head)
+    end
+end
+
+local rank = redis.call('ZRANK', KEYS[3], member)
+if rank < free then
+    local score = tonumber(redis.call('ZSCORE', KEYS[3], member))
+    redis.call('ZREM', KEYS[3], member)
+    redis.call('HDEL', KEYS[4], member)
+    redis.call('ZADD', KEYS[2], lease_until, member)
+    redis.call('ZADD', KEYS[1], lease_until, member)
+    if score > tonumber(redis.call('GET', KEYS[5]) or 0) then
+        redis.call('SET', KEYS[5], score)
+    end
+    return {1, 0, start}
+end
+return {0, rank + 1, start}
+"""
+
+
+class AILimitExceeded(Exception):
+    """Raised when a tenant's budget is used up or the queue wait times out."""
+
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+_scripts = {}
+_scripts_lock = threading.Lock()
+
+
+def backend_available() -> bool:
+    """Whether the default cache is django-redis, which the limiter runs on."""
+    return settings.CACHES.get("default", {}).get("BACKEND", "").startswith("django_redis.")
+
+
+def check_backend():
+    """Warn once at startup when LLM limits are configured but cannot be enforced."""
+    if LLMLimiter().limits_configured() and not backend_available():
+        logger.warning(
+            "AI LLM limits are configured but the default cache is not django-redis; "
+            "OpenRouter calls will not be limited"
+        )
+
+
+def _get_redis():
+    from django_redis import get_redis_connection
+    return get_redis_connection("default")
+
+
+def _acquire_script(client):
+    with _scripts_lock:
+        script = _scripts.get(id(client))
+        if script is None:
+            script = _scripts[id(client)] = client.register_script(ACQUIRE_SCRIPT)
+        return script
+
+
+class LLMLimiter:
+    """
+    Admission control for OpenRouter calls.
+
+    ``acquire`` blocks until the call may proceed and returns a lease,
+    which must be passed to ``release`` with the result once the call is
+    done. Without a django-redis cache, or when Redis is unreachable,
+    calls are let through unlimited.
+    """
+
+    POLL_INITIAL = 0.02
+    POLL_MAX = 0.25
+    PLAN_CACHE_TTL = 300
+
+    def __init__(self):
+        self.settings = settings.AI_ASSISTANT_SETTINGS
+        self.plan_limits = self.settings.get("plan_limits", {})
+        self.global_cap = self.settings.get("global_llm_concurrency", -1)
+        self.queue_timeout = self.settings.get("llm_queue_timeout", 30)
+        self.lease_seconds = self.settings.get("llm_lease_seconds", 180)
+        self.window = self.settings.get("token_budget_window", 3600)
+
+    def acquire(self, user_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Wait for admission of one upstream call by ``user_id``."""
+        if not self._enabled():
+            return None
+        limits = self._get_plan_limits(user_id)
+        lease = self._new_lease(user_id, limits)
+        delay = self.POLL_INITIAL
+
+        while True:
+            admitted = self._try_acquire(lease)
+            if admitted is not None:
+                return admitted
+            time.sleep(delay)
+            delay = min(delay * 2, self.POLL_MAX)
+
+    async def aacquire(self, user_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Async counterpart of ``acquire``."""
+        if not self._enabled():
+            return None
+        limits = await database_sync_to_async(self._get_plan_limits)(user_id)
+        lease = self._new_lease(user_id, limits)
+        delay = self.POLL_INITIAL
+
+        while True:
+            admitted = await sync_to_async(self._try_acquire, thread_sensitive=False)(lease)
+            if admitted is not None:
+                return admitted
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.POLL_MAX)
+
+    def release(self, lease: Optional[Dict[str, Any]], result: Optional[Dict[str, Any]] = None):
+        """Free the lease and charge the tokens the call used to the tenant."""
+        if not lease or not lease.get("admitted"):
+            return
+
+        tokens = int((result or {}).get("tokens_used") or 0)
+        now = time.time()
+        tenant = lease["tenant"]
+        try:
+            pipe = _get_redis().pipeline(transaction=False)
+            pipe.zrem(self._key("inflight", tenant), lease["member"])
+            pipe.zrem(self._key("inflight"), lease["member"])
+            if tokens > 0:
+                pipe.hincrby(self._key("tokens", tenant), self._bucket(now), tokens)
+                pipe.expire(self._key("tokens", tenant), self.window + self._bucket_size())
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to release LLM lease for tenant {tenant}: {e}")
+
+    async def arelease(self, lease: Optional[Dict[str, Any]], result: Optional[Dict[str, Any]] = None):
+        if lease and lease.get("admitted"):
+            await sync_to_async(self.release, thread_sensitive=False)(lease, result)
+
+    def tenant_usage(self, user_id: str) -> Dict[str, Any]:
+        """Current concurrency and token usage of a tenant against its plan."""
+        plan, limits = self._resolve_plan(user_id)
+        usage = {
+            "plan": plan,
+            "concurrency_limit": limits["concurrency"],
+            "token_budget": limits["tokens"],
+            "token_budget_window_seconds": self.window,
+            "in_flight": 0,
+            "tokens_used": 0
+        }
+        if not backend_available():
+            return usage
+        try:
+            client = _get_redis()
+            window_start = self._bucket(time.time()) - self.window
+            buckets = client.hgetall(self._key("tokens", str(user_id)))
+            usage["tokens_used"] = sum(
+                int(value) for bucket, value in buckets.items() if int(bucket) >= window_start
+            )
+            usage["in_flight"] = client.zcount(self._key("inflight", str(user_id)), time.time(), "+inf")
+        except Exception as e:
+            logger.error(f"Failed to read LLM usage for tenant {user_id}: {e}")
+        return usage
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        """Queue-wait metrics and the current depth of the fair queue."""
+        if not backend_available():
+            return {}
+        try:
+            client = _get_redis()
+            raw = client.hgetall(f"{KEY_PREFIX}:stats")
+            now = time.time()
+            queued = client.zcard(f"{KEY_PREFIX}:waiting")
+            in_flight = client.zcount(f"{KEY_PREFIX}:inflight", now, "+inf")
+        except Exception as e:
+            logger.error(f"Failed to read LLM limiter stats: {e}")
+            return {}
+
+        counters = {key.decode(): float(value) for key, value in raw.items()}
+        admitted = int(counters.get("admitted", 0))
+        return {
+            "admitted": admitted,
+            "queued_admissions": int(counters.get("queued", 0)),
+            "rejected_budget": int(counters.get("rejected_budget", 0)),
+            "rejected_timeout": int(counters.get("rejected_timeout", 0)),
+            "average_wait_ms": round(counters.get("wait_ms_total", 0) / admitted, 2) if admitted else 0.0,
+            "max_wait_ms": int(counters.get("wait_ms_max", 0)),
+            "wait_histogram_ms": {
+                f"le_{bound}": int(counters.get(f"wait_le_{bound}", 0))
+                for bound in WAIT_BUCKETS_MS + ("inf",)
+            },
+            "queue_depth": queued,
+            "in_flight": in_flight
+        }
+
+    def limits_configured(self) -> bool:
+        """Whether any plan or the global cap actually limits calls."""
+        return self.global_cap >= 0 or any(
+            limits.get("concurrency", -1) >= 0 or limits.get("tokens", -1) >= 0
+            for limits in self.plan_limits.values()
+        )
+
+    def _enabled(self) -> bool:
+        return backend_available() and self.limits_configured()
+
+    def _new_lease(self, user_id: Optional[str], limits: Dict[str, int]) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "tenant": str(user_id) if user_id else SYSTEM_TENANT,
+            # Time first so equal fair-queue scores are served in arrival order
+            "member": f"{int(now * 1000):015d}:{uuid.uuid4().hex}",
+            "limits": limits,
+            "queued_at": now,
+            # Fair-queue start, kept when the tenant's cap bounces the lease
+            "start": -1,
+            "admitted": False,
+            "queued": False
+        }
+
+    def _try_acquire(self, lease: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """One admission attempt; returns the admitted lease, or None to keep waiting."""
+        now = time.time()
+        tenant = lease["tenant"]
+        limits = lease["limits"]
+
+        try:
+            client = _get_redis()
+            status, detail, start = _acquire_script(client)(
+                keys=[
+                    self._key("inflight", tenant),
+                    self._key("inflight"),
+                    self._key("waiting"),
+                    self._key("waiting_deadlines"),
+                    self._key("vtime"),
+                    self._key("tenant_start"),
+                    self._key("tokens", tenant)
+                ],
+                args=[
+                    lease["member"], tenant, now, self.lease_seconds,
+                    limits["concurrency"], self.global_cap, limits["tokens"],
+                    self._bucket(now) - self.window,
+                    # A waiter that misses a few polls loses its place
+                    self.POLL_MAX * 8,
+                    lease["start"]
+                ],
+                client=client
+            )
+        except Exception as e:
+            logger.error(f"LLM limiter unavailable, admitting without limits: {e}")
+            return {**lease, "admitted": False}
+
+        lease["start"] = start
+        if status == 1:
+            lease = {**lease, "admitted": True}
+            self._record_admission(lease, now)
+            return lease
+
+        if status == -1:
+            self._incr("rejected_budget")
+            raise AILimitExceeded(
+                f"AI token budget of {limits['tokens']} tokens per {self.window // 60} minutes used up",
+                "budget"
+            )
+
+        lease["queued"] = True
+        if now - lease["queued_at"] >= self.queue_timeout:
+            self._abandon(lease)
+            self._incr("rejected_timeout")
+            raise AILimitExceeded("AI service is busy, timed out waiting for capacity", "queue_timeout")
+        return None
+
+    def _abandon(self, lease: Dict[str, Any]):
+        try:
+            pipe = _get_redis().pipeline(transaction=False)
+            pipe.zrem(self._key("inflight", lease["tenant"]), lease["member"])
+            pipe.zrem(self._key("waiting"), lease["member"])
+            pipe.hdel(self._key("waiting_deadlines"), lease["member"])
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to leave the LLM queue: {e}")
+
+    def _record_admission(self, lease: Dict[str, Any], now: float):
+        wait_ms = int((now - lease["queued_at"]) * 1000)
+        bucket = next((bound for bound in WAIT_BUCKETS_MS if wait_ms <= bound), "inf")
+        try:
+            pipe = _get_redis().pipeline(transaction=False)
+            stats_key = self._key("stats")
+            pipe.hincrby(stats_key, "admitted", 1)
+            pipe.hincrby(stats_key, f"wait_le_{bucket}", 1)
+            pipe.hincrbyfloat(stats_key, "wait_ms_total", wait_ms)
+            if lease["queued"]:
+                pipe.hincrby(stats_key, "queued", 1)
+            pipe.execute()
+
+            # Not atomic with the counters above; good enough for a max gauge
+            client = _get_redis()
+            if wait_ms > float(client.hget(stats_key, "wait_ms_max") or 0):
+                client.hset(stats_key, "wait_ms_max", wait_ms)
+        except Exception as e:
+            logger.debug(f"Failed to record LLM queue wait: {e}")
+
+    def _incr(self, counter: str):
+        try:
+            _get_redis().hincrby(self._key("stats"), counter, 1)
+        except Exception as e:
+            logger.debug(f"Failed to update LLM limiter {counter} counter: {e}")
+
+    def _get_plan_limits(self, user_id: Optional[str]) -> Dict[str, int]:
+        if not user_id:
+            return {"concurrency": -1, "tokens": -1}
+        return self._resolve_plan(user_id)[1]
+
+    def _resolve_plan(self, user_id: str) -> Tuple[str, Dict[str, int]]:
+        """Subscription plan of a tenant and its limits, cached briefly."""
+        from users.models import UserProfile
+
+        cache_key = f"{KEY_PREFIX}:plan:{user_id}"
+        plan = cache.get(cache_key)
+        if plan is None:
+            try:
+                plan = UserProfile.objects.filter(user_id=user_id).values_list(
+                    'subscription_plan', flat=True
+                ).first() or 'freemium'
+                cache.set(cache_key, plan, self.PLAN_CACHE_TTL)
+            except Exception as e:
+                logger.error(f"Failed to load subscription plan of tenant {user_id}: {e}")
+                plan = 'freemium'
+
+        limits = self.plan_limits.get(plan) or self.plan_limits.get('freemium') or {}
+        return plan, {
+            "concurrency": limits.get("concurrency", -1),
+            "tokens": limits.get("tokens", -1)
+        }
+
+    def _bucket_size(self) -> int:
+        return max(self.window // 60, 1)
+
+    def _bucket(self, now: float) -> int:
+        size = self._bucket_size()
+        return int(now // size) * size
+
+    def _key(self, name: str, tenant: str = None) -> str:
+        return f"{KEY_PREFIX}:{name}:{tenant}" if tenant else f"{KEY_PREFIX}:{name}"
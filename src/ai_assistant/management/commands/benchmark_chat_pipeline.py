@@ -0,0 +1,301 @@
+"""
+Load benchmark for the chat pipeline.
+
+Drives synthetic sessions through the HTTP ``send_message`` view and the
+``ChatConsumer`` WebSocket, in process, against the configured database and
+Redis. Point OPENROUTER_BASE_URL at ``manage.py openrouter_replay`` (or pass
+--standin) so no request reaches openrouter.ai.
+
+Usage:
+    python manage.py benchmark_chat_pipeline --sessions 20 --turns 6
+    python manage.py benchmark_chat_pipeline --transport ws --standin --latency-ms 800
+"""
+
+import time
+import uuid
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List
+
+import jwt
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.urls import reverse
+
+from ai_assistant.models import ChatSession, ChatMessage, AIAction, ConversationContext
+from ai_assistant.replay import ReplayServer, ReplayStore, load_recordings
+
+
+# One synthetic session; every session is a separate tenant
+SESSION_SCRIPT = [
+    "Hi there",
+    "Is Camera A available tomorrow from 10am to 4pm?",
+    "Find customer Maria",
+    "Do we have a tripod?",
+    "Can you help me plan the shoots for next week?",
+    "Thanks!",
+]
+
+PHASES = ("entity_extraction", "context_build", "retrieval", "llm", "actions", "persistence")
+
+
+class QueryCounter:
+    """Counts queries on every database connection, including new ones in worker threads."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self):
+        connection_created.connect(self._on_connection_created, weak=False)
+        for conn in connections.all():
+            self._attach(conn)
+
+    def uninstall(self):
+        connection_created.disconnect(self._on_connection_created)
+
+    def _on_connection_created(self, sender, connection, **kwargs):
+        self._attach(connection)
+
+    def _attach(self, conn):
+        if self not in conn.execute_wrappers:
+            conn.execute_wrappers.append(self)
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class Command(BaseCommand):
+    help = "Measure chat turns per second, per-phase latency and queries per turn over HTTP and WebSocket"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=10, help='Synthetic sessions per transport (default: 10)')
+        parser.add_argument(
+            '--turns',
+            type=int,
+            default=len(SESSION_SCRIPT),
+            help=f'Turns per session, cycling through the script (default: {len(SESSION_SCRIPT)})'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=0,
+            help='Sessions running at once (default: all of them)'
+        )
+        parser.add_argument(
+            '--transport',
+            choices=['http', 'ws', 'both'],
+            default='both',
+            help='Path to drive (default: both)'
+        )
+        parser.add_argument(
+            '--plan',
+            default='enterprise',
+            help='Subscription plan of the synthetic tenants (default: enterprise)'
+        )
+        parser.add_argument(
+            '--standin',
+            action='store_true',
+            help='Serve the built-in recordings from this process instead of using OPENROUTER_BASE_URL'
+        )
+        parser.add_argument('--latency-ms', type=int, default=0, help='Stand-in response latency (with --standin)')
+        parser.add_argument('--chunk-delay-ms', type=int, default=0, help='Stand-in delay between stream chunks')
+        parser.add_argument('--keep-data', action='store_true', help='Keep the sessions and messages created')
+
+    def handle(self, *args, **options):
+        if not settings.SUPABASE_JWT_SECRET:
+            raise CommandError("SUPABASE_JWT_SECRET must be set to sign the benchmark tokens")
+        if connection.vendor != 'postgresql':
+            self.stdout.write(self.style.WARNING(
+                f"Running against {connection.vendor}; query counts and timings differ from Postgres"
+            ))
+
+        server = None
+        if options['standin']:
+            server = ReplayServer(
+                ('127.0.0.1', 0),
+                ReplayStore(load_recordings()),
+                latency_ms=options['latency_ms'],
+                chunk_delay_ms=options['chunk_delay_ms']
+            )
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            settings.OPENROUTER_BASE_URL = server.base_url
+        elif 'openrouter.ai' in settings.OPENROUTER_BASE_URL:
+            raise CommandError(
+                "OPENROUTER_BASE_URL points at openrouter.ai; run manage.py openrouter_replay "
+                "and set OPENROUTER_BASE_URL, or pass --standin"
+            )
+
+        self.stdout.write(f"OpenRouter: {settings.OPENROUTER_BASE_URL}")
+
+        counter = QueryCounter()
+        counter.install()
+        transports = ['http', 'ws'] if options['transport'] == 'both' else [options['transport']]
+        tenants = []
+
+        try:
+            for transport in transports:
+                users = self._create_tenants(options['sessions'], options['plan'])
+                tenants.extend(users)
+                concurrency = options['concurrency'] or len(users)
+
+                queries_before = counter.count
+                start = time.perf_counter()
+                if transport == 'http':
+                    turns = self._run_http(users, options['turns'], concurrency)
+                else:
+                    turns = asyncio.run(self._run_ws(users, options['turns'], concurrency))
+                elapsed = time.perf_counter() - start
+
+                self._report(transport, turns, elapsed, counter.count - queries_before)
+        finally:
+            counter.uninstall()
+            if server:
+                server.shutdown()
+                server.server_close()
+            if tenants and not options['keep_data']:
+                self._delete_tenants(tenants)
+
+    def _create_tenants(self, count: int, plan: str) -> List[Dict[str, Any]]:
+        """Users with a profile on ``plan``, a chat session and a signed token each."""
+        from users.models import UserProfile
+        from users.services import UserProfileService
+
+        profiles = UserProfileService()
+        now = int(time.time())
+        users = []
+        for index in range(count):
+            user_id = str(uuid.uuid4())
+            email = f"benchmark-{user_id[:8]}@example.com"
+            profiles.get_or_create_profile(user_id=user_id, email=email)
+            UserProfile.objects.filter(user_id=user_id).update(subscription_plan=plan)
+            session = ChatSession.objects.create(user_id=user_id, title=f"Benchmark session {index + 1}")
+            token = jwt.encode(
+                {
+                    "sub": user_id,
+                    "email": email,
+                    "aud": "authenticated",
+                    "role": "authenticated",
+                    "iat": now,
+                    "exp": now + 3600
+                },
+                settings.SUPABASE_JWT_SECRET,
+                algorithm="HS256"
+            )
+            users.append({"user_id": user_id, "session_id": str(session.id), "token": token})
+        return users
+
+    def _delete_tenants(self, users: List[Dict[str, Any]]):
+        from users.models import UserProfile
+
+        user_ids = [user["user_id"] for user in users]
+        for model in (AIAction, ChatMessage, ConversationContext, ChatSession, UserProfile):
+            model.objects.filter(user_id__in=user_ids).delete()
+
+    def _run_http(self, users: List[Dict[str, Any]], turns: int, concurrency: int) -> List[Dict[str, Any]]:
+        url = reverse('ai_assistant:send_message')
+
+        def run_session(user: Dict[str, Any]) -> List[Dict[str, Any]]:
+            client = Client(HTTP_HOST='localhost')
+            results = []
+            try:
+                for turn in range(turns):
+                    start = time.perf_counter()
+                    response = client.post(
+                        url,
+                        {"message": SESSION_SCRIPT[turn % len(SESSION_SCRIPT)], "session_id": user["session_id"]},
+                        content_type='application/json',
+                        HTTP_AUTHORIZATION=f"Bearer {user['token']}"
+                    )
+                    latency = time.perf_counter() - start
+                    data = response.json() if response.status_code < 500 else {}
+                    results.append({
+                        "ok": response.status_code == 200 and data.get('success', False),
+                        "latency": latency,
+                        "phase_ms": ((data.get('ai_response') or {}).get('metadata') or {}).get('phase_ms', {})
+                    })
+            finally:
+                connection.close()
+            return results
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return [turn for session in pool.map(run_session, users) for turn in session]
+
+    async def _run_ws(self, users: List[Dict[str, Any]], turns: int, concurrency: int) -> List[Dict[str, Any]]:
+        from channels.testing import WebsocketCommunicator
+        from core.asgi import application
+
+        semaphore = asyncio.Semaphore(concurrency)
+        headers = [(b'origin', b'http://localhost'), (b'host', b'localhost')]
+
+        async def run_session(user: Dict[str, Any]) -> List[Dict[str, Any]]:
+            async with semaphore:
+                communicator = WebsocketCommunicator(
+                    application, f"/ws/chat/{user['session_id']}/", headers=headers
+                )
+                connected, _ = await communicator.connect(timeout=10)
+                if not connected:
+                    return [{"ok": False, "latency": 0.0, "phase_ms": {}} for _ in range(turns)]
+
+                await communicator.receive_json_from(timeout=10)
+                await communicator.send_json_to({"type": "authenticate", "token": user["token"]})
+                await communicator.receive_json_from(timeout=10)
+
+                results = []
+                for turn in range(turns):
+                    start = time.perf_counter()
+                    await communicator.send_json_to({
+                        "type": "chat.message",
+                        "message": SESSION_SCRIPT[turn % len(SESSION_SCRIPT)]
+                    })
+                    # Skip typing, delta and action frames until the turn's outcome
+                    while True:
+                        frame = await communicator.receive_json_from(timeout=120)
+                        if frame.get('type') in ('chat.response', 'error'):
+                            break
+                    results.append({
+                        "ok": frame['type'] == 'chat.response',
+                        "latency": time.perf_counter() - start,
+                        "phase_ms": (frame.get('metadata') or {}).get('phase_ms', {})
+                    })
+
+                await communicator.disconnect()
+                return results
+
+        sessions = await asyncio.gather(*(run_session(user) for user in users))
+        return [turn for session in sessions for turn in session]
+
+    def _report(self, transport: str, turns: List[Dict[str, Any]], elapsed: float, queries: int):
+        completed = [turn for turn in turns if turn["ok"]]
+        latencies = [turn["latency"] * 1000 for turn in completed]
+
+        self.stdout.write("")
+        self.stdout.write(self.style.SUCCESS(
+            f"{transport.upper()}: {len(turns)} turns in {elapsed:.2f}s "
+            f"({len(turns) / elapsed:.1f} turns/s), {len(turns) - len(completed)} failed"
+        ))
+        self.stdout.write(
+            f"  turn latency ms    p50 {_percentile(latencies, 0.5):8.1f}  "
+            f"p95 {_percentile(latencies, 0.95):8.1f}  max {max(latencies, default=0):8.1f}"
+        )
+        for phase in PHASES:
+            values = [turn["phase_ms"][phase] for turn in completed if phase in turn["phase_ms"]]
+            if values:
+                self.stdout.write(
+                    f"  {phase:<18} p50 {_percentile(values, 0.5):8.1f}  "
+                    f"p95 {_percentile(values, 0.95):8.1f}  ({len(values)} turns)"
+                )
+        self.stdout.write(f"  queries per turn   {queries / len(turns) if turns else 0:.1f}")
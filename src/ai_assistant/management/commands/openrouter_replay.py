@@ -0,0 +1,80 @@
+"""
+Local OpenRouter stand-in that replays recorded completions.
+
+Usage:
+    python manage.py openrouter_replay --port 8787 --latency-ms 800 --chunk-delay-ms 20
+    python manage.py openrouter_replay --recordings recordings.json
+    python manage.py openrouter_replay --record recordings.json  # fill from openrouter.ai
+
+Then run the app with OPENROUTER_BASE_URL=http://127.0.0.1:8787.
+"""
+
+import os
+from django.core.management.base import BaseCommand, CommandError
+
+from ai_assistant.replay import ReplayServer, ReplayStore, load_recordings
+
+
+class Command(BaseCommand):
+    help = "Serve recorded OpenRouter chat completions locally, with configurable latency"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on (default: 127.0.0.1)')
+        parser.add_argument('--port', type=int, default=8787, help='Port to listen on (default: 8787)')
+        parser.add_argument(
+            '--recordings',
+            help='JSON file of recordings to replay (default: the built-in set)'
+        )
+        parser.add_argument(
+            '--record',
+            metavar='FILE',
+            help='Forward unmatched requests to --upstream and store the replies in FILE'
+        )
+        parser.add_argument(
+            '--upstream',
+            default='https://openrouter.ai/api/v1',
+            help='API used in record mode (default: https://openrouter.ai/api/v1)'
+        )
+        parser.add_argument(
+            '--latency-ms',
+            type=int,
+            default=0,
+            help='Delay before each response or its first chunk (default: 0)'
+        )
+        parser.add_argument('--jitter-ms', type=int, default=0, help='Random extra latency of up to this much')
+        parser.add_argument('--chunk-size', type=int, default=16, help='Characters per streamed chunk (default: 16)')
+        parser.add_argument('--chunk-delay-ms', type=int, default=0, help='Delay between streamed chunks (default: 0)')
+
+    def handle(self, *args, **options):
+        record_path = options['record']
+        if record_path:
+            recordings = load_recordings(record_path) if os.path.exists(record_path) else []
+            store = ReplayStore(recordings, record_path)
+            upstream = options['upstream']
+        else:
+            try:
+                store = ReplayStore(load_recordings(options['recordings']))
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Failed to load recordings: {e}")
+            upstream = None
+
+        server = ReplayServer(
+            (options['host'], options['port']),
+            store,
+            latency_ms=options['latency_ms'],
+            jitter_ms=options['jitter_ms'],
+            chunk_size=options['chunk_size'],
+            chunk_delay_ms=options['chunk_delay_ms'],
+            upstream=upstream
+        )
+
+        mode = f"recording from {upstream}" if upstream else f"replaying {len(store.recordings)} recordings"
+        self.stdout.write(self.style.SUCCESS(f"OpenRouter stand-in on {server.base_url} ({mode})"))
+        self.stdout.write(f"Set OPENROUTER_BASE_URL={server.base_url} for the app under test")
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,282 @@
+"""
+AI Metrics
+
+Latency histograms and token counters of the assistant, kept in Redis so
+that web processes and Celery workers report into the same series. Each
+metric is one Redis hash; recording is a single pipelined round trip and
+fails open. ``render_metrics`` returns every series, together with the
+response cache and LLM limiter counters, in the Prometheus text format for
+the metrics endpoint.
+
+Series:
+
+    ai_llm_request_duration_seconds  OpenRouter calls by model, outcome and mode
+    ai_llm_tokens_total              provider tokens by model and kind
+    ai_turn_phase_duration_seconds   chat turn phases (entity_extraction,
+                                     context_build, retrieval, llm, actions,
+                                     persistence) by phase and outcome
+    ai_retrieval_bookings_total      bookings the model made with retrieval
+                                     on, by whether the services and customer
+                                     it needed were already in the prompt (a
+                                     lookup round trip saved)
+    ai_response_cache_lookups_total  AI response cache lookups by result (hit
+                                     or miss), recorded with the call's other
+                                     metrics
+"""
+
+import time
+import logging
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple
+from asgiref.sync import sync_to_async
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "ai_metrics"
+
+# Outcomes of an OpenRouter call
+OUTCOME_SUCCESS = "success"
+OUTCOME_CACHED = "cached"
+OUTCOME_COALESCED = "coalesced"
+OUTCOME_ERROR = "error"
+
+# name: (type, help, histogram bounds in seconds)
+METRICS = {
+    "ai_llm_request_duration_seconds": (
+        "histogram",
+        "OpenRouter request latency, including retries and queueing for capacity.",
+        (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+    ),
+    "ai_llm_tokens_total": (
+        "counter",
+        "Tokens reported by OpenRouter.",
+        None,
+    ),
+    "ai_turn_phase_duration_seconds": (
+        "histogram",
+        "Duration of each phase of a chat turn.",
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+    ),
+    "ai_retrieval_bookings_total": (
+        "counter",
+        "Bookings created with catalog and customer retrieval, by whether a lookup round trip was saved.",
+        None,
+    ),
+    "ai_response_cache_lookups_total": (
+        "counter",
+        "AI response cache lookups.",
+        None,
+    ),
+}
+
+
+def _get_redis():
+    from django_redis import get_redis_connection
+    return get_redis_connection("default")
+
+
+def _label_string(labels: Dict[str, Any]) -> str:
+    parts = []
+    for name in sorted(labels):
+        value = str(labels[name]).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    return ",".join(parts)
+
+
+class MetricsBatch:
+    """
+    Observations collected in memory and written in one round trip.
+    """
+
+    def __init__(self):
+        self._ops: List[Tuple[str, str, float]] = []
+
+    def observe(self, name: str, seconds: float, **labels):
+        """Add a histogram observation."""
+        bounds = METRICS[name][2]
+        label_string = _label_string(labels)
+        bucket = next((bound for bound in bounds if seconds <= bound), "+Inf")
+        self._ops.append((name, f"{label_string}|le|{bucket}", 1))
+        self._ops.append((name, f"{label_string}|count", 1))
+        self._ops.append((name, f"{label_string}|sum", seconds))
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """Add to a counter."""
+        if amount:
+            self._ops.append((name, _label_string(labels), amount))
+
+    def flush(self):
+        if not self._ops:
+            return
+        ops, self._ops = self._ops, []
+        try:
+            pipe = _get_redis().pipeline(transaction=False)
+            for name, field, amount in ops:
+                if isinstance(amount, int):
+                    pipe.hincrby(f"{KEY_PREFIX}:{name}", field, amount)
+                else:
+                    pipe.hincrbyfloat(f"{KEY_PREFIX}:{name}", field, amount)
+            pipe.execute()
+        except Exception as e:
+            logger.debug(f"Failed to record AI metrics: {e}")
+
+
+def record_llm_call(
+    model: str,
+    outcome: str,
+    seconds: float,
+    stream: bool = False,
+    result: Optional[Dict[str, Any]] = None,
+    batch: Optional[MetricsBatch] = None
+):
+    """
+    Record the latency of an OpenRouter call and the tokens it used.
+
+    Observations already collected for the call in ``batch`` are written in
+    the same round trip.
+    """
+    batch = batch or MetricsBatch()
+    batch.observe(
+        "ai_llm_request_duration_seconds", seconds,
+        model=model, outcome=outcome, mode="stream" if stream else "complete"
+    )
+    if outcome == OUTCOME_SUCCESS and result:
+        prompt_stats = result.get("prompt_stats") or {}
+        total = result.get("tokens_used") or 0
+        prompt = prompt_stats.get("prompt_tokens") or 0
+        batch.inc("ai_llm_tokens_total", prompt, model=model, kind="prompt")
+        batch.inc("ai_llm_tokens_total", max(0, total - prompt), model=model, kind="completion")
+        batch.inc("ai_llm_tokens_total", prompt_stats.get("cached_tokens") or 0, model=model, kind="cached_prompt")
+    batch.flush()
+
+
+async def arecord_llm_call(*args, **kwargs):
+    """Async counterpart of ``record_llm_call``."""
+    await sync_to_async(record_llm_call, thread_sensitive=False)(*args, **kwargs)
+
+
+class TurnTimer:
+    """
+    Phase timings of one chat turn, recorded once the turn ends.
+    """
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self._recorded = False
+        self._nested = []
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Time the block and add it to phase ``name``.
+
+        Time spent in a phase nested inside the block counts only for the
+        nested phase.
+        """
+        started = time.time()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.time() - started
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed - self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def phase_ms(self) -> Dict[str, int]:
+        """Time spent in each phase so far, in milliseconds."""
+        return {name: int(seconds * 1000) for name, seconds in self.phases.items()}
+
+    def record(self, outcome: str):
+        """Record every phase that ran; later calls are ignored."""
+        if self._recorded:
+            return
+        self._recorded = True
+        batch = MetricsBatch()
+        for phase, seconds in self.phases.items():
+            batch.observe("ai_turn_phase_duration_seconds", seconds, phase=phase, outcome=outcome)
+        batch.flush()
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _render_recorded(raw: Dict[str, Dict[bytes, bytes]]) -> List[str]:
+    lines = []
+    for name, (metric_type, help_text, bounds) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        fields = {key.decode(): float(value) for key, value in (raw.get(name) or {}).items()}
+
+        if metric_type == "counter":
+            for label_string in sorted(fields):
+                lines.append(f"{name}{{{label_string}}} {_format_value(fields[label_string])}")
+            continue
+
+        series = sorted({field.rsplit("|", 1)[0] for field in fields if field.endswith("|count")})
+        for label_string in series:
+            separator = "," if label_string else ""
+            cumulative = 0.0
+            for bound in list(bounds) + ["+Inf"]:
+                cumulative += fields.get(f"{label_string}|le|{bound}", 0)
+                lines.append(
+                    f'{name}_bucket{{{label_string}{separator}le="{bound}"}} {_format_value(cumulative)}'
+                )
+            lines.append(f"{name}_sum{{{label_string}}} {_format_value(fields.get(f'{label_string}|sum', 0))}")
+            lines.append(f"{name}_count{{{label_string}}} {_format_value(fields.get(f'{label_string}|count', 0))}")
+    return lines
+
+
+def _render_family(name: str, help_text: str, values: Dict[str, float], label: str, metric_type: str = "gauge") -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for value_label, value in values.items():
+        lines.append(f'{name}{{{label}="{value_label}"}} {_format_value(value)}')
+    return lines
+
+
+def _render_hit_ratio(raw: Dict[str, Dict[bytes, bytes]]) -> List[str]:
+    lookups = {key.decode(): float(value) for key, value in (raw.get("ai_response_cache_lookups_total") or {}).items()}
+    hits = lookups.get('result="hit"', 0)
+    total = hits + lookups.get('result="miss"', 0)
+    return [
+        "# HELP ai_response_cache_hit_ratio Share of AI response cache lookups that hit.",
+        "# TYPE ai_response_cache_hit_ratio gauge",
+        f"ai_response_cache_hit_ratio {_format_value(round(hits / total, 4) if total else 0.0)}",
+    ]
+
+
+def render_metrics() -> str:
+    """All AI metrics in the Prometheus text exposition format."""
+    from .limits import LLMLimiter
+
+    lines = []
+    try:
+        pipe = _get_redis().pipeline(transaction=False)
+        for name in METRICS:
+            pipe.hgetall(f"{KEY_PREFIX}:{name}")
+        raw = dict(zip(METRICS, pipe.execute()))
+        lines.extend(_render_recorded(raw))
+        lines.extend(_render_hit_ratio(raw))
+    except Exception as e:
+        logger.error(f"Failed to read AI metrics: {e}")
+
+    limiter_stats = LLMLimiter.stats()
+    if limiter_stats:
+        lines.extend(_render_family(
+            "ai_llm_limiter_decisions_total", "Admission decisions of the LLM limiter.",
+            {
+                "admitted": limiter_stats["admitted"],
+                "queued": limiter_stats["queued_admissions"],
+                "rejected_budget": limiter_stats["rejected_budget"],
+                "rejected_timeout": limiter_stats["rejected_timeout"],
+            },
+            "decision", "counter"
+        ))
+        lines.extend(_render_family(
+            "ai_llm_limiter_requests", "Requests waiting for or holding OpenRouter capacity.",
+            {"queued": limiter_stats["queue_depth"], "in_flight": limiter_stats["in_flight"]},
+            "state"
+        ))
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-15 12:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_assistant', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='routing_reason',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='routing_tier',
+            field=models.CharField(blank=True, choices=[('router', 'Intent Router'), ('light', 'Light Model'), ('full', 'Full Model')], max_length=10),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='tier_latency_ms',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-15 12:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_assistant', '0002_chatmessage_routing'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['session_id', 'id'], name='chat_messag_session_97f3b9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['user_id', 'id'], name='chat_messag_user_id_e39a8a_idx'),
+        ),
+    ]
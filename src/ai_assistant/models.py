@@ -8,6 +8,7 @@ including chat sessions, message storage, action tracking, and context managemen
 import uuid
 import json
 from django.db import models
+from django.db.models import F
 from django.utils import timezone
 from typing import Dict, Any, List, Optional
 
@@ -72,13 +73,30 @@ class ChatSession(models.Model):
     
     def increment_message_count(self):
         """Increment message count for this session"""
+        ChatSession.record_activity(self.id, messages=1)
         self.message_count += 1
-        self.save(update_fields=['message_count', 'last_activity'])
     
     def increment_action_count(self):
         """Increment action count for this session"""
+        ChatSession.record_activity(self.id, actions=1)
         self.actions_performed += 1
-        self.save(update_fields=['actions_performed', 'last_activity'])
+    
+    @classmethod
+    def record_activity(cls, session_id, messages: int = 0, actions: int = 0, **fields) -> int:
+        """
+        Add to the session counters and set ``fields`` in a single UPDATE.
+        Counters use F() expressions, so concurrent turns never lose increments.
+        """
+        now = timezone.now()
+        if 'context' in fields:
+            fields['updated_at'] = now
+        
+        return cls.objects.filter(id=session_id).update(
+            message_count=F('message_count') + messages,
+            actions_performed=F('actions_performed') + actions,
+            last_activity=now,
+            **fields
+        )
 
 
 class ChatMessage(models.Model):
@@ -95,13 +113,19 @@ class ChatMessage(models.Model):
     
     MESSAGE_STATUS = [
         ('sent', 'Sent'),
-        ('processing', 'Processing'),
-        ('processed', 'Processed'),
-        ('failed', 'Failed'),
+        ('processing', 'Processing'),  # User turn waiting on the AI reply
+        ('processed', 'Processed'),  # Turn completed and reply persisted
+        ('failed', 'Failed'),  # AI call or action phase failed
         ('edited', 'Edited'),
         ('deleted', 'Deleted'),
     ]
     
+    ROUTING_TIERS = [
+        ('router', 'Intent Router'),
+        ('light', 'Light Model'),
+        ('full', 'Full Model'),
+    ]
+    
     id = models.BigAutoField(primary_key=True)
     session_id = models.UUIDField(null=True, blank=True, db_index=True)  # Optional session grouping
     user_id = models.UUIDField(db_index=True)  # Links to Supabase auth.users.id
@@ -120,6 +144,12 @@ class ChatMessage(models.Model):
     confidence_score = models.FloatField(null=True, blank=True)
     entities_extracted = models.JSONField(default=list, blank=True)
     intent_recognized = models.CharField(max_length=100, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)  # When a worker took the queued turn
+    
+    # Model cascade (for AI messages): tier that answered, why, and time spent per tier
+    routing_tier = models.CharField(max_length=10, choices=ROUTING_TIERS, blank=True)
+    routing_reason = models.CharField(max_length=50, blank=True)
+    tier_latency_ms = models.JSONField(default=dict, blank=True)
     
     # Response metadata (for AI messages)
     parent_message_id = models.BigIntegerField(null=True, blank=True)  # References user message
@@ -137,6 +167,9 @@ class ChatMessage(models.Model):
             models.Index(fields=['sender_type', 'timestamp']),
             models.Index(fields=['status', 'timestamp']),
             models.Index(fields=['parent_message_id']),
+            # Keyset pagination of history (before_id)
+            models.Index(fields=['session_id', 'id']),
+            models.Index(fields=['user_id', 'id']),
         ]
         ordering = ['timestamp']
     
@@ -0,0 +1,191 @@
+"""
+Prompt Builder
+
+Assembles the OpenRouter message array within a token budget. The static
+system prompt is sent as a cacheable prefix, followed by the rolling
+conversation summary and a table of the catalog entries and customers the
+message mentions, and history is trimmed newest-first to
+``history_token_budget``.
+"""
+
+import math
+from typing import Dict, Any, List, Optional, Tuple
+from django.conf import settings
+
+# Rough average for English text with BPE tokenizers; exact counts come back
+# in the OpenRouter usage block.
+CHARS_PER_TOKEN = 4
+
+# Role and separator tokens added by chat templates for every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in ``text``."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def estimate_message_tokens(content: str) -> int:
+    """Estimate the tokens a chat message with ``content`` costs."""
+    return estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+class PromptBuilder:
+    """
+    Builds chat completion messages with a cacheable system prefix and a
+    token-budgeted slice of the conversation history.
+    """
+
+    def __init__(self):
+        self.settings = settings.AI_ASSISTANT_SETTINGS
+        self.window_size = self.settings["context_window_size"]
+        self.history_budget = self.settings.get("history_token_budget", 1500)
+        self.cache_control = self.settings.get("prompt_cache_control", True)
+
+    def build(
+        self,
+        prompt: str,
+        system_prompt: str,
+        context: Dict[str, Any] = None,
+        snippets: Dict[str, Any] = None
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Build the message array for a turn.
+
+        Args:
+            prompt: User input message
+            system_prompt: Static system prompt
+            context: Conversation context and history
+            snippets: Services and customers retrieved for the message
+
+        Returns:
+            Tuple of (messages, prompt stats)
+        """
+        context = context or {}
+        history = self._prior_history(prompt, context.get("message_history") or [])
+
+        system_tokens = estimate_message_tokens(system_prompt)
+        prompt_tokens = estimate_message_tokens(prompt)
+
+        history_messages, history_tokens = self._select_history(history)
+
+        messages = [self._system_message(system_prompt)]
+
+        # After the cached prefix, since it changes as the session grows
+        summary = context.get("conversation_summary")
+        summary_tokens = 0
+        if summary:
+            summary_content = f"Summary of the earlier conversation:\n{summary}"
+            messages.append({"role": "system", "content": summary_content})
+            summary_tokens = estimate_message_tokens(summary_content)
+
+        # Also after the prefix; it depends on the message
+        snippets = snippets or {}
+        retrieval_content = format_snippets(snippets)
+        retrieval_tokens = 0
+        if retrieval_content:
+            messages.append({"role": "system", "content": retrieval_content})
+            retrieval_tokens = estimate_message_tokens(retrieval_content)
+
+        messages.extend(history_messages)
+        messages.append({"role": "user", "content": prompt})
+
+        sent_tokens = system_tokens + summary_tokens + retrieval_tokens + history_tokens + prompt_tokens
+
+        # What the untrimmed window (which also repeated the prompt) would have cost
+        full_window = (context.get("message_history") or [])[-self.window_size:]
+        untrimmed_tokens = system_tokens + prompt_tokens + sum(
+            estimate_message_tokens(msg["content"]) for msg in full_window
+        )
+
+        stats = {
+            "estimated_prompt_tokens": sent_tokens,
+            "system_tokens": system_tokens,
+            "summary_tokens": summary_tokens,
+            "retrieval_tokens": retrieval_tokens,
+            "retrieved_services": len(snippets.get("services") or []),
+            "retrieved_customers": len(snippets.get("customers") or []),
+            "history_tokens": history_tokens,
+            "history_messages": len(history_messages),
+            "history_messages_dropped": len(history) - len(history_messages),
+            "cacheable_prefix_tokens": system_tokens if self.cache_control else 0,
+            "tokens_saved": max(untrimmed_tokens - sent_tokens, 0)
+        }
+        return messages, stats
+
+    def _system_message(self, system_prompt: str) -> Dict[str, Any]:
+        """System message, marked as a prompt cache breakpoint when enabled."""
+        if not self.cache_control:
+            return {"role": "system", "content": system_prompt}
+
+        return {
+            "role": "system",
+            "content": [{
+                "type": "text",
+                "text": system_prompt,
+                "cache_control": {"type": "ephemeral"}
+            }]
+        }
+
+    def _prior_history(self, prompt: str, history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        History before the current turn; the stored history already ends with the prompt.
+        
+        Unanswered repeats of the prompt (double sends, retries) are dropped
+        too, so duplicates build the same request and can be coalesced.
+        """
+        end = len(history)
+        while end and history[end - 1].get("sender_type") == "user" and history[end - 1].get("content") == prompt:
+            end -= 1
+        return history[:end]
+
+    def _select_history(self, history: List[Dict[str, Any]]) -> Tuple[List[Dict[str, str]], int]:
+        """Newest messages that fit in the history budget, in chronological order."""
+        selected = []
+        used_tokens = 0
+
+        for msg in reversed(history[-self.window_size:]):
+            # Replies that only made tool calls have no text to replay
+            if not msg["content"]:
+                continue
+            tokens = estimate_message_tokens(msg["content"])
+            if used_tokens + tokens > self.history_budget:
+                break
+            selected.append({
+                "role": "user" if msg["sender_type"] == "user" else "assistant",
+                "content": msg["content"]
+            })
+            used_tokens += tokens
+
+        selected.reverse()
+        return selected, used_tokens
+
+
+def format_snippets(snippets: Dict[str, Any]) -> str:
+    """Compact table of retrieved services and customers, or "" when there are none."""
+    services = snippets.get("services") or []
+    customers = snippets.get("customers") or []
+    if not services and not customers:
+        return ""
+
+    lines = ["Catalog entries and customers matching the user's message (they exist; use them as listed):"]
+    if services:
+        lines.append("Services: name | type | rates | quantity")
+        lines.extend(
+            f"- {service['name']} | {service['type']} | {service['rates'] or '-'} | {service['quantity']}"
+            for service in services
+        )
+    if customers:
+        lines.append("Customers (book them by name; search_customer returns contact details): name | company")
+        lines.extend(f"- {customer['name']} | {customer['company'] or '-'}" for customer in customers)
+    return "\n".join(lines)
+
+
+def merge_usage_stats(prompt_stats: Optional[Dict[str, Any]], usage: Dict[str, Any]) -> Dict[str, Any]:
+    """Add the provider's prompt and cache token counts to the builder stats."""
+    stats = dict(prompt_stats or {})
+    stats["prompt_tokens"] = usage.get("prompt_tokens", 0)
+    stats["cached_tokens"] = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+    return stats
@@ -0,0 +1,98 @@
+"""
+WebSocket Frame Protocol
+
+Version 1 is the original protocol: every event is its own JSON text frame
+with its own timestamp. Version 2 is negotiated with a WebSocket subprotocol
+at connect time and sends all events of a turn (typing off, the response and
+the feedback of every action) as one ``batch`` envelope stamped once. Its
+``msgpack`` variant carries the same payloads as binary MessagePack frames.
+
+Subprotocols, in the server's order of preference:
+
+    chat.v2.msgpack  version 2, binary MessagePack frames
+    chat.v2.json     version 2, JSON text frames
+
+Clients that offer neither get version 1. Events sent on their own
+(streamed deltas, pongs, history pages) are plain frames in every version.
+Client frames may use either encoding in any version.
+"""
+
+import json
+from typing import Dict, Any, List, Optional
+
+import msgpack
+from django.utils import timezone
+
+SUBPROTOCOL_MSGPACK = "chat.v2.msgpack"
+SUBPROTOCOL_JSON = "chat.v2.json"
+
+# subprotocol: (version, encoding)
+SUBPROTOCOLS = {
+    SUBPROTOCOL_MSGPACK: (2, "msgpack"),
+    SUBPROTOCOL_JSON: (2, "json"),
+}
+
+
+class FrameDecodeError(ValueError):
+    """A client frame that is not a valid JSON or MessagePack object."""
+
+
+class FrameCodec:
+    """
+    Encodes events for one connection in its negotiated protocol.
+
+    ``frames()`` returns the keyword arguments of ``AsyncWebsocketConsumer.send``
+    for a list of events, one call per frame.
+    """
+
+    def __init__(self, subprotocol: Optional[str] = None):
+        self.subprotocol = subprotocol if subprotocol in SUBPROTOCOLS else None
+        self.version, self.encoding = SUBPROTOCOLS.get(self.subprotocol, (1, "json"))
+
+    @classmethod
+    def negotiate(cls, offered: List[str]) -> "FrameCodec":
+        """Codec of the most preferred subprotocol the client offered."""
+        for subprotocol in SUBPROTOCOLS:
+            if subprotocol in (offered or []):
+                return cls(subprotocol)
+        return cls()
+
+    @property
+    def batches(self) -> bool:
+        return self.version >= 2
+
+    def encode(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Send arguments of a single frame."""
+        if self.encoding == "msgpack":
+            return {"bytes_data": msgpack.packb(payload, default=str, use_bin_type=True)}
+        return {"text_data": json.dumps(payload, default=str)}
+
+    def frames(self, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Send arguments of the frames that carry ``events``.
+
+        Version 1 stamps and sends each event on its own; version 2 sends a
+        single envelope with one timestamp for all of them. A lone event is
+        never wrapped.
+        """
+        timestamp = timezone.now().isoformat()
+        if not self.batches or len(events) == 1:
+            return [self.encode({**event, "timestamp": event.get("timestamp", timestamp)}) for event in events]
+        return [self.encode({"type": "batch", "events": events, "timestamp": timestamp})]
+
+    @staticmethod
+    def decode(text_data: Optional[str] = None, bytes_data: Optional[bytes] = None) -> Dict[str, Any]:
+        """Payload of a client frame."""
+        if not text_data and not bytes_data:
+            raise FrameDecodeError("Empty frame")
+        try:
+            if bytes_data is not None:
+                payload = msgpack.unpackb(bytes_data, raw=False)
+            else:
+                payload = json.loads(text_data)
+        except (ValueError, msgpack.UnpackException) as e:
+            raise FrameDecodeError(str(e)) from e
+
+        if not isinstance(payload, dict):
+            raise FrameDecodeError("Frame is not an object")
+        return payload
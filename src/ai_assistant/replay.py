@@ -0,0 +1,345 @@
+"""
+OpenRouter Replay
+
+A local stand-in for the OpenRouter chat completions API, so the chat
+pipeline can be load tested without calling openrouter.ai. Completions are
+replayed from recordings: the first recording whose ``match`` pattern is
+found in the last user message (and whose ``model``, if given, is part of
+the requested model) answers the request. Streamed requests get the same
+completion as server-sent events, split into chunks, with tool call
+arguments split across chunks the way OpenRouter sends them.
+
+A recording:
+
+    {
+        "match": "(?i)book",
+        "model": "sonnet",
+        "message": {"content": "...", "tool_calls": [...]},
+        "usage": {"prompt_tokens": 900, "completion_tokens": 60}
+    }
+
+In record mode the stand-in starts from the recordings file alone (no
+built-in recordings); requests without a matching recording are forwarded
+to the real API and the reply is stored for the next run.
+
+Point the app at the stand-in with ``OPENROUTER_BASE_URL=http://127.0.0.1:8787``.
+"""
+
+import re
+import json
+import time
+import uuid
+import random
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Covers the paths a benchmark session takes: small talk for the light
+# model, ACTION_DATA blocks, tool calls and plain full-model replies
+DEFAULT_RECORDINGS = [
+    {
+        "match": r"(?i)^\s*(thanks|thank you|ok|great|hi|hello)\b",
+        "message": {"content": "You're welcome! Let me know if you need anything else."},
+    },
+    {
+        "match": r"(?i)\bavailab",
+        "message": {
+            "content": (
+                "Let me check the availability for you.\n\n"
+                "ACTION_DATA:\n"
+                '{"action": "check_availability", "parameters": {"services": ["Camera A"], '
+                '"start_time": "tomorrow 10:00 AM", "end_time": "tomorrow 4:00 PM"}, '
+                '"confidence": 0.9, "requires_confirmation": false}'
+            )
+        },
+    },
+    {
+        "match": r"(?i)\b(find|search|look up)\b",
+        "message": {
+            "content": "I'll look that customer up.",
+            "tool_calls": [
+                {
+                    "id": "call_search",
+                    "type": "function",
+                    "function": {
+                        "name": "search_customer",
+                        "arguments": '{"query": "Maria", "confidence": 0.9}'
+                    }
+                }
+            ]
+        },
+    },
+    {
+        "match": r"(?i)\b(do we have|exists?|offer)\b",
+        "message": {
+            "content": "Let me check our catalog.",
+            "tool_calls": [
+                {
+                    "id": "call_service",
+                    "type": "function",
+                    "function": {
+                        "name": "check_service_exists",
+                        "arguments": '{"service_name": "Tripod", "confidence": 0.85}'
+                    }
+                }
+            ]
+        },
+    },
+    {
+        "match": r"",
+        "message": {
+            "content": (
+                "I can help with bookings, customers and your service catalog. "
+                "Tell me what you'd like to schedule and when."
+            )
+        },
+    },
+]
+
+
+def load_recordings(path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Recordings from a JSON file, or the built-in set."""
+    if not path:
+        return [dict(recording) for recording in DEFAULT_RECORDINGS]
+    with open(path) as recordings_file:
+        return json.load(recordings_file)
+
+
+def _last_user_message(payload: Dict[str, Any]) -> str:
+    for message in reversed(payload.get("messages") or []):
+        if message.get("role") == "user":
+            content = message.get("content")
+            return content if isinstance(content, str) else json.dumps(content)
+    return ""
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class ReplayStore:
+    """Thread-safe set of recordings, optionally appended to a file."""
+
+    def __init__(self, recordings: List[Dict[str, Any]], record_path: Optional[str] = None):
+        self.recordings = recordings
+        self.record_path = record_path
+        self._lock = threading.Lock()
+
+    def find(self, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        prompt = _last_user_message(payload)
+        model = payload.get("model") or ""
+        with self._lock:
+            for recording in self.recordings:
+                if recording.get("model") and recording["model"] not in model:
+                    continue
+                if re.search(recording.get("match", ""), prompt):
+                    return recording
+        return None
+
+    def add(self, payload: Dict[str, Any], response_data: Dict[str, Any]) -> Dict[str, Any]:
+        message = response_data["choices"][0]["message"]
+        recording = {
+            "match": "^" + re.escape(_last_user_message(payload)) + "$",
+            "model": payload.get("model"),
+            "message": {key: message[key] for key in ("content", "tool_calls") if message.get(key)},
+            "usage": response_data.get("usage") or {},
+        }
+        with self._lock:
+            # Exact recordings go before the catch-all patterns
+            self.recordings.insert(0, recording)
+            if self.record_path:
+                with open(self.record_path, "w") as recordings_file:
+                    json.dump(self.recordings, recordings_file, indent=2)
+        return recording
+
+
+def build_completion(recording: Dict[str, Any], payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Non-streamed chat completion body of a recording."""
+    message = {"role": "assistant", "content": recording["message"].get("content") or ""}
+    if recording["message"].get("tool_calls"):
+        message["tool_calls"] = recording["message"]["tool_calls"]
+    return {
+        "id": f"gen-replay-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model"),
+        "choices": [{
+            "index": 0,
+            "message": message,
+            "finish_reason": "tool_calls" if message.get("tool_calls") else "stop"
+        }],
+        "usage": _usage(recording, payload),
+    }
+
+
+def _usage(recording: Dict[str, Any], payload: Dict[str, Any]) -> Dict[str, Any]:
+    usage = dict(recording.get("usage") or {})
+    usage.setdefault("prompt_tokens", _estimate_tokens(json.dumps(payload.get("messages") or [])))
+    usage.setdefault("completion_tokens", _estimate_tokens(json.dumps(recording["message"])))
+    usage.setdefault("total_tokens", usage["prompt_tokens"] + usage["completion_tokens"])
+    return usage
+
+
+def stream_chunks(recording: Dict[str, Any], payload: Dict[str, Any], chunk_size: int) -> List[Dict[str, Any]]:
+    """Streamed chunks of a recording: text, then tool call fragments, then usage."""
+    model = payload.get("model")
+
+    def chunk(delta: Dict[str, Any], finish_reason: str = None) -> Dict[str, Any]:
+        return {
+            "object": "chat.completion.chunk",
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+
+    chunks = []
+    content = recording["message"].get("content") or ""
+    for start in range(0, len(content), chunk_size):
+        chunks.append(chunk({"content": content[start:start + chunk_size]}))
+
+    tool_calls = recording["message"].get("tool_calls") or []
+    for index, call in enumerate(tool_calls):
+        function = call.get("function") or {}
+        chunks.append(chunk({"tool_calls": [{
+            "index": index,
+            "id": call.get("id") or f"call_{index}",
+            "type": "function",
+            "function": {"name": function.get("name"), "arguments": ""}
+        }]}))
+        arguments = function.get("arguments") or ""
+        if not isinstance(arguments, str):
+            arguments = json.dumps(arguments)
+        for start in range(0, len(arguments), chunk_size):
+            chunks.append(chunk({"tool_calls": [{
+                "index": index,
+                "function": {"arguments": arguments[start:start + chunk_size]}
+            }]}))
+
+    final = chunk({}, "tool_calls" if tool_calls else "stop")
+    final["usage"] = _usage(recording, payload)
+    chunks.append(final)
+    return chunks
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """
+    HTTP server answering ``POST .../chat/completions`` from recordings.
+
+    Args:
+        address: (host, port) to listen on
+        store: Recordings to replay
+        latency_ms: Delay before the response (or the first chunk) is sent
+        jitter_ms: Random extra delay of up to this much
+        chunk_size: Characters per streamed chunk
+        chunk_delay_ms: Delay between streamed chunks
+        upstream: Real API base URL; requests without a recording are
+            forwarded to it and recorded
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        store: ReplayStore,
+        latency_ms: int = 0,
+        jitter_ms: int = 0,
+        chunk_size: int = 16,
+        chunk_delay_ms: int = 0,
+        upstream: Optional[str] = None
+    ):
+        super().__init__(address, ReplayHandler)
+        self.store = store
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.chunk_size = max(1, chunk_size)
+        self.chunk_delay_ms = chunk_delay_ms
+        self.upstream = upstream.rstrip("/") if upstream else None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def first_byte_delay(self) -> float:
+        return (self.latency_ms + random.uniform(0, self.jitter_ms)) / 1000
+
+    def record(self, payload: Dict[str, Any], authorization: str) -> Dict[str, Any]:
+        """Forward a request to the real API and store the completion."""
+        response = requests.post(
+            f"{self.upstream}/chat/completions",
+            headers={"Authorization": authorization, "Content-Type": "application/json"},
+            json={**payload, "stream": False},
+            timeout=120
+        )
+        response.raise_for_status()
+        return self.store.add(payload, response.json())
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "Invalid JSON body"}})
+            return
+
+        recording = self.server.store.find(payload)
+        if recording is None:
+            if not self.server.upstream:
+                self._send_json(404, {"error": {"message": "No recording matches this request"}})
+                return
+            try:
+                recording = self.server.record(payload, self.headers.get("Authorization", ""))
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Recording from upstream failed: {e}")
+                self._send_json(502, {"error": {"message": f"Upstream request failed: {e}"}})
+                return
+
+        time.sleep(self.server.first_byte_delay())
+
+        if payload.get("stream"):
+            self._send_stream(recording, payload)
+        else:
+            self._send_json(200, build_completion(recording, payload))
+
+    def _send_json(self, status_code: int, body: Dict[str, Any]):
+        data = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, recording: Dict[str, Any], payload: Dict[str, Any]):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        chunks = stream_chunks(recording, payload, self.server.chunk_size)
+        for index, chunk in enumerate(chunks):
+            if index and self.server.chunk_delay_ms:
+                time.sleep(self.server.chunk_delay_ms / 1000)
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+        self._write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, text: str):
+        data = text.encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
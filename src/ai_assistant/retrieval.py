@@ -0,0 +1,231 @@
+"""
+Catalog and Customer Retrieval
+
+Finds the services and customers a chat message refers to, so they can be
+listed in the prompt and the model can create a booking in the same turn
+instead of first asking for ``check_service_exists`` and ``search_customer``
+results.
+
+Every phrase of up to three words in the message is looked up in the
+tenant's service name index (``service_catalog.search``) and in a customer
+index built the same way over names, companies and email addresses. Both
+indexes live in process memory, so a turn costs at most one query per index
+for the details of the entries that matched.
+
+Customers are listed by name and company only; their contact details stay
+out of the prompt and are returned by ``search_customer`` when needed.
+"""
+
+import re
+import logging
+from typing import Dict, Any, List, Iterable
+
+from customer.models import Customer
+from service_catalog.models import Service
+from service_catalog.search import ServiceNameIndex, VersionedIndexCache, get_service_index
+from .cache import get_tenant_versions
+from .metrics import MetricsBatch
+
+logger = logging.getLogger(__name__)
+
+# Stricter than the action executor's threshold: phrases of a whole message
+# are not meant to name anything, so weak partial matches are noise
+RETRIEVAL_THRESHOLD = 0.45
+
+MAX_PHRASE_WORDS = 3
+MAX_QUERY_WORDS = 40
+
+_TOKEN_RE = re.compile(r'[a-z0-9@._-]+')
+_NUMERIC_RE = re.compile(r'^\d+(?:am|pm|h|hrs?)?$')
+
+# Words that never name a service or customer on their own
+_STOP_WORDS = frozenset("""
+    a an the and or but for from to of in on at by with without about into
+    i me my we our us you your he she they them it its this that these those
+    is are was were be been am do does did have has had can could would will
+    shall should may might must please thanks thank hi hello hey ok okay yes no
+    book booking bookings schedule reserve rent rental need want like get
+    make add create find search check look up set help
+    customer customers client clients service services equipment
+    today tomorrow yesterday morning afternoon evening night noon
+    next last week weeks day days hour hours month until till pm
+""".split())
+
+LOOKUP_ACTIONS = ("check_service_exists", "search_customer")
+
+
+class CustomerNameIndex(ServiceNameIndex):
+    """
+    Trigram index of the active customers of one tenant.
+
+    Customers are indexed under their full name, company and the local part
+    of their email address, with the same scoring as services.
+    """
+
+    @classmethod
+    def build(cls, user_id: str) -> "CustomerNameIndex":
+        """Load the active customers of a tenant with a single query."""
+        rows = Customer.objects.filter(user_id=user_id, status='active').values_list(
+            'id', 'first_name', 'last_name', 'company', 'email'
+        )
+        return cls(user_id, (
+            (customer_id, f"{first_name} {last_name}", None, None, [company, email.split('@')[0]])
+            for customer_id, first_name, last_name, company, email in rows
+        ))
+
+
+def _customer_version(user_id: str) -> int:
+    try:
+        return get_tenant_versions(user_id, ("customer",))["customer"]
+    except Exception as e:
+        logger.error(f"Failed to read customer version for tenant {user_id}: {e}")
+        return -1
+
+
+# Keyed on the tenant's "customer" version, which ``ai_assistant.signals``
+# bumps on every customer write
+_customer_indexes = VersionedIndexCache(CustomerNameIndex.build, _customer_version)
+
+
+def get_customer_index(user_id: str) -> CustomerNameIndex:
+    """Customer name index of a tenant, rebuilt when its customers changed."""
+    return _customer_indexes.get(user_id)
+
+
+def candidate_phrases(text: str) -> List[str]:
+    """
+    Phrases of up to ``MAX_PHRASE_WORDS`` consecutive words of ``text``.
+
+    Phrases made only of stop words and numbers are left out; stop words
+    inside a phrase are kept so names like "Camera A" still match exactly.
+    """
+    words = _TOKEN_RE.findall((text or '').lower())[:MAX_QUERY_WORDS]
+    phrases = []
+    seen = set()
+    for start in range(len(words)):
+        for end in range(start + 1, min(start + MAX_PHRASE_WORDS, len(words)) + 1):
+            window = words[start:end]
+            if all(word in _STOP_WORDS or _NUMERIC_RE.match(word) for word in window):
+                continue
+            phrase = ' '.join(window)
+            if phrase not in seen:
+                seen.add(phrase)
+                phrases.append(phrase)
+    return phrases
+
+
+def _rank(index: ServiceNameIndex, phrases: Iterable[str], top_k: int) -> List[str]:
+    """Ids of the ``top_k`` entries best matched by any of the phrases."""
+    best = {}
+    for phrase in phrases:
+        for match in index.search(phrase, limit=top_k, min_score=RETRIEVAL_THRESHOLD):
+            if match['score'] > best.get(match['id'], 0):
+                best[match['id']] = match['score']
+    ranked = sorted(best.items(), key=lambda item: -item[1])
+    return [entry_id for entry_id, _ in ranked[:top_k]]
+
+
+def _amount(value) -> str:
+    text = f"{value:f}"
+    return text.rstrip('0').rstrip('.') if '.' in text else text
+
+
+def _rates(service: Dict[str, Any]) -> str:
+    rates = []
+    for field, unit in (('price_per_hour', 'hour'), ('price_per_day', 'day'), ('price_per_week', 'week')):
+        if service.get(field):
+            rates.append(f"{_amount(service[field])}/{unit}")
+    if not rates and service.get('base_price') is not None:
+        rates.append(_amount(service['base_price']))
+    return ', '.join(rates)
+
+
+def retrieve_snippets(user_id: str, text: str, top_k: int = 5) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Services and customers of a tenant that ``text`` refers to.
+
+    Returns:
+        Dictionary with "services" (name, type, rates, quantity) and
+        "customers" (name, company), best match first
+    """
+    phrases = candidate_phrases(text)
+    snippets = {"services": [], "customers": []}
+    if not phrases or top_k <= 0:
+        return snippets
+
+    service_ids = _rank(get_service_index(user_id), phrases, top_k)
+    if service_ids:
+        services = {
+            str(service['id']): service
+            for service in Service.objects.filter(id__in=service_ids, user_id=user_id).values(
+                'id', 'name', 'service_type', 'base_price', 'price_per_hour',
+                'price_per_day', 'price_per_week', 'quantity_available'
+            )
+        }
+        snippets["services"] = [
+            {
+                "name": services[service_id]['name'],
+                "type": services[service_id]['service_type'],
+                "rates": _rates(services[service_id]),
+                "quantity": services[service_id]['quantity_available']
+            }
+            for service_id in service_ids if service_id in services
+        ]
+
+    customer_ids = _rank(get_customer_index(user_id), phrases, top_k)
+    if customer_ids:
+        customers = {
+            str(customer['id']): customer
+            for customer in Customer.objects.filter(id__in=customer_ids, user_id=user_id).values(
+                'id', 'first_name', 'last_name', 'company'
+            )
+        }
+        snippets["customers"] = [
+            {
+                "name": f"{customers[customer_id]['first_name']} {customers[customer_id]['last_name']}".strip(),
+                "company": customers[customer_id]['company']
+            }
+            for customer_id in customer_ids if customer_id in customers
+        ]
+
+    return snippets
+
+
+def booking_round_trips_saved(snippets: Dict[str, Any], actions: List[Dict[str, Any]]) -> List[bool]:
+    """
+    Whether each ``create_booking`` of a reply was made without a lookup turn.
+
+    A booking saves the round trip when every service it names and its
+    customer's name were listed in the prompt and the reply issued no
+    lookup action of its own.
+    """
+    looked_up = any(action.get("action") in LOOKUP_ACTIONS for action in actions)
+    service_names = {service["name"].strip().lower() for service in snippets.get("services") or []}
+    customer_names = {customer["name"].strip().lower() for customer in snippets.get("customers") or []}
+
+    saved = []
+    for action in actions:
+        if action.get("action") != "create_booking":
+            continue
+        parameters = action.get("parameters") or {}
+        names = [
+            (service.get("service_name") or service.get("name") or "") if isinstance(service, dict) else str(service)
+            for service in parameters.get("services") or []
+        ]
+        customer = parameters.get("customer") or {}
+        customer_name = (customer.get("name") or "").strip().lower() if isinstance(customer, dict) else ""
+        saved.append(
+            not looked_up
+            and bool(names)
+            and all(name.strip().lower() in service_names for name in names)
+            and customer_name in customer_names
+        )
+    return saved
+
+
+def record_booking_round_trips(snippets: Dict[str, Any], actions: List[Dict[str, Any]]):
+    """Count the bookings of a reply by whether retrieval saved their lookup turn."""
+    batch = MetricsBatch()
+    for saved in booking_round_trips_saved(snippets, actions):
+        batch.inc("ai_retrieval_bookings_total", round_trip_saved="true" if saved else "false")
+    batch.flush()
@@ -0,0 +1,285 @@
+"""
+Intent Router
+
+Deterministic fast path in front of OpenRouterService. Simple read-only
+requests ("is the Sony A7 available Friday", "find customer Maria Santos")
+are answered from extracted entities: the action runs directly and the
+reply is rendered from a template. Anything ambiguous returns None so the
+turn falls back to the LLM.
+"""
+
+import re
+import time
+import logging
+from typing import Dict, Any, List, Optional
+from datetime import datetime, date, time as dt_time, timedelta
+from django.conf import settings
+from django.utils import timezone
+
+from calendar_mgmt.models import CalendarSettings
+from service_catalog.search import get_service_index, normalize_text
+from .action_executor import ActionExecutor, READ_ONLY_ACTIONS
+
+logger = logging.getLogger(__name__)
+
+ROUTER_MODEL_NAME = "intent_router"
+
+_WEEKDAY_NAMES = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+_MONTH_NAMES = [
+    'january', 'february', 'march', 'april', 'may', 'june', 'july',
+    'august', 'september', 'october', 'november', 'december'
+]
+_FILLER_WORDS_RE = re.compile(r'^(?:for|the|a|an|called|named|my)\s+', re.IGNORECASE)
+_TRAILING_PUNCTUATION_RE = re.compile(r'[\s?!.,;:]+$')
+
+
+class IntentRouter:
+    """
+    Rule-based router that answers simple read-only intents without the LLM.
+
+    A turn is routed only when the extracted entities name exactly one
+    read-only action with enough confidence, no write intent is present, no
+    workflow is in progress and every parameter can be resolved. The result
+    has the same shape as an OpenRouterService response; its actions carry
+    the already computed result so they are recorded, not executed again.
+    """
+
+    def __init__(self):
+        self.settings = settings.AI_ASSISTANT_SETTINGS
+        self.min_confidence = self.settings.get("fast_path_min_confidence", 0.7)
+        self._executor = None
+
+    @property
+    def executor(self) -> ActionExecutor:
+        if self._executor is None:
+            self._executor = ActionExecutor()
+        return self._executor
+
+    def route(
+        self,
+        message_content: str,
+        entities: List[Dict[str, Any]],
+        context: Dict[str, Any] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Answer the message directly, or return None to use the LLM.
+
+        Args:
+            message_content: User's message content
+            entities: Output of EntityExtractionService for the message
+            context: Conversation context of the turn
+
+        Returns:
+            OpenRouterService-style response dictionary, or None
+        """
+        if not self.settings.get("fast_path_enabled", True):
+            return None
+
+        context = context or {}
+        user_id = context.get("user_id")
+        if not user_id or context.get("active_workflow"):
+            return None
+
+        start_time = time.time()
+
+        try:
+            action_type = self._single_intent(entities)
+            if not action_type:
+                return None
+
+            if action_type == 'check_availability':
+                parameters = self._availability_parameters(message_content, entities, user_id)
+            elif action_type == 'search_customer':
+                parameters = self._customer_search_parameters(entities)
+            else:
+                parameters = self._service_lookup_parameters(message_content, entities)
+
+            if parameters is None:
+                return None
+
+            result = self.executor.execute_action(action_type, parameters, user_id)
+            if not result.get('success'):
+                return None
+
+            response_text = self._render_reply(action_type, parameters, result)
+
+        except Exception as e:
+            logger.error(f"Intent router failed, falling back to LLM: {e}")
+            return None
+
+        processing_time = int((time.time() - start_time) * 1000)
+        logger.info(f"Answered {action_type} via intent router in {processing_time}ms")
+
+        return {
+            "success": True,
+            "response_text": response_text,
+            "actions": [{
+                "action": action_type,
+                "parameters": parameters,
+                "requires_confirmation": False,
+                "precomputed_result": result
+            }],
+            "tokens_used": 0,
+            "model_used": ROUTER_MODEL_NAME,
+            "processing_time_ms": processing_time,
+            "routed": True
+        }
+
+    def _single_intent(self, entities: List[Dict[str, Any]]) -> Optional[str]:
+        """The only action intent of the message, if it is a confident read."""
+        intents = {
+            entity["value"] for entity in entities
+            if entity["type"] == "action" and entity.get("confidence", 0) >= self.min_confidence
+        }
+        if len(intents) != 1:
+            return None
+
+        action_type = intents.pop()
+        return action_type if action_type in READ_ONLY_ACTIONS else None
+
+    def _availability_parameters(
+        self,
+        message_content: str,
+        entities: List[Dict[str, Any]],
+        user_id: str
+    ) -> Optional[Dict[str, Any]]:
+        dates = [entity for entity in entities if entity["type"] == "date"]
+        if len(dates) != 1:
+            return None
+
+        day = self._resolve_date(dates[0]["value"])
+        if not day:
+            return None
+
+        service_names = self._match_services(message_content, user_id)
+        if not service_names:
+            return None
+
+        start_time, end_time = self._business_day(day, user_id)
+        return {
+            'services': service_names,
+            'start_time': start_time.isoformat(),
+            'end_time': end_time.isoformat()
+        }
+
+    def _customer_search_parameters(self, entities: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        names = [entity["value"] for entity in entities if entity["type"] == "person_name"]
+        if len(names) != 1:
+            return None
+        return {'query': names[0]}
+
+    def _service_lookup_parameters(
+        self,
+        message_content: str,
+        entities: List[Dict[str, Any]]
+    ) -> Optional[Dict[str, Any]]:
+        # The service name is whatever follows "check/find/search service ..."
+        action = next(entity for entity in entities if entity["type"] == "action")
+        service_name = message_content[action["end"]:].strip()
+        service_name = _FILLER_WORDS_RE.sub('', service_name)
+        service_name = _TRAILING_PUNCTUATION_RE.sub('', service_name)
+
+        if not service_name or len(service_name.split()) > 5:
+            return None
+        return {'service_name': service_name}
+
+    def _resolve_date(self, value: str) -> Optional[date]:
+        """Resolve an unambiguous date entity; "next friday" or 05/06 are left to the LLM."""
+        value = value.lower().strip()
+        today = timezone.localdate()
+
+        if value == 'today':
+            return today
+        if value == 'tomorrow':
+            return today + timedelta(days=1)
+
+        words = value.split()
+        if len(words) == 1 and value in _WEEKDAY_NAMES:
+            return today + timedelta(days=(_WEEKDAY_NAMES.index(value) - today.weekday()) % 7)
+        if len(words) == 2 and words[0] == 'this' and words[1] in _WEEKDAY_NAMES:
+            return today + timedelta(days=(_WEEKDAY_NAMES.index(words[1]) - today.weekday()) % 7)
+        if len(words) == 2 and words[0] in _MONTH_NAMES:
+            try:
+                resolved = date(today.year, _MONTH_NAMES.index(words[0]) + 1, int(words[1]))
+            except ValueError:
+                return None
+            if resolved < today:
+                resolved = resolved.replace(year=today.year + 1)
+            return resolved
+
+        return None
+
+    def _business_day(self, day: date, user_id: str):
+        """Start and end of the tenant's business hours on ``day``."""
+        calendar_settings = CalendarSettings.objects.filter(user_id=user_id).only(
+            'business_hours_start', 'business_hours_end'
+        ).first()
+
+        opens = calendar_settings.business_hours_start if calendar_settings else dt_time(8, 0)
+        closes = calendar_settings.business_hours_end if calendar_settings else dt_time(18, 0)
+
+        return (
+            timezone.make_aware(datetime.combine(day, opens)),
+            timezone.make_aware(datetime.combine(day, closes))
+        )
+
+    def _match_services(self, message_content: str, user_id: str) -> List[str]:
+        """Catalog services named in the message, longest match first."""
+        text = normalize_text(message_content)
+        matches = []
+
+        for service_name, phrases in get_service_index(user_id).aliases():
+            for phrase in phrases:
+                match = re.search(rf'\b{re.escape(phrase)}\b', text)
+                if match:
+                    matches.append((match.start(), match.end(), service_name))
+                    break
+
+        # Drop matches contained in a longer one ("Sony A7" inside "Sony A7 III")
+        matches.sort(key=lambda m: (m[0], -(m[1] - m[0])))
+        service_names = []
+        covered_until = -1
+        for start, end, service_name in matches:
+            if end <= covered_until:
+                continue
+            service_names.append(service_name)
+            covered_until = end
+
+        return service_names
+
+    def _render_reply(self, action_type: str, parameters: Dict[str, Any], result: Dict[str, Any]) -> str:
+        if action_type == 'check_availability':
+            return self._render_availability(result)
+        if action_type == 'search_customer':
+            return self._render_customer_search(parameters, result)
+        return result.get('message', 'Done.')
+
+    def _render_availability(self, result: Dict[str, Any]) -> str:
+        data = result['data']
+        day = datetime.fromisoformat(data['start_time']).strftime('%A, %B %d').replace(' 0', ' ')
+        lines = [f"Here's the availability for {day}:"]
+
+        for service in data['available_services']:
+            quantity = service.get('quantity_available') or 0
+            units = f" ({quantity} available)" if quantity > 1 else ""
+            lines.append(f"- {service['name']} is available{units}")
+        for service in data['unavailable_services']:
+            lines.append(f"- {service['name']} is not available: {service.get('reason', 'Not available')}")
+
+        return "\n".join(lines)
+
+    def _render_customer_search(self, parameters: Dict[str, Any], result: Dict[str, Any]) -> str:
+        customers = result['data']['customers']
+        query = parameters['query']
+
+        if not customers:
+            return f'I couldn\'t find any active customers matching "{query}".'
+
+        lines = [
+            f'I found {len(customers)} customer{"s" if len(customers) != 1 else ""} matching "{query}":'
+        ]
+        for customer in customers:
+            details = ", ".join(value for value in (customer.get('email'), customer.get('phone')) if value)
+            lines.append(f"- {customer['name']}" + (f" ({details})" if details else ""))
+
+        return "\n".join(lines)
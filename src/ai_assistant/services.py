@@ -6,22 +6,127 @@ including OpenRouter API integration, entity extraction, intent recognition,
 and action execution coordination.
 """
 
+import re
 import json
 import time
+import random
+import asyncio
 import logging
+import weakref
+import threading
+import httpx
 import requests
-from typing import Dict, Any, List, Optional, Tuple
+import requests.adapters
+from typing import Dict, Any, List, Optional, Tuple, Callable, Awaitable
+from email.utils import parsedate_to_datetime
 from datetime import datetime, timedelta
 from django.conf import settings
-from django.core.cache import cache
 from django.utils import timezone
-from django.db import transaction
+from django.db import models, transaction, connection
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from asgiref.sync import async_to_sync, sync_to_async
 
 from .models import ChatSession, ChatMessage, AIAction, ConversationContext
+from .cache import AIResponseCache, PreparedActionCache, SingleFlight
+from .limits import LLMLimiter, AILimitExceeded
+from .router import IntentRouter
+from .cascade import (
+    TurnClassifier, LIGHT_SYSTEM_PROMPT, TIER_ROUTER, TIER_LIGHT, TIER_FULL,
+    needs_escalation, annotate_routing
+)
+from .prompts import PromptBuilder, merge_usage_stats
+from .tools import ACTION_TOOLS, TOOL_CALLING_PROMPT, ToolCallStream, parse_tool_calls
+from .summaries import summary_due
+from .history import load_history, serialize_message
+from .metrics import (
+    MetricsBatch, TurnTimer, record_llm_call, arecord_llm_call,
+    OUTCOME_SUCCESS, OUTCOME_CACHED, OUTCOME_COALESCED, OUTCOME_ERROR
+)
+from .action_scheduler import ActionScheduler, EagerReadRunner
+from .action_executor import ActionExecutor
+from .retrieval import retrieve_snippets, record_booking_round_trips
 from users.authentication import SupabaseUser
 
 logger = logging.getLogger(__name__)
 
+ACTION_DATA_MARKER = "ACTION_DATA:"
+
+
+class StreamingTextFilter:
+    """
+    Filters streamed completion text so only the user-visible part is forwarded.
+    Holds back any trailing characters that could be the start of the
+    ACTION_DATA marker and drops everything once the marker is seen.
+    """
+    
+    def __init__(self):
+        self._pending = ""
+        self._stopped = False
+    
+    def feed(self, chunk: str) -> str:
+        """Add a chunk of streamed text and return the part that is safe to show."""
+        if self._stopped:
+            return ""
+        
+        self._pending += chunk
+        marker_index = self._pending.find(ACTION_DATA_MARKER)
+        if marker_index != -1:
+            visible = self._pending[:marker_index]
+            self._pending = ""
+            self._stopped = True
+            return visible
+        
+        # Keep a possible partial marker at the end of the buffer
+        held = 0
+        for size in range(min(len(ACTION_DATA_MARKER) - 1, len(self._pending)), 0, -1):
+            if ACTION_DATA_MARKER.startswith(self._pending[-size:]):
+                held = size
+                break
+        
+        visible = self._pending[:len(self._pending) - held]
+        self._pending = self._pending[len(visible):]
+        return visible
+    
+    def flush(self) -> str:
+        """Return any held-back text once the stream has ended."""
+        if self._stopped:
+            return ""
+        visible, self._pending = self._pending, ""
+        return visible
+
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """
+    Return the process-wide keep-alive session used for OpenRouter calls.
+    
+    Reusing pooled connections avoids a TCP+TLS handshake on every AI turn.
+    Retries are handled by OpenRouterService so Retry-After can be honored.
+    """
+    global _http_session
+    
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                pool_size = settings.AI_ASSISTANT_SETTINGS.get("http_pool_size", 20)
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=pool_size,
+                    max_retries=0
+                )
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _http_session = session
+    
+    return _http_session
+
 
 class OpenRouterService:
     """
@@ -29,11 +134,16 @@ class OpenRouterService:
     Handles AI text generation, conversation management, and response parsing.
     """
     
-    def __init__(self):
+    def __init__(self, model: str = None):
         self.api_key = settings.OPENROUTER_API_KEY
         self.base_url = settings.OPENROUTER_BASE_URL
-        self.model = settings.OPENROUTER_MODEL
+        self.model = model or settings.OPENROUTER_MODEL
         self.settings = settings.AI_ASSISTANT_SETTINGS
+        self.tool_calling = self.settings.get("tool_calling", True)
+        self.response_cache = AIResponseCache()
+        self.single_flight = SingleFlight()
+        self.limiter = LLMLimiter()
+        self.prompt_builder = PromptBuilder()
         
         if not self.api_key:
             logger.error("OpenRouter API key not configured")
@@ -57,109 +167,360 @@ class OpenRouterService:
             Dictionary containing response text, metadata, and extracted actions
         """
         start_time = time.time()
+        flight = None
+        lease = None
+        result = None
+        outcome = OUTCOME_ERROR
+        # Cache lookup counts are written with the call's other metrics
+        metrics = MetricsBatch()
         
         try:
             # Build message array
-            messages = self._build_message_array(prompt, context, system_prompt)
+            messages, prompt_stats = self._build_message_array(prompt, context, system_prompt)
             
             # Prepare request payload
-            payload = {
-                "model": self.model,
-                "messages": messages,
-                "max_tokens": self.settings["max_tokens"],
-                "temperature": self.settings["temperature"],
-                "stream": False
-            }
+            payload = self._build_payload(messages, stream=False, tools=self._get_tools(system_prompt))
             
             # Check cache first
-            cache_key = self._generate_cache_key(payload)
-            cached_response = cache.get(cache_key)
+            cache_key = self.response_cache.build_key(prompt, context, system_prompt, self.model)
+            cached_response = self.response_cache.get(cache_key, metrics)
             if cached_response:
                 logger.info("Using cached response for AI request")
+                outcome = OUTCOME_CACHED
                 return cached_response
             
-            # Make API request
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "https://your-domain.com",  # Required by OpenRouter
-                "X-Title": "AI Scheduling Assistant"
-            }
+            # Identical request already in flight: share its result
+            flight = self.single_flight.fingerprint(payload, (context or {}).get("user_id"))
+            if not self.single_flight.acquire(flight):
+                coalesced = self.single_flight.wait(flight)
+                flight = None
+                if coalesced:
+                    outcome = OUTCOME_COALESCED
+                    return coalesced
             
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=self.settings["timeout"]
-            )
+            # Make API request
+            lease = self.limiter.acquire((context or {}).get("user_id"))
+            response = self._post_completion(payload)
             
             response.raise_for_status()
             response_data = response.json()
             
             # Process response
             processing_time = int((time.time() - start_time) * 1000)
-            result = self._process_response(response_data, processing_time)
+            result = self._process_response(response_data, processing_time, prompt_stats)
             
-            # Cache successful responses
-            cache.set(cache_key, result, self.settings["response_cache_ttl"])
+            # Cache successful responses without write actions
+            self.response_cache.set(cache_key, result)
             
             logger.info(f"AI response generated successfully in {processing_time}ms")
             return result
             
         except requests.exceptions.RequestException as e:
             logger.error(f"OpenRouter API request failed: {e}")
+            return self._error_result(e, start_time)
+        except Exception as e:
+            logger.error(f"Unexpected error in AI response generation: {e}")
+            return self._error_result(e, start_time)
+        finally:
+            self.limiter.release(lease, result)
+            self.single_flight.publish(flight, result)
+            if result and result["success"]:
+                outcome = OUTCOME_SUCCESS
+            record_llm_call(self.model, outcome, time.time() - start_time, False, result, metrics)
+    
+    def stream_response(
+        self,
+        prompt: str,
+        context: Dict[str, Any] = None,
+        system_prompt: str = None,
+        on_delta: Callable[[str], None] = None,
+        on_action: Callable[[Dict[str, Any]], None] = None
+    ) -> Dict[str, Any]:
+        """
+        Generate AI response using OpenRouter's streaming mode.
+        
+        Visible text is passed to ``on_delta`` as soon as OpenRouter emits it;
+        anything after the ACTION_DATA marker is held back so clients never see
+        raw action JSON. Each tool call is passed to ``on_action`` as soon as
+        its arguments are complete. The return value has the same shape as
+        ``generate_response`` once the completion has finished.
+        
+        Args:
+            prompt: User input message
+            context: Conversation context and history
+            system_prompt: Custom system prompt (optional)
+            on_delta: Callback receiving each chunk of visible response text
+            on_action: Callback receiving each action of a completed tool call
+        
+        Returns:
+            Dictionary containing response text, metadata, and extracted actions
+        """
+        start_time = time.time()
+        flight = None
+        lease = None
+        result = None
+        outcome = OUTCOME_ERROR
+        # Cache lookup counts are written with the call's other metrics
+        metrics = MetricsBatch()
+        on_delta = on_delta or (lambda text: None)
+        
+        try:
+            messages, prompt_stats = self._build_message_array(prompt, context, system_prompt)
+            payload = self._build_payload(messages, stream=True, tools=self._get_tools(system_prompt))
+            
+            # Cached completions are replayed as a single delta
+            cache_key = self.response_cache.build_key(prompt, context, system_prompt, self.model)
+            cached_response = self.response_cache.get(cache_key, metrics)
+            if cached_response:
+                logger.info("Using cached response for streamed AI request")
+                outcome = OUTCOME_CACHED
+                on_delta(cached_response["response_text"])
+                return cached_response
+            
+            # Identical request already in flight: share its result
+            flight = self.single_flight.fingerprint(payload, (context or {}).get("user_id"))
+            if not self.single_flight.acquire(flight):
+                coalesced = self.single_flight.wait(flight)
+                flight = None
+                if coalesced:
+                    outcome = OUTCOME_COALESCED
+                    on_delta(coalesced["response_text"])
+                    return coalesced
+            
+            lease = self.limiter.acquire((context or {}).get("user_id"))
+            response = self._post_completion(payload, stream=True)
+            
+            try:
+                response.raise_for_status()
+                text_filter = StreamingTextFilter()
+                tool_stream = ToolCallStream()
+                chunks = []
+                usage = {}
+                
+                for line in response.iter_lines(decode_unicode=True):
+                    event = self._parse_stream_line(line)
+                    if event is None:
+                        continue
+                    if event.get("usage"):
+                        usage = event["usage"]
+                    
+                    content = self._get_stream_delta(event)
+                    if content:
+                        chunks.append(content)
+                        visible = text_filter.feed(content)
+                        if visible:
+                            on_delta(visible)
+                    
+                    for action in tool_stream.feed(event):
+                        if on_action:
+                            on_action(action)
+                
+                remainder = text_filter.flush()
+                if remainder:
+                    on_delta(remainder)
+                for action in tool_stream.finish():
+                    if on_action:
+                        on_action(action)
+            finally:
+                response.close()
+            
+            response_data = {
+                "choices": [{"message": {"content": "".join(chunks)}}],
+                "usage": usage
+            }
+            processing_time = int((time.time() - start_time) * 1000)
+            result = self._process_response(
+                response_data, processing_time, prompt_stats, tool_stream.actions
+            )
+            
+            self.response_cache.set(cache_key, result)
+            
+            logger.info(f"AI response streamed successfully in {processing_time}ms")
+            return result
+            
+        except requests.exceptions.RequestException as e:
+            logger.error(f"OpenRouter streaming request failed: {e}")
+            return self._error_result(e, start_time)
+        except Exception as e:
+            logger.error(f"Unexpected error in AI response streaming: {e}")
+            return self._error_result(e, start_time)
+        finally:
+            self.limiter.release(lease, result)
+            self.single_flight.publish(flight, result)
+            if result and result["success"]:
+                outcome = OUTCOME_SUCCESS
+            record_llm_call(self.model, outcome, time.time() - start_time, True, result, metrics)
+    
+    def _build_payload(
+        self, 
+        messages: List[Dict[str, Any]], 
+        stream: bool = False,
+        tools: List[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Build the chat completion request payload."""
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": self.settings["max_tokens"],
+            "temperature": self.settings["temperature"],
+            "stream": stream
+        }
+        
+        if tools:
+            payload["tools"] = tools
+            payload["tool_choice"] = "auto"
+        
+        if stream:
+            # Ask OpenRouter to append token usage to the final chunk
+            payload["usage"] = {"include": True}
+        
+        return payload
+    
+    def _get_headers(self) -> Dict[str, str]:
+        """Build OpenRouter request headers."""
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": "https://your-domain.com",  # Required by OpenRouter
+            "X-Title": "AI Scheduling Assistant"
+        }
+    
+    def _post_completion(self, payload: Dict[str, Any], stream: bool = False) -> requests.Response:
+        """
+        POST a chat completion over the pooled session, retrying transient failures.
+        
+        Connection errors and 429/5xx responses are retried up to
+        ``retry_attempts`` times with jittered exponential backoff, honoring
+        Retry-After when the provider sends it. Read timeouts are not retried.
+        """
+        session = get_http_session()
+        attempt = 0
+        
+        while True:
+            try:
+                response = session.post(
+                    f"{self.base_url}/chat/completions",
+                    headers=self._get_headers(),
+                    json=payload,
+                    timeout=(self.settings["connect_timeout"], self.settings["timeout"]),
+                    stream=stream
+                )
+            except requests.exceptions.ConnectionError as e:
+                if attempt >= self.settings["retry_attempts"]:
+                    raise
+                delay = self._get_retry_delay(attempt)
+                logger.warning(f"OpenRouter connection failed ({e}), retrying in {delay:.2f}s")
+            else:
+                if (response.status_code not in RETRYABLE_STATUS_CODES or 
+                        attempt >= self.settings["retry_attempts"]):
+                    return response
+                delay = self._get_retry_delay(attempt, response.headers.get("Retry-After"))
+                response.close()
+                logger.warning(f"OpenRouter returned {response.status_code}, retrying in {delay:.2f}s")
+            
+            time.sleep(delay)
+            attempt += 1
+    
+    def _get_retry_delay(self, attempt: int, retry_after: str = None) -> float:
+        """Compute the wait before the next retry, preferring the provider's Retry-After."""
+        max_delay = self.settings["retry_max_delay"]
+        
+        if retry_after:
+            try:
+                return min(max_delay, max(0.0, float(retry_after)))
+            except ValueError:
+                try:
+                    retry_at = parsedate_to_datetime(retry_after)
+                    return min(max_delay, max(0.0, (retry_at - timezone.now()).total_seconds()))
+                except (TypeError, ValueError):
+                    pass
+        
+        # Full jitter: spread retries from concurrent turns across the window
+        return random.uniform(0, min(max_delay, self.settings["retry_backoff_base"] * (2 ** attempt)))
+    
+    def _parse_stream_line(self, line: str) -> Optional[Dict[str, Any]]:
+        """Parse a single server-sent events line from a streamed completion."""
+        if not line or not line.startswith("data:"):
+            # Blank separators and ": OPENROUTER PROCESSING" keep-alive comments
+            return None
+        
+        data = line[len("data:"):].strip()
+        if not data or data == "[DONE]":
+            return None
+        
+        try:
+            return json.loads(data)
+        except json.JSONDecodeError:
+            logger.warning(f"Skipping malformed stream chunk: {data[:100]}")
+            return None
+    
+    def _get_stream_delta(self, event: Dict[str, Any]) -> str:
+        """Extract the content delta from a streamed completion chunk."""
+        if event.get("error"):
+            raise ValueError(event["error"].get("message", "Streaming error from AI provider"))
+        
+        choices = event.get("choices") or []
+        if not choices:
+            return ""
+        return (choices[0].get("delta") or {}).get("content") or ""
+    
+    def _error_result(self, error: Exception, start_time: float) -> Dict[str, Any]:
+        """Build the failure payload returned to callers."""
+        if isinstance(error, AILimitExceeded):
             return {
                 "success": False,
-                "error": f"AI service temporarily unavailable: {str(e)}",
-                "response_text": "I'm having trouble connecting to my AI service. Please try again in a moment.",
+                "error": str(error),
+                "limit_reason": error.reason,
+                "response_text": (
+                    "You've reached your plan's AI usage limit for now. Please try again later."
+                    if error.reason == "budget" else
+                    "I'm handling a lot of requests right now. Please try again in a moment."
+                ),
                 "processing_time_ms": int((time.time() - start_time) * 1000)
             }
-        except Exception as e:
-            logger.error(f"Unexpected error in AI response generation: {e}")
+        if isinstance(error, (requests.exceptions.RequestException, httpx.HTTPError)):
             return {
                 "success": False,
-                "error": str(e),
-                "response_text": "I encountered an unexpected error. Please try again.",
+                "error": f"AI service temporarily unavailable: {str(error)}",
+                "response_text": "I'm having trouble connecting to my AI service. Please try again in a moment.",
                 "processing_time_ms": int((time.time() - start_time) * 1000)
             }
+        return {
+            "success": False,
+            "error": str(error),
+            "response_text": "I encountered an unexpected error. Please try again.",
+            "processing_time_ms": int((time.time() - start_time) * 1000)
+        }
     
     def _build_message_array(
         self, 
         prompt: str, 
         context: Dict[str, Any] = None,
         system_prompt: str = None
-    ) -> List[Dict[str, str]]:
-        """Build the message array for OpenRouter API request."""
-        
-        messages = []
-        
-        # Add system prompt
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Build the token-budgeted message array and its prompt stats."""
+        # Retrieved entries back the actions of the default prompt only
+        snippets = None
         if not system_prompt:
             system_prompt = self._get_default_system_prompt()
+            snippets = (context or {}).get("retrieved_snippets")
         
-        messages.append({
-            "role": "system",
-            "content": system_prompt
-        })
-        
-        # Add conversation history from context
-        if context and "message_history" in context:
-            for msg in context["message_history"][-self.settings["context_window_size"]:]:
-                messages.append({
-                    "role": "user" if msg["sender_type"] == "user" else "assistant",
-                    "content": msg["content"]
-                })
-        
-        # Add current user message
-        messages.append({
-            "role": "user",
-            "content": prompt
-        })
-        
-        return messages
+        return self.prompt_builder.build(prompt, system_prompt, context, snippets)
+    
+    def _get_tools(self, system_prompt: str = None) -> Optional[List[Dict[str, Any]]]:
+        """Action tools offered with the default system prompt."""
+        if self.tool_calling and not system_prompt:
+            return ACTION_TOOLS
+        return None
     
     def _get_default_system_prompt(self) -> str:
         """Get the default system prompt for the AI assistant."""
+        if self.tool_calling:
+            return f"{self._get_base_system_prompt()}\n\n{TOOL_CALLING_PROMPT}"
+        return self._get_base_system_prompt()
+    
+    def _get_base_system_prompt(self) -> str:
+        """System prompt with actions written as ACTION_DATA blocks."""
         return """You are an AI assistant for a service-based and equipment scheduling business. Your primary role is to help business owners manage their schedules, customers, services and equipment through natural language commands.
 
 CORE PRINCIPLE: When information is incomplete or unclear, ALWAYS ask clarifying questions before taking action. Never make assumptions about missing data.
@@ -173,6 +534,9 @@ WORKFLOW PRIORITY:
 6. THEN: Create bookings with proper relationships
 7. Update all relevant pages (calendar, customers, services)
 
+MATCHING CATALOG ENTRIES AND CUSTOMERS:
+A system message may list the services and customers that match the user's message. Listed entries exist: use their exact names and emails in create_booking right away instead of running check_service_exists or search_customer first. Only look up services and customers that are not listed.
+
 AVAILABLE ACTIONS:
 - create_service: Add new services or equipment to catalog
 - update_service: Modify service details or pricing
@@ -379,7 +743,7 @@ ACTION_DATA:
 {
   "action": "search_customer",
   "parameters": {
-    "name": "John Smith"
+    "query": "John Smith"
   },
   "confidence": 0.9,
   "requires_confirmation": false
@@ -493,18 +857,33 @@ Always be helpful, professional, and patient. Guide users through providing comp
 
 When in doubt, ask! It's better to ask clarifying questions than to create incomplete or incorrect records in the system."""
     
-    def _process_response(self, response_data: Dict[str, Any], processing_time: int) -> Dict[str, Any]:
-        """Process OpenRouter API response and extract actions."""
+    def _process_response(
+        self, 
+        response_data: Dict[str, Any], 
+        processing_time: int,
+        prompt_stats: Dict[str, Any] = None,
+        tool_actions: List[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Process OpenRouter API response and extract actions.
+        
+        Actions come from the message's tool calls (or ``tool_actions``
+        already assembled from a stream), followed by any ACTION_DATA
+        blocks in the text for models that write actions inline.
+        """
         
         try:
-            # Extract response text
-            response_text = response_data["choices"][0]["message"]["content"]
+            # Extract response text; replies with only tool calls have none
+            message = response_data["choices"][0]["message"]
+            response_text = message.get("content") or ""
             
             # Extract tokens used
             tokens_used = response_data.get("usage", {}).get("total_tokens", 0)
             
-            # Parse actions from response
-            actions = self._extract_actions_from_response(response_text)
+            # Parse actions from tool calls, then from response text
+            if tool_actions is None:
+                tool_actions = parse_tool_calls(message)
+            actions = tool_actions + self._extract_actions_from_response(response_text)
             
             # Clean response text (remove action data)
             clean_text = self._clean_response_text(response_text)
@@ -516,7 +895,8 @@ When in doubt, ask! It's better to ask clarifying questions than to create incom
                 "actions": actions,
                 "tokens_used": tokens_used,
                 "processing_time_ms": processing_time,
-                "model_used": self.model
+                "model_used": self.model,
+                "prompt_stats": merge_usage_stats(prompt_stats, response_data.get("usage") or {})
             }
             
         except (KeyError, IndexError) as e:
@@ -534,9 +914,9 @@ When in doubt, ask! It's better to ask clarifying questions than to create incom
         
         try:
             # Look for ACTION_DATA: markers
-            if "ACTION_DATA:" in response_text:
+            if ACTION_DATA_MARKER in response_text:
                 # Split by ACTION_DATA: and process each action
-                parts = response_text.split("ACTION_DATA:")
+                parts = response_text.split(ACTION_DATA_MARKER)
                 for part in parts[1:]:  # Skip first part (before any ACTION_DATA)
                     # Extract JSON from this part
                     lines = part.strip().split("\n")
@@ -567,22 +947,316 @@ When in doubt, ask! It's better to ask clarifying questions than to create incom
     
     def _clean_response_text(self, response_text: str) -> str:
         """Remove action data from response text for clean display."""
-        if "ACTION_DATA:" in response_text:
-            return response_text.split("ACTION_DATA:")[0].strip()
+        if ACTION_DATA_MARKER in response_text:
+            return response_text.split(ACTION_DATA_MARKER)[0].strip()
         return response_text.strip()
+
+
+# Pooled async clients, one per running event loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Return the pooled async HTTP client for the running event loop.
+    
+    httpx clients are bound to the loop they were first used on, so one client
+    is kept per loop and shared by every consumer running on it.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        ai_settings = settings.AI_ASSISTANT_SETTINGS
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=ai_settings.get("http_pool_size", 20),
+                max_keepalive_connections=ai_settings.get("http_pool_size", 20)
+            ),
+            timeout=httpx.Timeout(
+                ai_settings["timeout"],
+                connect=ai_settings["connect_timeout"]
+            )
+        )
+        _async_clients[loop] = client
+    return client
+
+
+class AsyncOpenRouterService(OpenRouterService):
+    """
+    asyncio variant of OpenRouterService for the WebSocket path.
+    Uses a shared pooled httpx client so waiting on OpenRouter does not
+    occupy a worker thread.
+    """
+    
+    async def agenerate_response(
+        self, 
+        prompt: str, 
+        context: Dict[str, Any] = None,
+        system_prompt: str = None
+    ) -> Dict[str, Any]:
+        """Async counterpart of ``generate_response``."""
+        start_time = time.time()
+        flight = None
+        lease = None
+        result = None
+        outcome = OUTCOME_ERROR
+        # Cache lookup counts are written with the call's other metrics
+        metrics = MetricsBatch()
+        
+        try:
+            messages, prompt_stats = self._build_message_array(prompt, context, system_prompt)
+            payload = self._build_payload(messages, stream=False, tools=self._get_tools(system_prompt))
+            
+            cache_key = await sync_to_async(self.response_cache.build_key)(
+                prompt, context, system_prompt, self.model
+            )
+            cached_response = await self.response_cache.aget(cache_key, metrics)
+            if cached_response:
+                logger.info("Using cached response for AI request")
+                outcome = OUTCOME_CACHED
+                return cached_response
+            
+            # Identical request already in flight: share its result
+            flight = self.single_flight.fingerprint(payload, (context or {}).get("user_id"))
+            if not await self.single_flight.aacquire(flight):
+                coalesced = await self.single_flight.await_result(flight)
+                flight = None
+                if coalesced:
+                    outcome = OUTCOME_COALESCED
+                    return coalesced
+            
+            lease = await self.limiter.aacquire((context or {}).get("user_id"))
+            response = await self._apost_completion(payload)
+            
+            response.raise_for_status()
+            response_data = response.json()
+            
+            processing_time = int((time.time() - start_time) * 1000)
+            result = self._process_response(response_data, processing_time, prompt_stats)
+            
+            await self.response_cache.aset(cache_key, result)
+            
+            logger.info(f"AI response generated successfully in {processing_time}ms")
+            return result
+            
+        except httpx.HTTPError as e:
+            logger.error(f"OpenRouter API request failed: {e}")
+            return self._error_result(e, start_time)
+        except Exception as e:
+            logger.error(f"Unexpected error in AI response generation: {e}")
+            return self._error_result(e, start_time)
+        finally:
+            await self.limiter.arelease(lease, result)
+            await self.single_flight.apublish(flight, result)
+            if result and result["success"]:
+                outcome = OUTCOME_SUCCESS
+            await arecord_llm_call(self.model, outcome, time.time() - start_time, False, result, metrics)
+    
+    async def astream_response(
+        self,
+        prompt: str,
+        context: Dict[str, Any] = None,
+        system_prompt: str = None,
+        on_delta: Callable[[str], Awaitable[None]] = None,
+        on_action: Callable[[Dict[str, Any]], None] = None
+    ) -> Dict[str, Any]:
+        """
+        Async counterpart of ``stream_response``; ``on_delta`` is awaited,
+        ``on_action`` is called directly and must not block.
+        """
+        start_time = time.time()
+        flight = None
+        lease = None
+        result = None
+        outcome = OUTCOME_ERROR
+        # Cache lookup counts are written with the call's other metrics
+        metrics = MetricsBatch()
+        
+        try:
+            messages, prompt_stats = self._build_message_array(prompt, context, system_prompt)
+            payload = self._build_payload(messages, stream=True, tools=self._get_tools(system_prompt))
+            
+            cache_key = await sync_to_async(self.response_cache.build_key)(
+                prompt, context, system_prompt, self.model
+            )
+            cached_response = await self.response_cache.aget(cache_key, metrics)
+            if cached_response:
+                logger.info("Using cached response for streamed AI request")
+                outcome = OUTCOME_CACHED
+                if on_delta:
+                    await on_delta(cached_response["response_text"])
+                return cached_response
+            
+            # Identical request already in flight: share its result
+            flight = self.single_flight.fingerprint(payload, (context or {}).get("user_id"))
+            if not await self.single_flight.aacquire(flight):
+                coalesced = await self.single_flight.await_result(flight)
+                flight = None
+                if coalesced:
+                    outcome = OUTCOME_COALESCED
+                    if on_delta:
+                        await on_delta(coalesced["response_text"])
+                    return coalesced
+            
+            text_filter = StreamingTextFilter()
+            tool_stream = ToolCallStream()
+            chunks = []
+            usage = {}
+            
+            lease = await self.limiter.aacquire((context or {}).get("user_id"))
+            response = await self._apost_completion(payload, stream=True)
+            
+            try:
+                response.raise_for_status()
+                
+                async for line in response.aiter_lines():
+                    event = self._parse_stream_line(line)
+                    if event is None:
+                        continue
+                    if event.get("usage"):
+                        usage = event["usage"]
+                    
+                    content = self._get_stream_delta(event)
+                    if content:
+                        chunks.append(content)
+                        visible = text_filter.feed(content)
+                        if visible and on_delta:
+                            await on_delta(visible)
+                    
+                    for action in tool_stream.feed(event):
+                        if on_action:
+                            on_action(action)
+            finally:
+                await response.aclose()
+            
+            remainder = text_filter.flush()
+            if remainder and on_delta:
+                await on_delta(remainder)
+            for action in tool_stream.finish():
+                if on_action:
+                    on_action(action)
+            
+            response_data = {
+                "choices": [{"message": {"content": "".join(chunks)}}],
+                "usage": usage
+            }
+            processing_time = int((time.time() - start_time) * 1000)
+            result = self._process_response(
+                response_data, processing_time, prompt_stats, tool_stream.actions
+            )
+            
+            await self.response_cache.aset(cache_key, result)
+            
+            logger.info(f"AI response streamed successfully in {processing_time}ms")
+            return result
+            
+        except httpx.HTTPError as e:
+            logger.error(f"OpenRouter streaming request failed: {e}")
+            return self._error_result(e, start_time)
+        except Exception as e:
+            logger.error(f"Unexpected error in AI response streaming: {e}")
+            return self._error_result(e, start_time)
+        finally:
+            await self.limiter.arelease(lease, result)
+            await self.single_flight.apublish(flight, result)
+            if result and result["success"]:
+                outcome = OUTCOME_SUCCESS
+            await arecord_llm_call(self.model, outcome, time.time() - start_time, True, result, metrics)
+
+    
+    async def _apost_completion(self, payload: Dict[str, Any], stream: bool = False) -> httpx.Response:
+        """Async counterpart of ``_post_completion`` using the pooled httpx client."""
+        client = get_async_http_client()
+        attempt = 0
+        
+        while True:
+            request = client.build_request(
+                "POST",
+                f"{self.base_url}/chat/completions",
+                headers=self._get_headers(),
+                json=payload
+            )
+            try:
+                response = await client.send(request, stream=stream)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                if attempt >= self.settings["retry_attempts"]:
+                    raise
+                delay = self._get_retry_delay(attempt)
+                logger.warning(f"OpenRouter connection failed ({e}), retrying in {delay:.2f}s")
+            else:
+                if (response.status_code not in RETRYABLE_STATUS_CODES or 
+                        attempt >= self.settings["retry_attempts"]):
+                    return response
+                delay = self._get_retry_delay(attempt, response.headers.get("Retry-After"))
+                await response.aclose()
+                logger.warning(f"OpenRouter returned {response.status_code}, retrying in {delay:.2f}s")
+            
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+_WEEKDAYS = r'monday|tuesday|wednesday|thursday|friday|saturday|sunday'
+_MONTHS = r'january|february|march|april|may|june|july|august|september|october|november|december'
+
+# Entity patterns as (group, entity type, action type, confidence, regex).
+# Earlier entries win when several patterns match at the same position, so
+# longer and more specific phrases come first.
+_ENTITY_SPECS = [
+    # Dates
+    ('date_relative_weekday', 'date', None, 0.8, rf'\b(?:next|this)\s+(?:{_WEEKDAYS})\b'),
+    ('date_weekday', 'date', None, 0.8, rf'\b(?:{_WEEKDAYS})\b'),
+    ('date_numeric', 'date', None, 0.8, r'\b\d{1,2}[-/]\d{1,2}[-/]\d{2,4}\b'),
+    ('date_month_day', 'date', None, 0.8, rf'\b(?:{_MONTHS})\s+\d{{1,2}}\b'),
+    ('date_relative_day', 'date', None, 0.8, r'\b(?:tomorrow|today|yesterday)\b'),
     
-    def _generate_cache_key(self, payload: Dict[str, Any]) -> str:
-        """Generate cache key for response caching."""
-        # Create hash of the payload for caching
-        import hashlib
-        payload_str = json.dumps(payload, sort_keys=True)
-        return f"ai_response:{hashlib.md5(payload_str.encode()).hexdigest()}"
+    # Multi-word action phrases
+    ('action_create_customer', 'action', 'create_customer', 0.7, r'\b(?:add|create|new)\s+(?:customer|client)\b'),
+    ('action_create_service', 'action', 'create_service', 0.7, r'\b(?:add|create|new)\s+(?:service|equipment)\b'),
+    ('action_update_service', 'action', 'update_service', 0.7, r'\b(?:update|modify|change)\s+(?:service|equipment|price|rate)\b'),
+    ('action_search_customer', 'action', 'search_customer', 0.7, r'\b(?:find|search|look\s+up|lookup)\s+(?:for\s+)?(?:a\s+|the\s+)?(?:customer|client)s?\b'),
+    ('action_check_service_exists', 'action', 'check_service_exists', 0.7, r'\b(?:check|find|search)\s+(?:service|equipment)\b'),
+    # Only the verb is consumed so entities between it and the noun are still found
+    ('action_create_item', 'action', 'create_service', 0.7, r'\b(?:add|create)\b(?=\s+.+\s+(?:camera|lens|equipment|service)\b)'),
+    ('action_price_statement', 'action', 'create_service', 0.7, r'\b(?:rate|price|cost)\s+is\b'),
+    
+    # Equipment
+    ('equipment_camera', 'equipment', None, 0.8, r'\bcamera(?:\s*[A-Z])?\b'),
+    ('equipment_item', 'equipment', None, 0.8, r'\b(?:lens\s*kit|tripod|flash|microphone|battery\s*pack|memory\s*card)\b'),
+    
+    # Single-word actions
+    ('action_create_booking', 'action', 'create_booking', 0.7, r'\b(?:book|schedule|reserve)\b'),
+    ('action_update_booking', 'action', 'update_booking', 0.7, r'\b(?:change|modify|update|reschedule)\b'),
+    ('action_cancel_booking', 'action', 'cancel_booking', 0.7, r'\b(?:cancel|delete|remove)\b'),
+    ('action_check_availability', 'action', 'check_availability', 0.7, r'\b(?:check|available|availability)\b'),
+]
+
+# Capitalized words that are never part of a person's name
+_NAME_STOP_WORDS = (
+    rf'(?:{_WEEKDAYS}|today|tomorrow|yesterday|camera|add|create|find|search|book|schedule|reserve|'
+    r'change|modify|update|reschedule|cancel|delete|remove|check|available|availability)\b'
+)
+_NAME_WORD = rf'(?!(?i:{_NAME_STOP_WORDS}))[A-Z][a-z]+'
+_ENTITY_SPECS.append(
+    ('person_name', 'person_name', None, 0.7, rf'\b(?-i:{_NAME_WORD}(?:\s+{_NAME_WORD})*)\b')
+)
+
+_ENTITY_PATTERN = re.compile(
+    '|'.join(f'(?P<{group}>{pattern})' for group, _, _, _, pattern in _ENTITY_SPECS),
+    re.IGNORECASE
+)
+_ENTITY_GROUPS = {
+    group: (entity_type, action_type, confidence)
+    for group, entity_type, action_type, confidence, _ in _ENTITY_SPECS
+}
 
 
 class EntityExtractionService:
     """
     Service for extracting entities from user messages.
     Identifies dates, names, equipment, and other relevant business entities.
+    
+    All patterns are combined into one precompiled regex and the text is
+    scanned once, so overlapping matches resolve to a single entity.
     """
     
     def extract_entities(self, text: str, context: Dict[str, Any] = None) -> List[Dict[str, Any]]:
@@ -594,135 +1268,98 @@ class EntityExtractionService:
             context: Conversation context for better extraction
         
         Returns:
-            List of extracted entities with type, value, and confidence
+            List of extracted entities with type, value, and confidence,
+            ordered by position in the text
         """
         entities = []
         
-        # Basic entity extraction patterns
-        entities.extend(self._extract_dates(text))
-        entities.extend(self._extract_names(text))
-        entities.extend(self._extract_equipment(text))
-        entities.extend(self._extract_actions(text))
-        
-        return entities
-    
-    def _extract_dates(self, text: str) -> List[Dict[str, Any]]:
-        """Extract date entities from text."""
-        import re
-        from dateutil import parser
-        
-        entities = []
-        
-        # Common date patterns
-        date_patterns = [
-            r'\b(next|this)\s+(monday|tuesday|wednesday|thursday|friday|saturday|sunday)\b',
-            r'\b(monday|tuesday|wednesday|thursday|friday|saturday|sunday)\b',
-            r'\b(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})\b',
-            r'\b(january|february|march|april|may|june|july|august|september|october|november|december)\s+\d{1,2}\b',
-            r'\btomorrow\b',
-            r'\btoday\b',
-            r'\byesterday\b',
-        ]
-        
-        for pattern in date_patterns:
-            matches = re.finditer(pattern, text, re.IGNORECASE)
-            for match in matches:
-                entities.append({
-                    "type": "date",
-                    "value": match.group(),
-                    "start": match.start(),
-                    "end": match.end(),
-                    "confidence": 0.8
-                })
-        
-        return entities
-    
-    def _extract_names(self, text: str) -> List[Dict[str, Any]]:
-        """Extract name entities from text."""
-        import re
-        
-        entities = []
-        
-        # Simple name pattern (capitalized words)
-        name_pattern = r'\b[A-Z][a-z]+(?:\s+[A-Z][a-z]+)*\b'
-        
-        matches = re.finditer(name_pattern, text)
-        for match in matches:
-            # Skip common words that aren't names
-            name = match.group()
-            if name.lower() not in ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday', 'Camera']:
+        for match in _ENTITY_PATTERN.finditer(text):
+            entity_type, action_type, confidence = _ENTITY_GROUPS[match.lastgroup]
+            
+            if action_type:
                 entities.append({
-                    "type": "person_name",
-                    "value": name,
+                    "type": "action",
+                    "value": action_type,
+                    "text": match.group(),
                     "start": match.start(),
                     "end": match.end(),
-                    "confidence": 0.7
+                    "confidence": confidence
                 })
-        
-        return entities
-    
-    def _extract_equipment(self, text: str) -> List[Dict[str, Any]]:
-        """Extract equipment entities from text."""
-        import re
-        
-        entities = []
-        
-        # Camera equipment patterns
-        equipment_patterns = [
-            r'\bcamera\s*[A-Z]?\b',
-            r'\blens\s*kit\b',
-            r'\btripod\b',
-            r'\bflash\b',
-            r'\bmicrophone\b',
-            r'\bbattery\s*pack\b',
-            r'\bmemory\s*card\b',
-        ]
-        
-        for pattern in equipment_patterns:
-            matches = re.finditer(pattern, text, re.IGNORECASE)
-            for match in matches:
+            else:
                 entities.append({
-                    "type": "equipment",
+                    "type": entity_type,
                     "value": match.group(),
                     "start": match.start(),
                     "end": match.end(),
-                    "confidence": 0.8
+                    "confidence": confidence
                 })
         
         return entities
+
+
+class ChatTurnPublisher:
+    """
+    Pushes the progress of a queued chat turn to the user's chat channel group.
+    ChatConsumer instances join ``chat_{user_id}`` after authenticating.
+    """
     
-    def _extract_actions(self, text: str) -> List[Dict[str, Any]]:
-        """Extract action entities from text."""
-        import re
-        
-        entities = []
-        
-        # Action patterns
-        action_patterns = {
-            'create_booking': [r'\b(book|schedule|reserve)\b'],
-            'update_booking': [r'\b(change|modify|update|reschedule)\b'],
-            'cancel_booking': [r'\b(cancel|delete|remove)\b'],
-            'check_availability': [r'\b(check|available|availability)\b'],
-            'create_customer': [r'\b(add|create|new)\s+(customer|client)\b'],
-            'create_service': [r'\b(add|create|new)\s+(service|equipment)\b', r'\b(add|create)\s+.+\s+(camera|lens|equipment|service)\b', r'\brate\s+is\b', r'\bprice\s+is\b', r'\bcost\s+is\b'],
-            'update_service': [r'\b(update|modify|change)\s+(service|equipment|price|rate)\b'],
-            'check_service_exists': [r'\b(check|find|search)\s+(service|equipment)\b'],
-        }
-        
-        for action_type, patterns in action_patterns.items():
-            for pattern in patterns:
-                matches = re.finditer(pattern, text, re.IGNORECASE)
-                for match in matches:
-                    entities.append({
-                        "type": "action",
-                        "value": action_type,
-                        "text": match.group(),
-                        "start": match.start(),
-                        "end": match.end(),
-                        "confidence": 0.7
-                    })
-        
-        return entities
+    def __init__(self, user_id: str, user_message_id: int):
+        self.group_name = chat_group_name(user_id)
+        self.user_message_id = user_message_id
+        self.channel_layer = get_channel_layer()
+        self._delta_index = 0
+    
+    def send_delta(self, text: str):
+        """Forward a chunk of streamed response text."""
+        self._group_send({
+            'type': 'chat.turn.delta',
+            'user_message_id': self.user_message_id,
+            'delta': text,
+            'index': self._delta_index
+        })
+        self._delta_index += 1
+    
+    def send_result(self, result: Dict[str, Any]):
+        """Forward the final result of the turn."""
+        self._group_send({
+            'type': 'chat.turn.result',
+            'user_message_id': self.user_message_id,
+            'result': result
+        })
+    
+    def _group_send(self, message: Dict[str, Any]):
+        if not self.channel_layer:
+            return
+        try:
+            async_to_sync(self.channel_layer.group_send)(self.group_name, message)
+        except Exception as e:
+            logger.error(f"Failed to publish chat turn update to {self.group_name}: {e}")
+
+
+def chat_group_name(user_id: str) -> str:
+    """Channel layer group that receives a user's queued chat turn updates."""
+    return f"chat_{user_id}"
+
+
+def parse_confirmation(value: Any) -> bool:
+    """
+    The ``confirmed`` flag of an action confirmation request.
+
+    Missing values mean not confirmed. Besides booleans only "true"/"1" and
+    "false"/"0" are accepted, so a string like "false" never confirms.
+
+    Raises:
+        ValueError: If the value is none of these
+    """
+    if value is None or isinstance(value, bool):
+        return bool(value)
+    if isinstance(value, str):
+        normalized = value.strip().lower()
+        if normalized in ('true', '1'):
+            return True
+        if normalized in ('false', '0'):
+            return False
+    raise ValueError(f"Invalid confirmed value: {value!r}")
 
 
 class AIAssistantService:
@@ -733,13 +1370,19 @@ class AIAssistantService:
     
     def __init__(self):
         self.openrouter = OpenRouterService()
+        self.async_openrouter = AsyncOpenRouterService()
         self.entity_extractor = EntityExtractionService()
+        self.intent_router = IntentRouter()
+        self.turn_classifier = TurnClassifier()
+        self.light_openrouter = OpenRouterService(model=self.turn_classifier.light_model)
+        self.async_light_openrouter = AsyncOpenRouterService(model=self.turn_classifier.light_model)
     
     def process_message(
         self, 
         user: SupabaseUser, 
         message_content: str, 
-        session_id: str = None
+        session_id: str = None,
+        on_delta: Callable[[str], None] = None
     ) -> Dict[str, Any]:
         """
         Process a user message through the AI assistant pipeline.
@@ -748,79 +1391,466 @@ class AIAssistantService:
             user: Authenticated user
             message_content: User's message content
             session_id: Optional session ID for conversation context
+            on_delta: Optional callback for streamed response text; when given
+                the completion is streamed from OpenRouter token by token
         
         Returns:
             Dictionary containing AI response and action results
         """
         start_time = time.time()
+        turn = None
         
         try:
-            with transaction.atomic():
-                # Get or create session
-                session = self._get_or_create_session(user.id, session_id)
-                
-                # Save user message
-                user_message = self._save_user_message(
-                    user.id, message_content, session.id
+            # Phase 1 (transactional): record the user turn and gather context
+            turn = self._begin_turn(user, message_content, session_id)
+            
+            # Phase 2 (no transaction): the slow LLM round trip
+            self._release_db_connection()
+            with turn["timer"].phase("llm"):
+                ai_response = self._generate_ai_response(
+                    message_content, turn["context"], on_delta, turn["entities"], turn["timer"]
                 )
+            
+            # Phase 3 (transactional): persist the reply and run actions
+            return self._complete_turn(user, turn, ai_response, start_time)
                 
-                # Extract entities
+        except Exception as e:
+            logger.error(f"Error processing message: {e}")
+            if turn:
+                self._fail_turn(turn, str(e))
+            return {
+                "success": False,
+                "error": f"Failed to process message: {str(e)}",
+                "processing_time_ms": int((time.time() - start_time) * 1000)
+            }
+    
+    async def aprocess_message(
+        self, 
+        user: SupabaseUser, 
+        message_content: str, 
+        session_id: str = None,
+        on_delta: Callable[[str], Awaitable[None]] = None
+    ) -> Dict[str, Any]:
+        """
+        Async entry point for the WebSocket path.
+        
+        Same pipeline as ``process_message``, but the LLM call is awaited on
+        the event loop and only the ORM phases are offloaded to threads.
+        """
+        start_time = time.time()
+        turn = None
+        
+        try:
+            turn = await database_sync_to_async(self._begin_turn)(
+                user, message_content, session_id
+            )
+            
+            with turn["timer"].phase("llm"):
+                ai_response = await self._agenerate_ai_response(
+                    message_content, turn["context"], on_delta, turn["entities"], turn["timer"]
+                )
+            
+            return await database_sync_to_async(self._complete_turn)(
+                user, turn, ai_response, start_time
+            )
+        
+        except Exception as e:
+            logger.error(f"Error processing message: {e}")
+            if turn:
+                await database_sync_to_async(self._fail_turn)(turn, str(e))
+            return {
+                "success": False,
+                "error": f"Failed to process message: {str(e)}",
+                "processing_time_ms": int((time.time() - start_time) * 1000)
+            }
+    
+    def enqueue_message(
+        self, 
+        user: SupabaseUser, 
+        message_content: str, 
+        session_id: str = None,
+        stream: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Record the user turn and hand the rest of it to the ai_processing queue.
+        
+        The reply is pushed to the user's chat channel group by the worker,
+        so the request returns as soon as the user message is saved.
+        """
+        from .tasks import process_chat_turn
+        
+        try:
+            turn = self._begin_turn(user, message_content, session_id)
+            user_message = turn["user_message"]
+            
+            task = process_chat_turn.delay(str(user.id), user_message.id, stream)
+            turn["timer"].record("queued")
+            
+            return {
+                "success": True,
+                "queued": True,
+                "task_id": task.id,
+                "user_message_id": user_message.id,
+                "session_id": str(turn["session"].id),
+                "entities": turn["entities"]
+            }
+        
+        except Exception as e:
+            logger.error(f"Error queueing message: {e}")
+            return {
+                "success": False,
+                "error": f"Failed to queue message: {str(e)}"
+            }
+    
+    def run_queued_turn(self, user_id: str, user_message_id: int, stream: bool = False) -> Dict[str, Any]:
+        """
+        Run phases 2 and 3 of a turn queued by ``enqueue_message``.
+        
+        Called from the Celery worker. The turn is claimed with a conditional
+        UPDATE first, so a redelivered or duplicate task that arrives while
+        it runs, or after it finished, never produces a second reply. A claim
+        older than ``queued_turn_claim_timeout`` belongs to a worker that
+        died and can be taken over.
+        """
+        start_time = time.time()
+        user = SupabaseUser({'sub': user_id})
+        
+        now = timezone.now()
+        claim_timeout = self.openrouter.settings.get("queued_turn_claim_timeout", 300)
+        claimed = ChatMessage.objects.filter(
+            id=user_message_id, user_id=user_id, sender_type='user', status='processing'
+        ).filter(
+            models.Q(claimed_at__isnull=True) | models.Q(claimed_at__lt=now - timedelta(seconds=claim_timeout))
+        ).update(claimed_at=now)
+        
+        if not claimed:
+            if not ChatMessage.objects.filter(id=user_message_id, user_id=user_id, sender_type='user').exists():
+                logger.warning(f"Queued turn for missing message {user_message_id}")
+                return {"success": False, "error": "Message not found"}
+            logger.info(f"Skipping turn for message {user_message_id}, already handled or claimed")
+            return {"success": False, "error": "Turn already handled", "skipped": True}
+        
+        user_message = ChatMessage.objects.get(id=user_message_id)
+        timer = TurnTimer()
+        turn = {
+            "session": None,
+            "user_message": user_message,
+            "entities": user_message.entities_extracted,
+            "context": None,
+            "timer": timer
+        }
+        
+        publisher = ChatTurnPublisher(user_id, user_message_id)
+        
+        try:
+            session = ChatSession.objects.get(id=user_message.session_id)
+            turn["session"] = session
+            with timer.phase("context_build"):
+                turn["context"] = self._build_conversation_context(session, user_message)
+            
+            self._release_db_connection()
+            with timer.phase("llm"):
+                ai_response = self._generate_ai_response(
+                    user_message.content, turn["context"], publisher.send_delta if stream else None,
+                    turn["entities"], timer
+                )
+            result = self._complete_turn(user, turn, ai_response, start_time)
+        except Exception as e:
+            logger.error(f"Error processing queued message {user_message_id}: {e}")
+            self._fail_turn(turn, str(e))
+            result = {
+                "success": False,
+                "error": f"Failed to process message: {str(e)}",
+                "user_message_id": user_message_id,
+                "session_id": str(user_message.session_id),
+                "processing_time_ms": int((time.time() - start_time) * 1000)
+            }
+        
+        publisher.send_result(result)
+        return result
+    
+    def _begin_turn(
+        self, 
+        user: SupabaseUser, 
+        message_content: str, 
+        session_id: str = None
+    ) -> Dict[str, Any]:
+        """
+        Save the user message and build the context for the LLM call.
+        
+        The user message is left in the 'processing' state until the turn is
+        completed or failed, so an interrupted turn is visible in the history.
+        """
+        timer = TurnTimer()
+        
+        with transaction.atomic():
+            # Get or create session
+            with timer.phase("persistence"):
+                session = self._get_or_create_session(user.id, session_id)
+            
+            # Extract entities
+            with timer.phase("entity_extraction"):
                 entities = self.entity_extractor.extract_entities(
                     message_content, session.context
                 )
-                user_message.add_entities(entities)
-                
-                # Get conversation context
-                context = self._build_conversation_context(session)
-                
-                # Generate AI response
-                ai_response = self.openrouter.generate_response(
-                    message_content, context
+            
+            # Save user message
+            with timer.phase("persistence"):
+                user_message = self._save_user_message(
+                    user.id, message_content, session.id, entities
                 )
-                
-                if not ai_response["success"]:
-                    return {
-                        "success": False,
-                        "error": ai_response["error"],
-                        "user_message_id": user_message.id,
-                        "session_id": str(session.id)
-                    }
-                
-                # Save AI response message
+            
+            # Get conversation context
+            with timer.phase("context_build"):
+                context = self._build_conversation_context(session, user_message)
+        
+        return {
+            "session": session,
+            "user_message": user_message,
+            "entities": entities,
+            "context": context,
+            "timer": timer
+        }
+    
+    def _add_retrieved_snippets(
+        self, 
+        context: Dict[str, Any], 
+        message_content: str, 
+        timer: TurnTimer
+    ):
+        """
+        Add the services and customers the message mentions to the context.
+        
+        Only called for turns that reach the full model; the intent router
+        and the light model have no action prompt to use them with.
+        """
+        if not self.openrouter.settings.get("retrieval_enabled", True):
+            return
+        
+        with timer.phase("retrieval"):
+            try:
+                context["retrieved_snippets"] = retrieve_snippets(
+                    context["user_id"], message_content, self.openrouter.settings.get("retrieval_top_k", 5)
+                )
+            except Exception as e:
+                logger.error(f"Catalog retrieval failed for tenant {context['user_id']}: {e}")
+    
+    def _generate_ai_response(
+        self, 
+        message_content: str, 
+        context: Dict[str, Any],
+        on_delta: Callable[[str], None] = None,
+        entities: List[Dict[str, Any]] = None,
+        timer: TurnTimer = None
+    ) -> Dict[str, Any]:
+        """
+        Answer with the cheapest tier that can handle the turn: the intent
+        router, then the light model for turns that need no action planning,
+        then the full model, streaming the reply when a delta callback is given.
+        Catalog and customer retrieval runs only for turns that reach the full
+        model.
+        """
+        entities = entities or []
+        timer = timer or TurnTimer()
+        tier_latency = {}
+        
+        tier_start = time.time()
+        routed = self.intent_router.route(message_content, entities, context)
+        tier_latency[TIER_ROUTER] = int((time.time() - tier_start) * 1000)
+        if routed:
+            if on_delta:
+                on_delta(routed["response_text"])
+            return annotate_routing(routed, TIER_ROUTER, "intent_router", tier_latency)
+        
+        tier, reason = self.turn_classifier.classify(message_content, entities, context)
+        light_tokens = 0
+        if tier == TIER_LIGHT:
+            tier_start = time.time()
+            light = self.light_openrouter.generate_response(
+                message_content, context, system_prompt=LIGHT_SYSTEM_PROMPT
+            )
+            tier_latency[TIER_LIGHT] = int((time.time() - tier_start) * 1000)
+            if not needs_escalation(light):
+                if on_delta:
+                    on_delta(light["response_text"])
+                return annotate_routing(light, TIER_LIGHT, reason, tier_latency)
+            reason = "escalated" if light["success"] else "light_failed"
+            light_tokens = light.get("tokens_used") or 0
+        
+        self._add_retrieved_snippets(context, message_content, timer)
+        
+        tier_start = time.time()
+        if on_delta:
+            # Reads start while the rest of the reply is still streaming
+            eager_reads = EagerReadRunner(context.get("user_id"))
+            ai_response = eager_reads.collect(self.openrouter.stream_response(
+                message_content, context, on_delta=on_delta, on_action=eager_reads.submit
+            ))
+        else:
+            ai_response = self.openrouter.generate_response(message_content, context)
+        tier_latency[TIER_FULL] = int((time.time() - tier_start) * 1000)
+        
+        return annotate_routing(ai_response, TIER_FULL, reason, tier_latency, light_tokens)
+    
+    async def _agenerate_ai_response(
+        self, 
+        message_content: str, 
+        context: Dict[str, Any],
+        on_delta: Callable[[str], Awaitable[None]] = None,
+        entities: List[Dict[str, Any]] = None,
+        timer: TurnTimer = None
+    ) -> Dict[str, Any]:
+        """Async counterpart of ``_generate_ai_response``."""
+        entities = entities or []
+        timer = timer or TurnTimer()
+        tier_latency = {}
+        
+        tier_start = time.time()
+        routed = await database_sync_to_async(self.intent_router.route)(
+            message_content, entities, context
+        )
+        tier_latency[TIER_ROUTER] = int((time.time() - tier_start) * 1000)
+        if routed:
+            if on_delta:
+                await on_delta(routed["response_text"])
+            return annotate_routing(routed, TIER_ROUTER, "intent_router", tier_latency)
+        
+        tier, reason = self.turn_classifier.classify(message_content, entities, context)
+        light_tokens = 0
+        if tier == TIER_LIGHT:
+            tier_start = time.time()
+            light = await self.async_light_openrouter.agenerate_response(
+                message_content, context, system_prompt=LIGHT_SYSTEM_PROMPT
+            )
+            tier_latency[TIER_LIGHT] = int((time.time() - tier_start) * 1000)
+            if not needs_escalation(light):
+                if on_delta:
+                    await on_delta(light["response_text"])
+                return annotate_routing(light, TIER_LIGHT, reason, tier_latency)
+            reason = "escalated" if light["success"] else "light_failed"
+            light_tokens = light.get("tokens_used") or 0
+        
+        await database_sync_to_async(self._add_retrieved_snippets)(context, message_content, timer)
+        
+        tier_start = time.time()
+        if on_delta:
+            eager_reads = EagerReadRunner(context.get("user_id"))
+            ai_response = await eager_reads.acollect(await self.async_openrouter.astream_response(
+                message_content, context, on_delta=on_delta, on_action=eager_reads.submit
+            ))
+        else:
+            ai_response = await self.async_openrouter.agenerate_response(
+                message_content, context
+            )
+        tier_latency[TIER_FULL] = int((time.time() - tier_start) * 1000)
+        
+        return annotate_routing(ai_response, TIER_FULL, reason, tier_latency, light_tokens)
+    
+    def _complete_turn(
+        self, 
+        user: SupabaseUser, 
+        turn: Dict[str, Any], 
+        ai_response: Dict[str, Any], 
+        start_time: float
+    ) -> Dict[str, Any]:
+        """
+        Persist the AI reply, execute its actions and close the turn.
+        
+        Reads no write of the reply waits for run concurrently first; they
+        change nothing, so they stay out of the transaction. The AI message,
+        the action records, every write and the session update then commit
+        together, so a failure part-way leaves no half-recorded turn.
+        
+        Query budget for this phase: the AI message insert, the session row
+        lock and update, and the user message update. Actions add one bulk
+        insert, a completion update each and whatever they query themselves.
+        """
+        session = turn["session"]
+        user_message = turn["user_message"]
+        
+        if not ai_response["success"]:
+            self._fail_turn(turn, ai_response["error"])
+            return {
+                "success": False,
+                "error": ai_response["error"],
+                "user_message_id": user_message.id,
+                "session_id": str(session.id)
+            }
+        
+        timer = turn["timer"]
+        actions = ai_response.get("actions") or []
+        
+        # One executor per turn so lookups are shared and batched across actions
+        executor = ActionExecutor()
+        if actions:
+            with timer.phase("actions"):
+                actions = ActionScheduler().run_reads(user.id, actions, executor)
+        
+        action_results = []
+        with transaction.atomic():
+            # Save AI response message
+            with timer.phase("persistence"):
                 ai_message = self._save_ai_message(
                     user.id, ai_response, session.id, user_message.id
                 )
-                
-                # Process actions
-                action_results = []
-                if ai_response.get("actions"):
+            
+            if actions:
+                with timer.phase("actions"):
                     action_results = self._process_actions(
-                        user, ai_response["actions"], ai_message.id, session.id
+                        user, actions, ai_message.id, session.id, executor
                     )
+            
+            with timer.phase("persistence"):
+                # Update session context and counters
+                completed_actions = sum(
+                    1 for result in action_results if result.get("status") == "completed"
+                )
+                self._update_session_context(
+                    session, turn["entities"], ai_response, completed_actions
+                )
                 
-                # Update session context
-                self._update_session_context(session, entities, ai_response)
-                
-                processing_time = int((time.time() - start_time) * 1000)
-                
-                return {
-                    "success": True,
-                    "response_text": ai_response["response_text"],
-                    "user_message_id": user_message.id,
-                    "ai_message_id": ai_message.id,
-                    "session_id": str(session.id),
-                    "actions": action_results,
-                    "entities": entities,
-                    "processing_time_ms": processing_time
-                }
-                
+                user_message.mark_as_processed({"ai_message_id": ai_message.id})
+        
+        if actions and "retrieved_snippets" in turn["context"]:
+            record_booking_round_trips(turn["context"]["retrieved_snippets"], actions)
+        
+        processing_time = int((time.time() - start_time) * 1000)
+        timer.record(OUTCOME_SUCCESS)
+        
+        return {
+            "success": True,
+            "response_text": ai_response["response_text"],
+            "user_message_id": user_message.id,
+            "ai_message_id": ai_message.id,
+            "session_id": str(session.id),
+            "actions": action_results,
+            "entities": turn["entities"],
+            "processing_time_ms": processing_time,
+            "phase_ms": timer.phase_ms()
+        }
+    
+    def _fail_turn(self, turn: Dict[str, Any], error_message: str):
+        """Mark the user message of an unfinished turn as failed."""
+        turn["timer"].record(OUTCOME_ERROR)
+        
+        try:
+            turn["user_message"].mark_as_failed(error_message)
+            
+            # The user message still counts towards the session
+            ChatSession.record_activity(turn["user_message"].session_id, messages=1)
         except Exception as e:
-            logger.error(f"Error processing message: {e}")
-            return {
-                "success": False,
-                "error": f"Failed to process message: {str(e)}",
-                "processing_time_ms": int((time.time() - start_time) * 1000)
-            }
+            logger.error(f"Failed to mark message {turn['user_message'].id} as failed: {e}")
+    
+    def _release_db_connection(self):
+        """
+        Close the database connection ahead of the LLM call.
+        
+        Connections are not pooled, so an idle connection held open for the
+        whole round trip still occupies a Postgres slot. Django reconnects
+        lazily for the next phase. Skipped when a caller's transaction is open.
+        """
+        if not connection.in_atomic_block:
+            connection.close()
     
     def _get_or_create_session(self, user_id: str, session_id: str = None) -> ChatSession:
         """Get existing session or create new one."""
@@ -835,20 +1865,24 @@ class AIAssistantService:
             title=f"Chat Session {timezone.now().strftime('%Y-%m-%d %H:%M')}"
         )
     
-    def _save_user_message(self, user_id: str, content: str, session_id: str) -> ChatMessage:
+    def _save_user_message(
+        self, 
+        user_id: str, 
+        content: str, 
+        session_id: str, 
+        entities: List[Dict[str, Any]] = None
+    ) -> ChatMessage:
         """Save user message to database."""
         message = ChatMessage.objects.create(
             user_id=user_id,
             session_id=session_id,
             sender_type='user',
             content=content,
-            status='sent'
+            status='processing',
+            entities_extracted=entities or []
         )
         
-        # Update session
-        session = ChatSession.objects.get(id=session_id)
-        session.increment_message_count()
-        
+        # Session counters are updated once per turn in _update_session_context
         return message
     
     def _save_ai_message(
@@ -859,6 +1893,7 @@ class AIAssistantService:
         parent_message_id: int
     ) -> ChatMessage:
         """Save AI response message to database."""
+        routing = ai_response.get("routing", {})
         message = ChatMessage.objects.create(
             user_id=user_id,
             session_id=session_id,
@@ -869,36 +1904,49 @@ class AIAssistantService:
             metadata={
                 "actions_count": len(ai_response.get("actions", [])),
                 "tokens_used": ai_response.get("tokens_used", 0),
-                "model_used": ai_response.get("model_used", "")
-            }
-        )
-        
-        # Set AI response data
-        message.set_ai_response_data(
-            ai_response.get("model_used", ""),
-            ai_response.get("processing_time_ms", 0),
-            ai_response.get("tokens_used", 0)
+                "model_used": ai_response.get("model_used", ""),
+                "routed": ai_response.get("routed", False),
+                "prompt": ai_response.get("prompt_stats", {})
+            },
+            # AI response data
+            ai_model_used=ai_response.get("model_used", ""),
+            routing_tier=routing.get("tier", ""),
+            routing_reason=routing.get("reason", ""),
+            tier_latency_ms=routing.get("tier_latency_ms", {}),
+            processing_time_ms=ai_response.get("processing_time_ms", 0),
+            tokens_used=ai_response.get("tokens_used", 0)
         )
         
-        # Update session
-        session = ChatSession.objects.get(id=session_id)
-        session.increment_message_count()
-        
         return message
     
-    def _build_conversation_context(self, session: ChatSession) -> Dict[str, Any]:
-        """Build conversation context for AI processing."""
-        # Get recent messages
-        recent_messages = ChatMessage.objects.filter(
-            session_id=session.id
-        ).order_by('-timestamp')[:self.openrouter.settings["context_window_size"]]
+    def _build_conversation_context(
+        self, 
+        session: ChatSession, 
+        pending_message: ChatMessage = None
+    ) -> Dict[str, Any]:
+        """
+        Build conversation context for AI processing.
+        
+        Recent messages come from the session's history buffer.
+        ``pending_message`` is a message saved in the still open transaction,
+        which only reaches the buffer on commit.
+        """
+        window_size = self.openrouter.settings["context_window_size"]
+        
+        # Get recent messages not yet folded into the summary
+        recent_messages, _ = load_history(
+            session.user_id, session.id, limit=window_size,
+            after_id=session.context.get("summary_through_id", 0)
+        )
+        if pending_message and all(msg["id"] != pending_message.id for msg in recent_messages):
+            recent_messages = (recent_messages + [serialize_message(pending_message)])[-window_size:]
         
         message_history = []
-        for msg in reversed(recent_messages):
+        for msg in recent_messages:
             message_history.append({
-                "sender_type": msg.sender_type,
-                "content": msg.content,
-                "timestamp": msg.timestamp.isoformat()
+                "sender_type": msg["sender_type"],
+                "content": msg["content"],
+                "timestamp": msg["timestamp"]
             })
         
         # Get conversation context
@@ -906,7 +1954,9 @@ class AIAssistantService:
         
         return {
             "session_id": str(session.id),
+            "user_id": str(session.user_id),
             "message_history": message_history,
+            "conversation_summary": session.context.get("summary", ""),
             "session_context": session.context,
             "conversation_context": conversation_context,
             "last_intent": session.last_intent,
@@ -918,47 +1968,179 @@ class AIAssistantService:
         user: SupabaseUser, 
         actions: List[Dict[str, Any]], 
         message_id: int, 
-        session_id: str
+        session_id: str,
+        executor: ActionExecutor = None
     ) -> List[Dict[str, Any]]:
-        """Process actions identified by AI."""
-        action_results = []
+        """
+        Process actions identified by AI.
+        
+        All action records are inserted at once; the executable ones then run
+        in order on the calling thread, inside its transaction. Reads already
+        run by ``ActionScheduler.run_reads`` carry a ``precomputed_result``
+        and are only recorded. Actions awaiting confirmation are prepared
+        afterwards so confirming them later is fast. Results keep the order
+        of ``actions``.
+        """
+        now = timezone.now()
+        ai_actions = []
         
         for action_data in actions:
+            requires_confirmation = action_data.get("requires_confirmation", False)
+            
+            # Action record, already in progress or awaiting confirmation
+            ai_actions.append(AIAction(
+                message_id=message_id,
+                user_id=user.id,
+                session_id=session_id,
+                action_type=action_data.get("action", "unknown"),
+                target_model=self._determine_target_model(action_data.get("action", "")),
+                parameters=action_data.get("parameters", {}),
+                requires_confirmation=requires_confirmation,
+                status='pending' if requires_confirmation else 'in_progress',
+                started_at=None if requires_confirmation else now,
+                confirmation_requested_at=now if requires_confirmation else None
+            ))
+        
+        AIAction.objects.bulk_create(ai_actions)
+        
+        action_results = [None] * len(actions)
+        executable = []
+        
+        awaiting_confirmation = []
+        
+        for index, (action_data, ai_action) in enumerate(zip(actions, ai_actions)):
+            if ai_action.requires_confirmation:
+                awaiting_confirmation.append((index, ai_action))
+            else:
+                executable.append((index, action_data, ai_action))
+        
+        executor = executor or ActionExecutor()
+        executor.prefetch(
+            [action_data for _, action_data, _ in executable 
+             if "precomputed_result" not in action_data],
+            user.id
+        )
+        
+        for index, action_data, ai_action in executable:
             try:
-                # Create action record
-                ai_action = AIAction.objects.create(
-                    message_id=message_id,
-                    user_id=user.id,
-                    session_id=session_id,
-                    action_type=action_data.get("action", "unknown"),
-                    target_model=self._determine_target_model(action_data.get("action", "")),
-                    parameters=action_data.get("parameters", {}),
-                    requires_confirmation=action_data.get("requires_confirmation", False)
+                action_results[index] = self._execute_action(
+                    user, ai_action, action_data.get("precomputed_result"), executor
                 )
-                
-                # Execute action if not requiring confirmation
-                if not ai_action.requires_confirmation:
-                    result = self._execute_action(user, ai_action)
-                    action_results.append(result)
-                else:
-                    ai_action.request_confirmation()
-                    action_results.append({
-                        "action_id": str(ai_action.id),
-                        "action_type": ai_action.action_type,
-                        "status": "pending_confirmation",
-                        "message": "This action requires confirmation before execution."
-                    })
-                
             except Exception as e:
                 logger.error(f"Error processing action {action_data}: {e}")
-                action_results.append({
+                action_results[index] = {
                     "status": "error",
                     "error": str(e),
                     "action_data": action_data
-                })
+                }
+        
+        # After this turn's writes, so the prepared state already includes them
+        for index, ai_action in awaiting_confirmation:
+            action_results[index] = self._prepare_action(user, ai_action, executor)
         
         return action_results
     
+    def _prepare_action(
+        self, 
+        user: SupabaseUser, 
+        ai_action: AIAction, 
+        executor: ActionExecutor
+    ) -> Dict[str, Any]:
+        """
+        Precompute an action awaiting confirmation and cache the result.
+        
+        The pending result carries the conflicts and price quote so they can
+        be shown next to the confirm button.
+        """
+        result = {
+            "action_id": str(ai_action.id),
+            "action_type": ai_action.action_type,
+            "status": "pending_confirmation",
+            "message": "This action requires confirmation before execution."
+        }
+        
+        prepared_cache = PreparedActionCache()
+        versions = prepared_cache.versions(user.id)
+        prepared = executor.prepare_action(ai_action.action_type, ai_action.parameters, user.id)
+        if prepared:
+            prepared_cache.store(str(ai_action.id), user.id, prepared, versions)
+            result["preview"] = {
+                "conflicts": prepared.get("conflicts", []),
+                "quote": prepared.get("quote", []),
+                "total_price": prepared.get("total_price")
+            }
+        
+        return result
+    
+    def confirm_action(self, user: SupabaseUser, action_id: str, confirmed: bool = True) -> Dict[str, Any]:
+        """
+        Execute or cancel an action that is awaiting confirmation.
+        
+        Work prepared when the action was proposed is reused if the tenant's
+        data has not changed since; otherwise the action is validated again
+        in full before it runs.
+        
+        Args:
+            user: Authenticated user
+            action_id: ID of the pending AIAction
+            confirmed: Whether the user approved the action
+        
+        Returns:
+            Dictionary with the action result
+        """
+        prepared_cache = PreparedActionCache()
+        now = timezone.now()
+        
+        # Claim the action so a double click cannot execute it twice
+        claimed = AIAction.objects.filter(
+            id=action_id,
+            user_id=user.id,
+            requires_confirmation=True,
+            status='pending'
+        ).update(
+            status='in_progress' if confirmed else 'cancelled',
+            confirmed_by_user=confirmed,
+            confirmed_at=now if confirmed else None,
+            started_at=now if confirmed else None,
+            completed_at=None if confirmed else now
+        )
+        
+        if not claimed:
+            exists = AIAction.objects.filter(id=action_id, user_id=user.id).exists()
+            return {
+                "success": False,
+                "error": "Action is not awaiting confirmation" if exists else "Action not found"
+            }
+        
+        if not confirmed:
+            prepared_cache.discard(action_id)
+            return {
+                "success": True,
+                "action_id": str(action_id),
+                "status": "cancelled",
+                "message": "Action cancelled"
+            }
+        
+        ai_action = AIAction.objects.get(id=action_id)
+        prepared = prepared_cache.load(action_id, user.id)
+        prepared_cache.discard(action_id)
+        
+        result = self._execute_action(user, ai_action, prepared=prepared)
+        
+        if result["status"] == "completed" and ai_action.session_id:
+            ChatSession.record_activity(ai_action.session_id, actions=1)
+        
+        # Handlers report their own failures inside a completed action;
+        # failed actions carry no result at all
+        action_result = result.get("result") or {}
+        succeeded = result["status"] == "completed" and action_result.get("success", False)
+        return {
+            **result,
+            "success": succeeded,
+            "error": None if succeeded else result.get("error") or action_result.get("error"),
+            "prepared": prepared is not None
+        }
+    
     def _determine_target_model(self, action_type: str) -> str:
         """Determine target model based on action type."""
         mapping = {
@@ -977,28 +2159,44 @@ class AIAssistantService:
         }
         return mapping.get(action_type, 'system')
     
-    def _execute_action(self, user: SupabaseUser, ai_action: AIAction) -> Dict[str, Any]:
-        """Execute an AI action."""
-        ai_action.mark_in_progress()
+    def _execute_action(
+        self, 
+        user: SupabaseUser, 
+        ai_action: AIAction, 
+        precomputed_result: Dict[str, Any] = None,
+        executor: "ActionExecutor" = None,
+        prepared: Dict[str, Any] = None
+    ) -> Dict[str, Any]:
+        """
+        Execute an AI action.
         
+        Read-only actions that already ran pass their ``precomputed_result``
+        and are only recorded: reads answered by the intent router, reads
+        started by ``EagerReadRunner`` while the reply streamed and the
+        independent reads ``ActionScheduler.run_reads`` ran ahead of the
+        turn's transaction. Actions of one turn
+        share ``executor`` so their lookups are resolved once; confirmed
+        actions pass the ``prepared`` work cached when they were proposed.
+        The action is expected to be saved as 'in_progress' already.
+        """
         try:
-            # Import action executor
-            from .action_executor import ActionExecutor
-            executor = ActionExecutor()
-            
-            # Execute the action
-            result = executor.execute_action(
-                ai_action.action_type,
-                ai_action.parameters,
-                user.id
-            )
+            if precomputed_result is not None:
+                result = precomputed_result
+            else:
+                executor = executor or ActionExecutor()
+                
+                # Execute the action; the savepoint keeps a database error
+                # from breaking the turn's enclosing transaction
+                with transaction.atomic():
+                    result = executor.execute_action(
+                        ai_action.action_type,
+                        ai_action.parameters,
+                        user.id,
+                        prepared=prepared
+                    )
             
             ai_action.mark_completed(result, result.get("id"))
             
-            # Update session action count
-            session = ChatSession.objects.get(id=ai_action.session_id)
-            session.increment_action_count()
-            
             return {
                 "action_id": str(ai_action.id),
                 "action_type": ai_action.action_type,
@@ -1022,14 +2220,30 @@ class AIAssistantService:
         self, 
         session: ChatSession, 
         entities: List[Dict[str, Any]], 
-        ai_response: Dict[str, Any]
+        ai_response: Dict[str, Any],
+        actions_performed: int = 0
     ):
-        """Update session context with new information."""
+        """
+        Record a completed turn on its session with a single UPDATE.
+        
+        Adds the user and AI messages and the completed actions to the
+        session counters, merges extracted entities into the stored context
+        and sets the last intent. With the context read under row lock, the
+        session costs two queries per turn however many actions ran.
+        """
+        fields = {}
         
         # Update last intent if actions were identified
         if ai_response.get("actions"):
             action_types = [action.get("action", "") for action in ai_response["actions"]]
             session.last_intent = ", ".join(action_types)
+            fields["last_intent"] = session.last_intent
+        
+        # Merge into the stored context so a summary written meanwhile is kept
+        current = ChatSession.objects.select_for_update().only(
+            'id', 'context', 'message_count'
+        ).get(id=session.id)
+        session.context = current.context
         
         # Store entities in context
         for entity in entities:
@@ -1037,27 +2251,28 @@ class AIAssistantService:
                 context_key = f"last_{entity['type']}"
                 session.context[context_key] = entity["value"]
         
-        session.save(update_fields=['last_intent', 'context'])
-    
-    def get_chat_history(self, user_id: str, session_id: str = None, limit: int = 50) -> List[Dict[str, Any]]:
-        """Get chat history for a user or session."""
-        query = ChatMessage.objects.filter(user_id=user_id)
+        ChatSession.record_activity(
+            session.id, 
+            messages=2, 
+            actions=actions_performed, 
+            context=session.context, 
+            **fields
+        )
+        message_count = current.message_count + 2
         
-        if session_id:
-            query = query.filter(session_id=session_id)
-        
-        messages = query.order_by('-timestamp')[:limit]
-        
-        return [
-            {
-                "id": msg.id,
-                "session_id": str(msg.session_id) if msg.session_id else None,
-                "sender_type": msg.sender_type,
-                "content": msg.content,
-                "timestamp": msg.timestamp.isoformat(),
-                "status": msg.status,
-                "entities": msg.entities_extracted,
-                "metadata": msg.metadata
-            }
-            for msg in reversed(messages)
-        ] 
\ No newline at end of file
+        # Refresh the rolling summary off the request path once the turn commits
+        if summary_due(session.context, message_count):
+            from .tasks import refresh_conversation_summary
+            session_id = str(session.id)
+            transaction.on_commit(lambda: refresh_conversation_summary.delay(session_id), robust=True)
+    
+    def get_chat_history(
+        self, 
+        user_id: str, 
+        session_id: str = None, 
+        limit: int = 50,
+        before_id: int = None
+    ) -> List[Dict[str, Any]]:
+        """Get chat history for a user or session, oldest first; ``before_id`` pages back."""
+        messages, _ = load_history(user_id, session_id, limit=limit, before_id=before_id)
+        return messages
\ No newline at end of file
@@ -0,0 +1,58 @@
+"""
+Signal handlers that keep AI assistant caches consistent with tenant data.
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from calendar_mgmt.models import Booking, CalendarSettings
+from customer.models import Customer
+from .cache import bump_tenant_version
+from .history import SessionHistoryBuffer
+from .models import ChatMessage, ChatSession
+
+
+def _bump_after_commit(user_id, scope: str):
+    # Bumping before commit would let a concurrent turn cache the old state again
+    transaction.on_commit(lambda: bump_tenant_version(str(user_id), scope))
+
+
+@receiver([post_save, post_delete], sender=Customer)
+def invalidate_customer_responses(sender, instance, **kwargs):
+    """Drop cached AI replies of a tenant when its customers change."""
+    _bump_after_commit(instance.user_id, "customer")
+
+
+@receiver([post_save, post_delete], sender=Booking)
+@receiver([post_save, post_delete], sender=CalendarSettings)
+def invalidate_prepared_bookings(sender, instance, **kwargs):
+    """Revalidate prepared actions of a tenant when its calendar changes."""
+    _bump_after_commit(instance.user_id, "booking")
+
+
+@receiver(post_save, sender=ChatMessage)
+def buffer_chat_message(sender, instance, **kwargs):
+    """Keep the session's history buffer in step with saved messages."""
+    transaction.on_commit(lambda: SessionHistoryBuffer().record(instance))
+
+
+@receiver(post_delete, sender=ChatMessage)
+def unbuffer_chat_message(sender, instance, **kwargs):
+    """Remove deleted messages from the session's history buffer."""
+    transaction.on_commit(lambda: SessionHistoryBuffer().forget(instance))
+
+
+@receiver(post_save, sender=ChatSession)
+def start_history_buffer(sender, instance, created, **kwargs):
+    """New sessions start with an empty buffer instead of a seeding read."""
+    if created:
+        session_id, user_id = str(instance.id), str(instance.user_id)
+        transaction.on_commit(lambda: SessionHistoryBuffer().start_session(session_id, user_id))
+
+
+@receiver(post_delete, sender=ChatSession)
+def drop_history_buffer(sender, instance, **kwargs):
+    """Drop the history buffer of a deleted session."""
+    session_id = str(instance.id)
+    transaction.on_commit(lambda: SessionHistoryBuffer().drop_session(session_id))
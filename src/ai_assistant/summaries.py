@@ -0,0 +1,112 @@
+"""
+Conversation Summaries
+
+Keeps long chat sessions within a constant prompt size. Once a session has
+enough unsummarized messages, the older ones are folded into a rolling
+summary stored in ``ChatSession.context``; prompts then carry the summary
+plus the most recent raw turns.
+"""
+
+import logging
+from typing import Dict, Any, Optional
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import ChatSession, ChatMessage
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_SYSTEM_PROMPT = """You maintain a running summary of a conversation between a business owner and their scheduling assistant.
+
+Update the existing summary with the new messages. Keep every detail that later turns may rely on: customer names and contact details, services and equipment, dates and times, prices, booking references, decisions made and open questions. Drop greetings and small talk.
+
+Reply with the updated summary only, as short plain-text bullet points. Never include ACTION_DATA."""
+
+
+def summary_due(session_context: Dict[str, Any], message_count: int) -> bool:
+    """Whether a session has accumulated enough messages to refresh its summary."""
+    trigger = settings.AI_ASSISTANT_SETTINGS.get("summary_trigger_messages", 16)
+    if not trigger:
+        return False
+    return message_count - session_context.get("summary_message_count", 0) >= trigger
+
+
+class ConversationSummaryService:
+    """Folds older messages of a session into its rolling summary."""
+
+    LOCK_TIMEOUT = 300
+
+    def __init__(self):
+        self.settings = settings.AI_ASSISTANT_SETTINGS
+        self.keep_recent = self.settings.get("summary_keep_recent", 6)
+
+    def refresh(self, session_id: str) -> Dict[str, Any]:
+        """
+        Summarize all but the most recent messages of a session.
+
+        Returns:
+            Dictionary with success status and the number of folded messages
+        """
+        lock_key = f"ai_summary_lock:{session_id}"
+        if not cache.add(lock_key, 1, self.LOCK_TIMEOUT):
+            return {"success": False, "error": "Summary refresh already running"}
+
+        try:
+            return self._refresh(session_id)
+        finally:
+            cache.delete(lock_key)
+
+    def _refresh(self, session_id: str) -> Dict[str, Any]:
+        session = ChatSession.objects.only("id", "context").get(id=session_id)
+        previous_summary = session.context.get("summary", "")
+        through_id = session.context.get("summary_through_id", 0)
+
+        pending = list(
+            ChatMessage.objects.filter(session_id=session_id, id__gt=through_id)
+            .exclude(sender_type='system')
+            .order_by('id')
+            .values('id', 'sender_type', 'content')
+        )
+        to_fold = pending[:-self.keep_recent] if self.keep_recent else pending
+        if not to_fold:
+            return {"success": True, "folded": 0}
+
+        summary = self._summarize(previous_summary, to_fold)
+        if summary is None:
+            return {"success": False, "error": "Summary generation failed"}
+
+        with transaction.atomic():
+            session = ChatSession.objects.select_for_update().only("id", "context").get(id=session_id)
+
+            # Another refresh got there first; its summary already covers these turns
+            if session.context.get("summary_through_id", 0) != through_id:
+                return {"success": False, "error": "Summary changed concurrently"}
+
+            session.context.update({
+                "summary": summary,
+                "summary_through_id": to_fold[-1]["id"],
+                "summary_message_count": session.context.get("summary_message_count", 0) + len(to_fold)
+            })
+            session.save(update_fields=['context'])
+
+        logger.info(f"Folded {len(to_fold)} messages into the summary of session {session_id}")
+        return {"success": True, "folded": len(to_fold)}
+
+    def _summarize(self, previous_summary: str, messages: list) -> Optional[str]:
+        from .services import OpenRouterService
+
+        transcript = "\n".join(
+            f"{'User' if msg['sender_type'] == 'user' else 'Assistant'}: {msg['content']}"
+            for msg in messages
+        )
+        prompt = (
+            f"Existing summary:\n{previous_summary or '(none)'}\n\n"
+            f"New messages:\n{transcript}"
+        )
+
+        result = OpenRouterService().generate_response(prompt, system_prompt=SUMMARY_SYSTEM_PROMPT)
+        if not result["success"]:
+            logger.error(f"Failed to summarize conversation: {result.get('error')}")
+            return None
+        return result["response_text"]
@@ -0,0 +1,42 @@
+"""
+Celery tasks for the AI assistant.
+
+Tasks in this module are routed to the ``ai_processing`` queue by
+CELERY_TASK_ROUTES, so LLM-bound work can be scaled separately from the
+Daphne front ends.
+"""
+
+import logging
+from typing import Dict, Any
+from celery import shared_task
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True, acks_late=True, ignore_result=False)
+def process_chat_turn(self, user_id: str, user_message_id: int, stream: bool = False) -> Dict[str, Any]:
+    """
+    Generate the AI reply for a queued user message and run its actions.
+    
+    The full result is pushed to the user's chat channel group; only a
+    summary is stored in the result backend.
+    """
+    from .services import AIAssistantService
+    
+    result = AIAssistantService().run_queued_turn(user_id, user_message_id, stream=stream)
+    
+    return {
+        "success": result.get("success", False),
+        "user_message_id": user_message_id,
+        "ai_message_id": result.get("ai_message_id"),
+        "session_id": result.get("session_id"),
+        "error": result.get("error")
+    }
+
+
+@shared_task(acks_late=True)
+def refresh_conversation_summary(session_id: str) -> Dict[str, Any]:
+    """Fold older messages of a chat session into its rolling summary."""
+    from .summaries import ConversationSummaryService
+    
+    return ConversationSummaryService().refresh(session_id)
@@ -1,3 +1,805 @@
-from django.test import TestCase
+import json
+import time
+import uuid
+import threading
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import msgpack
+import redis
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from calendar_mgmt.models import Booking
+from calendar_mgmt.services import CalendarManagementService
+from customer.models import Customer
+from service_catalog.models import Service, ServiceCategory
+from service_catalog.search import get_catalog_version
+from users.authentication import SupabaseUser
+
+from . import history, limits, views
+from .action_executor import ActionExecutor
+from .action_scheduler import ActionScheduler, build_dependencies, independent_reads
+from .cache import AIResponseCache, SingleFlight, get_tenant_versions
+from .cascade import TurnClassifier
+from .consumers import ChatConsumer
+from .history import SessionHistoryBuffer, load_history
+from .limits import AILimitExceeded, LLMLimiter
+from .models import AIAction, ChatSession, ChatMessage
+from .protocol import FrameCodec, FrameDecodeError, SUBPROTOCOL_JSON, SUBPROTOCOL_MSGPACK
+from .retrieval import retrieve_snippets
+from .router import IntentRouter
+from .services import AIAssistantService, OpenRouterService, ChatTurnPublisher
+
+LOCMEM_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "ai-assistant-tests",
+    }
+}
+
+# Actions run on the test's own connection so they see its data
+TEST_AI_SETTINGS = {
+    **settings.AI_ASSISTANT_SETTINGS,
+    "action_concurrency": 1,
+    "execution_mode": "inline",
+}
+
+
+class FakeCompletion:
+    """Stands in for an OpenRouter chat completion response."""
+
+    status_code = 200
+
+    def __init__(self, content: str, tool_calls=None, total_tokens: int = 120):
+        self.content = content
+        self.tool_calls = tool_calls
+        self.total_tokens = total_tokens
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        message = {"role": "assistant", "content": self.content}
+        if self.tool_calls:
+            message["tool_calls"] = self.tool_calls
+        return {
+            "choices": [{"message": message, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 100, "total_tokens": self.total_tokens},
+        }
+
+
+def tool_call(name: str, arguments: dict, call_id: str = None) -> dict:
+    return {
+        "id": call_id or f"call_{name}",
+        "type": "function",
+        "function": {"name": name, "arguments": json.dumps(arguments)},
+    }
+
+
+def booking_arguments(start) -> dict:
+    return {
+        "title": "Product shoot",
+        "start_time": start.isoformat(),
+        "end_time": (start + timedelta(hours=6)).isoformat(),
+        "customer": {"name": "Maria Santos", "email": "maria@example.com"},
+        "services": [{"service_name": "Camera A"}],
+        "confidence": 0.9,
+        "requires_confirmation": False,
+    }
+
+
+class TenantMixin:
+    """A tenant with one service, one customer and a chat session."""
+
+    def create_tenant(self):
+        self.user_id = str(uuid.uuid4())
+        self.user = SupabaseUser({"sub": self.user_id})
+        category = ServiceCategory.objects.create(user_id=self.user_id, name="Cameras")
+        self.service = Service.objects.create(
+            user_id=self.user_id,
+            category=category,
+            name="Camera A",
+            service_type="equipment",
+            base_price=500,
+            price_per_day=500,
+        )
+        self.customer = Customer.objects.create(
+            user_id=self.user_id,
+            first_name="Maria",
+            last_name="Santos",
+            email="maria@example.com",
+            phone="+639171234567",
+        )
+        self.session = ChatSession.objects.create(user_id=self.user_id, title="Test session")
+        self.start = (timezone.now() + timedelta(days=7)).replace(hour=10, minute=0, second=0, microsecond=0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, AI_ASSISTANT_SETTINGS=TEST_AI_SETTINGS, OPENROUTER_API_KEY="test-key")
+class DoubleSendTests(TenantMixin, TransactionTestCase):
+    """A booking message sent twice while the first is in flight books once."""
+
+    def setUp(self):
+        self.create_tenant()
+
+    def test_double_sent_booking_creates_one_booking(self):
+        message = "Book Camera A for Maria next week from 10am to 4pm"
+        reply = FakeCompletion(
+            "I've booked Camera A for Maria.",
+            [tool_call("create_booking", booking_arguments(self.start))]
+        )
+        follower_waiting = threading.Event()
+        original_wait = SingleFlight.wait
+
+        def post_completion(service, payload, stream=False):
+            # Hold the leader's upstream call until the duplicate joins it
+            follower_waiting.wait(timeout=10)
+            return reply
+
+        def wait(single_flight, fingerprint):
+            follower_waiting.set()
+            return original_wait(single_flight, fingerprint)
+
+        results = {}
+
+        def send(name):
+            try:
+                results[name] = AIAssistantService().process_message(
+                    self.user, message, str(self.session.id)
+                )
+            finally:
+                connection.close()
+
+        with mock.patch.object(OpenRouterService, "_post_completion", post_completion), \
+                mock.patch.object(SingleFlight, "wait", wait):
+            first = threading.Thread(target=send, args=("first",))
+            first.start()
+            second = threading.Thread(target=send, args=("second",))
+            second.start()
+            first.join(timeout=30)
+            second.join(timeout=30)
+
+        self.assertTrue(results["first"]["success"])
+        self.assertTrue(results["second"]["success"])
+        self.assertEqual(Booking.objects.filter(user_id=self.user_id).count(), 1)
+        # Either send may have led the flight; the other only got its reply
+        self.assertEqual(sorted(len(result["actions"]) for result in results.values()), [0, 1])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, AI_ASSISTANT_SETTINGS=TEST_AI_SETTINGS, OPENROUTER_API_KEY="test-key")
+class QueuedTurnTests(TenantMixin, TestCase):
+    """Queued turns are claimed once and always end in a published result."""
+
+    def setUp(self):
+        self.create_tenant()
+        self.message = ChatMessage.objects.create(
+            user_id=self.user_id,
+            session_id=self.session.id,
+            sender_type="user",
+            content="Can you help me plan the shoots for next week?",
+            status="processing",
+        )
+        publisher = mock.patch.object(ChatTurnPublisher, "send_result")
+        self.send_result = publisher.start()
+        self.addCleanup(publisher.stop)
+
+    def run_turn(self):
+        with mock.patch.object(
+            OpenRouterService, "_post_completion", return_value=FakeCompletion("Sure, let's plan them.")
+        ) as post:
+            result = AIAssistantService().run_queued_turn(self.user_id, self.message.id)
+        return result, post
+
+    def test_turn_runs_once(self):
+        first, _ = self.run_turn()
+        second, post = self.run_turn()
+
+        self.assertTrue(first["success"])
+        self.assertTrue(second["skipped"])
+        post.assert_not_called()
+        self.assertEqual(ChatMessage.objects.filter(parent_message_id=self.message.id).count(), 1)
+
+    def test_turn_claimed_by_another_worker_is_skipped(self):
+        ChatMessage.objects.filter(id=self.message.id).update(claimed_at=timezone.now())
+
+        result, post = self.run_turn()
+
+        self.assertTrue(result["skipped"])
+        post.assert_not_called()
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, "processing")
+
+    def test_stale_claim_is_taken_over(self):
+        ChatMessage.objects.filter(id=self.message.id).update(claimed_at=timezone.now() - timedelta(hours=1))
+
+        result, post = self.run_turn()
+
+        self.assertTrue(result["success"])
+        post.assert_called_once()
+
+    def test_failure_before_the_llm_call_fails_the_turn(self):
+        with mock.patch.object(
+            AIAssistantService, "_build_conversation_context", side_effect=RuntimeError("history unavailable")
+        ):
+            result, post = self.run_turn()
+
+        self.assertFalse(result["success"])
+        post.assert_not_called()
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, "failed")
+        self.send_result.assert_called_once()
+        self.assertFalse(self.send_result.call_args.args[0]["success"])
+
+
+class ActionSchedulerTests(SimpleTestCase):
+    """Reads overlap each other but never a write of the same data."""
+
+    def test_dependencies(self):
+        dependencies = build_dependencies([
+            "search_customer", "check_service_exists", "create_booking", "check_availability", "search_customer"
+        ])
+
+        self.assertEqual(dependencies, [set(), set(), {0, 1}, {2}, {2}])
+
+    def test_writes_wait_for_the_previous_write(self):
+        dependencies = build_dependencies(["create_customer", "create_service"])
+
+        self.assertEqual(dependencies, [set(), {0}])
+
+    def test_independent_reads(self):
+        self.assertEqual(
+            independent_reads(["search_customer", "create_booking", "check_availability", "check_service_exists"]),
+            [0]
+        )
+        self.assertEqual(independent_reads(["create_service", "search_customer"]), [1])
+
+    def test_run_respects_dependencies(self):
+        action_types = ["check_service_exists", "search_customer", "create_booking", "check_availability"]
+        events = []
+        lock = threading.Lock()
+
+        def make_task(index):
+            def task():
+                with lock:
+                    events.append(("start", index))
+                time.sleep(0.02)
+                with lock:
+                    events.append(("end", index))
+                return {"index": index}
+            return task
+
+        results = ActionScheduler(max_workers=4).run(action_types, [make_task(i) for i in range(4)])
+
+        self.assertEqual([result["index"] for result in results], [0, 1, 2, 3])
+        for index, depends_on in enumerate(build_dependencies(action_types)):
+            for earlier in depends_on:
+                self.assertLess(events.index(("end", earlier)), events.index(("start", index)))
+        # The two leading reads overlapped
+        self.assertEqual({events[0], events[1]}, {("start", 0), ("start", 1)})
+
+
+@override_settings(CACHES=LOCMEM_CACHES, AI_ASSISTANT_SETTINGS=TEST_AI_SETTINGS, OPENROUTER_API_KEY="test-key")
+class TurnTransactionTests(TenantMixin, TestCase):
+    """A turn's writes commit with the rest of the turn or not at all."""
+
+    def setUp(self):
+        self.create_tenant()
+
+    def test_failure_after_actions_rolls_back_their_writes(self):
+        reply = FakeCompletion(
+            "I've booked Camera A for Maria.",
+            [tool_call("create_booking", booking_arguments(self.start))]
+        )
+
+        with mock.patch.object(OpenRouterService, "_post_completion", return_value=reply), \
+                mock.patch.object(
+                    AIAssistantService, "_update_session_context", side_effect=RuntimeError("session update failed")
+                ):
+            result = AIAssistantService().process_message(
+                self.user, "Book Camera A for Maria next week from 10am to 4pm", str(self.session.id)
+            )
+
+        self.assertFalse(result["success"])
+        self.assertFalse(Booking.objects.filter(user_id=self.user_id).exists())
+        self.assertFalse(AIAction.objects.filter(user_id=self.user_id).exists())
+        self.assertFalse(ChatMessage.objects.filter(session_id=self.session.id, sender_type="ai").exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES, AI_ASSISTANT_SETTINGS=TEST_AI_SETTINGS, OPENROUTER_API_KEY="test-key")
+class TurnQueryCountTests(TenantMixin, TestCase):
+    """The queries of a turn stay within the budget documented in services."""
+
+    # Measured for the turn below, savepoints included; raise it only with a reason
+    MAX_QUERIES = 40
+
+    def setUp(self):
+        self.create_tenant()
+
+    def test_turn_with_two_actions(self):
+        reply = FakeCompletion("I've booked Camera A for Maria.", [
+            tool_call("search_customer", {"query": "Maria Santos"}),
+            tool_call("create_booking", booking_arguments(self.start)),
+        ])
+
+        with mock.patch.object(OpenRouterService, "_post_completion", return_value=reply), \
+                CaptureQueriesContext(connection) as queries:
+            result = AIAssistantService().process_message(
+                self.user, "Book Camera A for Maria next week from 10am to 4pm", str(self.session.id)
+            )
+
+        self.assertTrue(result["success"])
+        self.assertEqual([action["status"] for action in result["actions"]], ["completed", "completed"])
+        self.assertLessEqual(len(queries), self.MAX_QUERIES)
+
+
+def redis_client():
+    """Client of the Redis server in REDIS_URL, or None when it is unreachable."""
+    client = redis.Redis.from_url(settings.REDIS_URL)
+    try:
+        client.ping()
+    except redis.RedisError:
+        return None
+    return client
+
+
+LIMITED_AI_SETTINGS = {
+    **settings.AI_ASSISTANT_SETTINGS,
+    "plan_limits": {"freemium": {"concurrency": 1, "tokens": 1000}},
+    "global_llm_concurrency": 1,
+}
+
+
+@override_settings(AI_ASSISTANT_SETTINGS=LIMITED_AI_SETTINGS)
+class LLMLimiterTests(SimpleTestCase):
+    """Admission decisions of the limiter's Lua script."""
+
+    def setUp(self):
+        self.client = redis_client()
+        if self.client is None:
+            self.skipTest("Redis is not reachable")
+        prefix = f"test_ai_llm_{uuid.uuid4().hex}"
+        for patcher in (
+            mock.patch.object(limits, "KEY_PREFIX", prefix),
+            mock.patch.object(limits, "_get_redis", return_value=self.client),
+            mock.patch.object(LLMLimiter, "_get_plan_limits", return_value={"concurrency": 1, "tokens": 1000}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: [self.client.delete(key) for key in self.client.scan_iter(f"{prefix}:*")])
+        self.limiter = LLMLimiter()
+
+    def attempt(self, lease):
+        return self.limiter._try_acquire(lease)
+
+    def lease(self, tenant):
+        return self.limiter._new_lease(tenant, self.limiter._get_plan_limits(tenant))
+
+    def test_tenant_cap(self):
+        first = self.attempt(self.lease("tenant-a"))
+        self.limiter.global_cap = -1
+
+        self.assertTrue(first["admitted"])
+        self.assertIsNone(self.attempt(self.lease("tenant-a")))
+        self.assertTrue(self.attempt(self.lease("tenant-b"))["admitted"])
+
+    def test_queued_waiter_holds_no_tenant_slot(self):
+        busy = self.attempt(self.lease("tenant-a"))
+        waiter = self.lease("tenant-b")
+
+        self.assertIsNone(self.attempt(waiter))
+        self.assertEqual(self.client.zcard(self.limiter._key("inflight", "tenant-b")), 0)
+        self.assertEqual(self.client.zcard(self.limiter._key("waiting")), 1)
+
+        self.limiter.release(busy)
+        self.assertTrue(self.attempt(waiter)["admitted"])
+        self.assertEqual(self.client.zcard(self.limiter._key("inflight", "tenant-b")), 1)
+
+    def test_fair_queue_serves_other_tenants_between_requests_of_one(self):
+        busy = self.attempt(self.lease("tenant-x"))
+        unlimited = {"concurrency": -1, "tokens": -1}
+        waiters = [
+            self.limiter._new_lease("tenant-a", unlimited),
+            self.limiter._new_lease("tenant-a", unlimited),
+            self.limiter._new_lease("tenant-b", unlimited),
+        ]
+        for waiter in waiters:
+            self.assertIsNone(self.attempt(waiter))
+        self.limiter.release(busy)
+
+        admitted = []
+        while len(admitted) < len(waiters):
+            for waiter in waiters:
+                if waiter["member"] not in admitted:
+                    lease = self.attempt(waiter)
+                    if lease:
+                        admitted.append(waiter["member"])
+                        self.limiter.release(lease)
+
+        self.assertLess(admitted.index(waiters[2]["member"]), admitted.index(waiters[1]["member"]))
+
+    def test_token_budget(self):
+        lease = self.attempt(self.lease("tenant-a"))
+        self.limiter.release(lease, {"tokens_used": 1000})
+
+        with self.assertRaises(AILimitExceeded) as raised:
+            self.attempt(self.lease("tenant-a"))
+        self.assertEqual(raised.exception.reason, "budget")
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_disabled_without_django_redis(self):
+        self.assertIsNone(LLMLimiter().acquire("tenant-a"))
+        with self.assertLogs(limits.logger, "WARNING"):
+            limits.check_backend()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CatalogVersionTests(TenantMixin, TestCase):
+    """Catalog writes invalidate the one service index every caller shares."""
+
+    def setUp(self):
+        self.create_tenant()
+
+    def test_catalog_writes_bump_the_shared_version(self):
+        before = get_catalog_version(self.user_id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.service.category.save()
+
+        self.assertEqual(get_catalog_version(self.user_id), before + 1)
+        self.assertEqual(get_tenant_versions(self.user_id)["catalog"], before + 1)
+
+    def test_router_sees_renamed_services(self):
+        router = IntentRouter()
+        self.assertEqual(router._match_services("Is Camera A free on Friday?", self.user_id), ["Camera A"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.service.name = "Camera B"
+            self.service.save()
+
+        self.assertEqual(router._match_services("Is Camera A free on Friday?", self.user_id), [])
+        self.assertEqual(router._match_services("Is Camera B free on Friday?", self.user_id), ["Camera B"])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, AI_ASSISTANT_SETTINGS=TEST_AI_SETTINGS)
+class ServiceResolutionTests(TenantMixin, TestCase):
+    """Names resolve to a service only when they name it, typos aside."""
+
+    def setUp(self):
+        self.create_tenant()
+        for name, brand, model in (("Canon EOS R5", "Canon", "EOS R5"), ("Sony FX3", "Sony", "FX3")):
+            Service.objects.create(
+                user_id=self.user_id,
+                category=self.service.category,
+                name=name,
+                brand=brand,
+                model=model,
+                service_type="equipment",
+                base_price=1500,
+            )
+
+    def check(self, service_name):
+        return ActionExecutor().execute_action("check_service_exists", {"service_name": service_name}, self.user_id)
+
+    def test_similar_models_do_not_resolve(self):
+        for service_name in ("Canon G7X", "Sony A7S", "Sony A7 III", "Canon EOS R6"):
+            with self.subTest(service_name=service_name):
+                result = self.check(service_name)
+                self.assertFalse(result["exists"])
+                self.assertEqual(CalendarManagementService()._validate_services(
+                    self.user_id, [{"name": service_name}]
+                ), [])
+
+    def test_typos_and_partial_names_resolve(self):
+        for service_name, expected in (("cannon eos r5", "Canon EOS R5"), ("sony fx3", "Sony FX3"), ("camera a", "Camera A")):
+            with self.subTest(service_name=service_name):
+                self.assertEqual(self.check(service_name)["service_name"], expected)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, AI_ASSISTANT_SETTINGS=TEST_AI_SETTINGS, OPENROUTER_API_KEY="test-key")
+class RetrievalTests(TenantMixin, TestCase):
+    """Retrieval runs once, only for turns the full model answers, without contact details."""
+
+    def setUp(self):
+        self.create_tenant()
+
+    def test_snippets_leave_out_contact_details(self):
+        snippets = retrieve_snippets(self.user_id, "Book Camera A for Maria Santos")
+
+        self.assertEqual(snippets["customers"], [{"name": "Maria Santos", "company": ""}])
+        self.assertEqual(snippets["services"][0]["name"], "Camera A")
+
+    def test_router_answered_turn_skips_retrieval(self):
+        with mock.patch("ai_assistant.services.retrieve_snippets") as retrieve, \
+                mock.patch.object(OpenRouterService, "_post_completion") as post:
+            result = AIAssistantService().process_message(
+                self.user, "Find customer Maria Santos", str(self.session.id)
+            )
+
+        self.assertTrue(result["success"])
+        post.assert_not_called()
+        retrieve.assert_not_called()
+
+    def test_booking_by_retrieved_name_uses_the_existing_customer(self):
+        customer = {"name": "Maria Santos"}
+        reply = FakeCompletion("I've booked Camera A for Maria.", [
+            tool_call("create_booking", {**booking_arguments(self.start), "customer": customer})
+        ])
+        classify = mock.patch.object(TurnClassifier, "classify", autospec=True, side_effect=TurnClassifier.classify)
+
+        with mock.patch.object(OpenRouterService, "_post_completion", return_value=reply) as post, \
+                classify as classified:
+            result = AIAssistantService().process_message(
+                self.user, "Book Camera A for Maria Santos next week from 10am to 4pm", str(self.session.id)
+            )
+
+        self.assertTrue(result["success"])
+        self.assertEqual(classified.call_count, 1)
+        prompt = json.dumps(post.call_args.args[0]["messages"])
+        self.assertIn("Maria Santos", prompt)
+        self.assertNotIn("maria@example.com", prompt)
+        self.assertEqual(Booking.objects.get(user_id=self.user_id).customer_id, self.customer.id)
+        self.assertEqual(Customer.objects.filter(user_id=self.user_id).count(), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, AI_ASSISTANT_SETTINGS=TEST_AI_SETTINGS)
+class ConfirmActionTests(TenantMixin, TestCase):
+    """A pending action runs once, whatever happens when it runs."""
+
+    def setUp(self):
+        self.create_tenant()
+        message = ChatMessage.objects.create(
+            user_id=self.user_id, session_id=self.session.id, sender_type="ai", content="Shall I book it?"
+        )
+        self.action = AIAction.objects.create(
+            message_id=message.id,
+            user_id=self.user_id,
+            session_id=self.session.id,
+            action_type="create_booking",
+            target_model="booking",
+            parameters=booking_arguments(self.start),
+            requires_confirmation=True,
+            status="pending",
+        )
+
+    def test_action_is_confirmed_once(self):
+        first = AIAssistantService().confirm_action(self.user, str(self.action.id))
+        second = AIAssistantService().confirm_action(self.user, str(self.action.id))
+
+        self.assertTrue(first["success"])
+        self.assertFalse(second["success"])
+        self.assertEqual(second["error"], "Action is not awaiting confirmation")
+        self.assertEqual(Booking.objects.filter(user_id=self.user_id).count(), 1)
+
+    def test_cancelled_action_cannot_be_confirmed(self):
+        AIAssistantService().confirm_action(self.user, str(self.action.id), confirmed=False)
+        result = AIAssistantService().confirm_action(self.user, str(self.action.id))
+
+        self.assertFalse(result["success"])
+        self.assertFalse(Booking.objects.filter(user_id=self.user_id).exists())
+
+    def test_failed_action_reports_its_error(self):
+        with mock.patch.object(ActionExecutor, "execute_action", side_effect=RuntimeError("calendar unavailable")):
+            result = AIAssistantService().confirm_action(self.user, str(self.action.id))
+
+        self.assertFalse(result["success"])
+        self.assertEqual(result["status"], "failed")
+        self.assertEqual(result["error"], "calendar unavailable")
+        self.action.refresh_from_db()
+        self.assertEqual(self.action.status, "failed")
+
+    def test_failure_without_a_message(self):
+        with mock.patch.object(ActionExecutor, "execute_action", side_effect=RuntimeError()):
+            result = AIAssistantService().confirm_action(self.user, str(self.action.id))
+
+        self.assertFalse(result["success"])
+        self.assertEqual(result["status"], "failed")
+
+    def post_confirmation(self, data):
+        request = APIRequestFactory().post(f"/api/ai/actions/{self.action.id}/confirm/", data, format="json")
+        force_authenticate(request, user=self.user)
+        return views.confirm_action(request, action_id=self.action.id)
+
+    def test_endpoint_confirms_only_explicit_true(self):
+        for confirmed in ("false", "0", False):
+            with self.subTest(confirmed=confirmed):
+                response = self.post_confirmation({"confirmed": confirmed})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.data["status"], "cancelled")
+                self.action.status = "pending"
+                self.action.save(update_fields=["status"])
+
+        self.assertEqual(self.post_confirmation({}).data["status"], "cancelled")
+        self.assertFalse(Booking.objects.filter(user_id=self.user_id).exists())
+
+    def test_endpoint_rejects_unparseable_values(self):
+        for confirmed in ("yes", "no", 2, [True]):
+            with self.subTest(confirmed=confirmed):
+                self.assertEqual(self.post_confirmation({"confirmed": confirmed}).status_code, 400)
+
+        self.action.refresh_from_db()
+        self.assertEqual(self.action.status, "pending")
+
+
+class FrameCodecTests(SimpleTestCase):
+    """Negotiation, batching and decoding of WebSocket frames."""
+
+    def test_negotiation_prefers_msgpack(self):
+        self.assertEqual(FrameCodec.negotiate([SUBPROTOCOL_JSON, SUBPROTOCOL_MSGPACK]).subprotocol, SUBPROTOCOL_MSGPACK)
+        self.assertEqual(FrameCodec.negotiate([SUBPROTOCOL_JSON]).encoding, "json")
+        self.assertEqual(FrameCodec.negotiate(["chat.v9"]).version, 1)
+        self.assertEqual(FrameCodec.negotiate(None).version, 1)
+
+    def test_version_1_sends_one_frame_per_event(self):
+        frames = FrameCodec().frames([{"type": "typing"}, {"type": "chat.response"}])
+
+        self.assertEqual([json.loads(frame["text_data"])["type"] for frame in frames], ["typing", "chat.response"])
+
+    def test_version_2_batches_events(self):
+        frames = FrameCodec(SUBPROTOCOL_MSGPACK).frames([{"type": "typing"}, {"type": "chat.response"}])
+
+        self.assertEqual(len(frames), 1)
+        payload = msgpack.unpackb(frames[0]["bytes_data"], raw=False)
+        self.assertEqual(payload["type"], "batch")
+        self.assertEqual([event["type"] for event in payload["events"]], ["typing", "chat.response"])
+
+    def test_lone_event_is_not_wrapped(self):
+        frames = FrameCodec(SUBPROTOCOL_JSON).frames([{"type": "pong"}])
+
+        self.assertEqual(json.loads(frames[0]["text_data"])["type"], "pong")
+
+    def test_decode_either_encoding(self):
+        self.assertEqual(FrameCodec.decode(text_data='{"type": "ping"}'), {"type": "ping"})
+        self.assertEqual(FrameCodec.decode(bytes_data=msgpack.packb({"type": "ping"})), {"type": "ping"})
+
+    def test_decode_rejects_invalid_frames(self):
+        for frame in ({}, {"text_data": ""}, {"bytes_data": b""}, {"text_data": "not json"},
+                      {"text_data": "[1, 2]"}, {"bytes_data": b"\xc1"}):
+            with self.subTest(frame=frame), self.assertRaises(FrameDecodeError):
+                FrameCodec.decode(**frame)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, AI_ASSISTANT_SETTINGS=TEST_AI_SETTINGS, OPENROUTER_API_KEY="test-key")
+class ResponseCacheTests(SimpleTestCase):
+    """Cache keys cover everything in the prompt; lookups cost no extra round trips."""
+
+    prompt = "What are your opening hours?"
+
+    def context(self, summary=""):
+        return {"user_id": "tenant-a", "message_history": [], "conversation_summary": summary}
+
+    def test_summary_is_part_of_the_key(self):
+        response_cache = AIResponseCache()
+
+        self.assertNotEqual(
+            response_cache.build_key(self.prompt, self.context("Maria asked about Camera A.")),
+            response_cache.build_key(self.prompt, self.context("Maria cancelled her booking."))
+        )
+
+    def test_lookup_is_counted_with_the_call(self):
+        service = OpenRouterService()
+        key = service.response_cache.build_key(self.prompt, self.context(), None, service.model)
+        service.response_cache.set(key, {"success": True, "response_text": "9am to 6pm.", "actions": []})
+        client = mock.MagicMock()
+
+        with mock.patch("ai_assistant.metrics._get_redis", return_value=client):
+            result = service.generate_response(self.prompt, self.context())
+
+        self.assertTrue(result["cached"])
+        pipe = client.pipeline.return_value
+        self.assertEqual(pipe.execute.call_count, 1)
+        self.assertIn('result="hit"', [call.args[1] for call in pipe.hincrby.call_args_list])
+
+
+HISTORY_AI_SETTINGS = {
+    **settings.AI_ASSISTANT_SETTINGS,
+    "history_buffer_size": 5,
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES, AI_ASSISTANT_SETTINGS=HISTORY_AI_SETTINGS)
+class HistoryPaginationTests(TenantMixin, TestCase):
+    """History pages from the buffer and the database join up without gaps."""
+
+    def setUp(self):
+        self.client = redis_client()
+        if self.client is None:
+            self.skipTest("Redis is not reachable")
+        prefix = f"test_ai_history_{uuid.uuid4().hex}"
+        for patcher in (
+            mock.patch.object(history, "KEY_PREFIX", prefix),
+            mock.patch.object(history, "_get_redis", return_value=self.client),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: [self.client.delete(key) for key in self.client.scan_iter(f"{prefix}:*")])
+
+        # Run the buffer signals, which only fire on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_tenant()
+            self.ids = [
+                ChatMessage.objects.create(
+                    user_id=self.user_id, session_id=self.session.id, sender_type="user", content=f"Message {number}"
+                ).id
+                for number in range(8)
+            ]
+
+    def page(self, **kwargs):
+        messages, has_more = load_history(self.user_id, str(self.session.id), **kwargs)
+        return [message["id"] for message in messages], has_more
+
+    def test_newest_page_comes_from_the_buffer(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.page(limit=3), (self.ids[5:], True))
+
+    def test_pages_below_the_floor_come_from_the_database(self):
+        # The buffer holds the newest five messages, so its floor is ids[3]
+        with self.assertNumQueries(1):
+            self.assertEqual(self.page(limit=3, before_id=self.ids[3]), (self.ids[:3], False))
+
+    def test_before_id_pages_join_up(self):
+        collected = []
+        before_id = None
+        has_more = True
+        while has_more:
+            ids, has_more = self.page(limit=3, before_id=before_id)
+            self.assertTrue(ids)
+            collected = ids + collected
+            before_id = ids[0]
+
+        self.assertEqual(collected, self.ids)
+
+    def test_after_id_returns_newer_messages(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.page(limit=3, after_id=self.ids[5]), (self.ids[6:], False))
+
+    def test_missing_buffer_is_seeded_by_the_first_read(self):
+        SessionHistoryBuffer().drop_session(str(self.session.id))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.page(limit=3), (self.ids[5:], True))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.page(limit=3), (self.ids[5:], True))
+
+    def get_history(self, view, **params):
+        request = APIRequestFactory().get("/api/ai/chat/history/", {"session_id": str(self.session.id), **params})
+        force_authenticate(request, user=self.user)
+        return view(request)
+
+    def test_offset_pages_still_work(self):
+        response = self.get_history(views.ChatHistoryView.as_view(), limit=3, offset=3)
+
+        self.assertEqual(response.status_code, 200)
+        # Newest first, like the before_id pages of this view
+        self.assertEqual([message["id"] for message in response.data["messages"]], self.ids[2:5][::-1])
+        self.assertTrue(response.data["has_more"])
+        self.assertEqual(response.data["next_before_id"], self.ids[2])
+
+    def test_bad_paging_parameters_are_rejected(self):
+        for view in (views.ChatHistoryView.as_view(), views.chat_history):
+            for params in ({"before_id": "abc"}, {"limit": "ten"}, {"limit": 0}):
+                with self.subTest(view=view, params=params):
+                    self.assertEqual(self.get_history(view, **params).status_code, 400)
+        response = self.get_history(views.ChatHistoryView.as_view(), offset=3, before_id=self.ids[5])
+        self.assertEqual(response.status_code, 400)
+
+    def test_socket_page_of_exactly_limit_messages_has_no_next_page(self):
+        consumer = ChatConsumer()
+        consumer.user, consumer.authenticated = self.user, True
+        # Keep the test's connection, which database_sync_to_async would close
+        with mock.patch("channels.db.close_old_connections"), \
+                mock.patch.object(consumer, "_send_event", new_callable=mock.AsyncMock) as send:
+            async_to_sync(consumer._handle_get_history)({"session_id": str(self.session.id), "limit": 8})
+
+        event = send.call_args.args[0]
+        self.assertEqual(event["count"], 8)
+        self.assertFalse(event["has_more"])
+        self.assertIsNone(event["next_before_id"])
+
+    def test_other_users_get_nothing_from_the_buffer(self):
+        messages, has_more = load_history(str(uuid.uuid4()), str(self.session.id), limit=3)
+        self.assertEqual((messages, has_more), ([], False))
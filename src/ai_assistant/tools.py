@@ -0,0 +1,316 @@
+"""
+Action Tools
+
+The assistant's actions as tools in the function-calling format OpenRouter
+accepts, one JSON schema per action type, and parsing of the tool calls the
+model returns. Streamed tool calls are assembled incrementally so an action
+is available as soon as its arguments are complete, before the rest of the
+completion has arrived.
+"""
+
+import json
+import logging
+from typing import Dict, Any, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+_STRING = {"type": "string"}
+_NUMBER = {"type": "number"}
+_DATETIME = {
+    "type": "string",
+    "description": "Date and time as given or ISO 8601, e.g. 'tomorrow 2:00 PM' or '2025-06-10T14:00'"
+}
+_SERVICE_NAMES = {
+    "type": "array",
+    "items": _STRING,
+    "description": "Service or equipment names as they appear in the catalog"
+}
+
+# Every tool also accepts these; they describe the call, not the action
+_CALL_PROPERTIES = {
+    "confidence": {
+        "type": "number",
+        "minimum": 0,
+        "maximum": 1,
+        "description": "How sure you are that this action is what the user wants"
+    },
+    "requires_confirmation": {
+        "type": "boolean",
+        "description": "Ask the user to confirm before the action runs"
+    },
+}
+
+# Appended to the system prompt when tools are offered; the examples in the
+# prompt keep the ACTION_DATA layout, which also serves models without tools
+TOOL_CALLING_PROMPT = """PERFORMING ACTIONS:
+Perform every action by calling the tool with the action's name. Its arguments are the "parameters" of the ACTION_DATA examples above, plus "confidence" and "requires_confirmation". Do not write ACTION_DATA blocks in your reply when you can call a tool. Write the message to the user first, then make the tool calls."""
+
+# action type: (description, properties, required)
+ACTION_SCHEMAS = {
+    'check_service_exists': (
+        "Verify that a service or equipment item exists in the catalog.",
+        {"service_name": _STRING},
+        ["service_name"],
+    ),
+    'check_availability': (
+        "Check whether services or equipment are free in a time range.",
+        {"services": _SERVICE_NAMES, "start_time": _DATETIME, "end_time": _DATETIME},
+        ["services", "start_time", "end_time"],
+    ),
+    'search_customer': (
+        "Find existing customers by name, email or phone.",
+        {"query": {"type": "string", "description": "Name or part of it"}, "email": _STRING, "phone": _STRING},
+        [],
+    ),
+    'create_booking': (
+        "Create a booking of catalog services or equipment for a customer.",
+        {
+            "title": _STRING,
+            "description": _STRING,
+            "start_time": _DATETIME,
+            "end_time": _DATETIME,
+            "all_day": {"type": "boolean"},
+            "notes": _STRING,
+            "customer": {
+                "type": "object",
+                "properties": {
+                    "name": _STRING,
+                    "email": _STRING,
+                    "phone": _STRING,
+                    "customer_type": {"type": "string", "enum": ["individual", "business"]},
+                },
+            },
+            "services": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "service_name": _STRING,
+                        "quantity": {"type": "integer", "minimum": 1},
+                    },
+                    "required": ["service_name"],
+                },
+            },
+        },
+        ["title", "start_time", "end_time", "customer", "services"],
+    ),
+    'update_booking': (
+        "Change the title, description, times or notes of an existing booking.",
+        {
+            "booking_id": _STRING,
+            "title": _STRING,
+            "description": _STRING,
+            "start_time": _DATETIME,
+            "end_time": _DATETIME,
+            "notes": _STRING,
+        },
+        ["booking_id"],
+    ),
+    'cancel_booking': (
+        "Cancel an existing booking.",
+        {"booking_id": _STRING},
+        ["booking_id"],
+    ),
+    'create_customer': (
+        "Add a customer. Leave unknown contact details empty.",
+        {
+            "first_name": _STRING,
+            "last_name": _STRING,
+            "email": _STRING,
+            "phone": _STRING,
+            "company": _STRING,
+            "notes": _STRING,
+            "customer_type": {"type": "string", "enum": ["individual", "business"]},
+        },
+        ["first_name"],
+    ),
+    'update_customer': (
+        "Change the details of an existing customer, found by id or email.",
+        {
+            "customer_id": _STRING,
+            "email": _STRING,
+            "first_name": _STRING,
+            "last_name": _STRING,
+            "phone": _STRING,
+            "company": _STRING,
+            "notes": _STRING,
+        },
+        [],
+    ),
+    'create_service': (
+        "Add a service or equipment item to the catalog.",
+        {
+            "name": _STRING,
+            "description": _STRING,
+            "service_type": {"type": "string", "enum": ["equipment", "service"]},
+            "category": _STRING,
+            "base_price": _NUMBER,
+            "price_per_hour": _NUMBER,
+            "price_per_day": _NUMBER,
+            "price_per_week": _NUMBER,
+            "quantity_available": {"type": "integer", "minimum": 1},
+            "availability_type": {"type": "string", "enum": ["limited", "unlimited"]},
+            "brand": _STRING,
+            "model": _STRING,
+        },
+        ["name"],
+    ),
+    'update_service': (
+        "Change the details or pricing of a catalog service, found by id or name.",
+        {
+            "service_id": _STRING,
+            "service_name": _STRING,
+            "name": _STRING,
+            "description": _STRING,
+            "base_price": _NUMBER,
+            "price_per_hour": _NUMBER,
+            "price_per_day": _NUMBER,
+            "price_per_week": _NUMBER,
+            "quantity_available": {"type": "integer", "minimum": 0},
+            "brand": _STRING,
+            "model": _STRING,
+        },
+        [],
+    ),
+}
+
+
+def _tool(action_type: str) -> Dict[str, Any]:
+    description, properties, required = ACTION_SCHEMAS[action_type]
+    return {
+        "type": "function",
+        "function": {
+            "name": action_type,
+            "description": description,
+            "parameters": {
+                "type": "object",
+                "properties": {**properties, **_CALL_PROPERTIES},
+                "required": required,
+            },
+        },
+    }
+
+
+ACTION_TOOLS = [_tool(action_type) for action_type in ACTION_SCHEMAS]
+
+
+def tool_call_to_action(
+    name: str,
+    arguments: Union[str, Dict[str, Any]],
+    call_id: str = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Convert a tool call into the action dictionary used by the executor.
+
+    Returns None for unknown tools and arguments that are not a JSON object.
+    """
+    if name not in ACTION_SCHEMAS:
+        logger.warning(f"Ignoring call of unknown tool {name!r}")
+        return None
+
+    if isinstance(arguments, str):
+        try:
+            arguments = json.loads(arguments) if arguments.strip() else {}
+        except json.JSONDecodeError as e:
+            logger.warning(f"Failed to parse arguments of tool {name}: {e}")
+            return None
+    if not isinstance(arguments, dict):
+        logger.warning(f"Ignoring tool {name} called with non-object arguments")
+        return None
+
+    parameters = dict(arguments)
+    action = {
+        "action": name,
+        "parameters": parameters,
+        "confidence": parameters.pop("confidence", None),
+        "requires_confirmation": bool(parameters.pop("requires_confirmation", False)),
+    }
+    if call_id:
+        action["tool_call_id"] = call_id
+    return action
+
+
+def parse_tool_calls(message: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Actions of the tool calls in a complete assistant message."""
+    actions = []
+    for call in message.get("tool_calls") or []:
+        function = call.get("function") or {}
+        action = tool_call_to_action(function.get("name"), function.get("arguments") or "", call.get("id"))
+        if action:
+            actions.append(action)
+    return actions
+
+
+class ToolCallStream:
+    """
+    Assembles tool calls from streamed completion chunks.
+
+    Chunks carry ``delta.tool_calls`` entries keyed by index, with the name
+    and id in the first fragment and the arguments JSON split across the
+    rest. A call is complete as soon as its arguments parse as a JSON
+    object: nothing can follow the closing brace of a top-level object.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._completed = []
+
+    def feed(self, event: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Add a stream chunk and return the actions it completed."""
+        choices = event.get("choices") or []
+        if not choices:
+            return []
+
+        completed = []
+        for fragment in (choices[0].get("delta") or {}).get("tool_calls") or []:
+            index = fragment.get("index", 0)
+            call = self._calls.setdefault(
+                index, {"index": index, "id": None, "name": "", "arguments": "", "done": False}
+            )
+            if call["done"]:
+                continue
+            if fragment.get("id"):
+                call["id"] = fragment["id"]
+            function = fragment.get("function") or {}
+            if function.get("name"):
+                call["name"] += function["name"]
+            call["arguments"] += function.get("arguments") or ""
+
+            action = self._complete(call)
+            if action:
+                completed.append(action)
+
+        return completed
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """Close the stream and return the actions of calls still open."""
+        completed = []
+        for index in sorted(self._calls):
+            call = self._calls[index]
+            if call["done"]:
+                continue
+            call["done"] = True
+            action = tool_call_to_action(call["name"], call["arguments"], call["id"])
+            if action:
+                self._completed.append((call["index"], action))
+                completed.append(action)
+        return completed
+
+    @property
+    def actions(self) -> List[Dict[str, Any]]:
+        """All completed actions in call order."""
+        return [action for _, action in sorted(self._completed, key=lambda item: item[0])]
+
+    def _complete(self, call: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if not call["name"] or not call["arguments"].rstrip().endswith("}"):
+            return None
+        try:
+            arguments = json.loads(call["arguments"])
+        except json.JSONDecodeError:
+            return None
+
+        call["done"] = True
+        action = tool_call_to_action(call["name"], arguments, call["id"])
+        if action:
+            self._completed.append((call["index"], action))
+        return action
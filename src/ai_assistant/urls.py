@@ -18,8 +18,11 @@ urlpatterns = [
     # Utility endpoints
     path('test/', views.test_connection, name='test_connection'),
     path('capabilities/', views.capabilities, name='capabilities'),
+    path('limits/', views.limits_status, name='limits_status'),
+    path('metrics/', views.metrics, name='metrics'),
     
     # Action endpoints (class-based views)
     path('actions/', views.ActionHistoryView.as_view(), name='action_history'),
     path('actions/<uuid:action_id>/', views.ActionDetailView.as_view(), name='action_detail'),
+    path('actions/<uuid:action_id>/confirm/', views.confirm_action, name='confirm_action'),
 ] 
\ No newline at end of file
@@ -6,21 +6,61 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated  # Optional: require auth
 from rest_framework import status, permissions
 from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.conf import settings
 from django.core.paginator import Paginator
 from users.authentication import SupabaseJWTAuthentication, require_authenticated_user
 from .models import ChatMessage, ChatSession, AIAction
-from .services import AIAssistantService
+from .services import AIAssistantService, parse_confirmation
+from .limits import LLMLimiter
+from .metrics import render_metrics
+from .history import load_history, serialize_message
 import logging
 import json
 from typing import Dict, Any
 from rest_framework.decorators import api_view, permission_classes
 from django.utils import timezone
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, Http404
+from django.utils.crypto import constant_time_compare
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 
 logger = logging.getLogger(__name__)
 
+
+def _history_params(params) -> Dict[str, Any]:
+    """
+    Paging parameters of a history request.
+
+    Raises:
+        ValueError: If ``limit``, ``offset`` or ``before_id`` is not a
+            valid integer
+    """
+    limit = int(params.get('limit', 50))
+    offset = int(params.get('offset') or 0)
+    before_id = params.get('before_id')
+    before_id = int(before_id) if before_id else None
+    if limit < 1 or offset < 0:
+        raise ValueError("limit must be positive and offset not negative")
+    return {'limit': limit, 'offset': offset, 'before_id': before_id}
+
+
+def _load_history_at_offset(user_id: str, session_id: str, limit: int, offset: int):
+    """
+    Page of history skipping the newest ``offset`` messages.
+
+    Kept for clients that still page with ``offset``; ``before_id`` pages
+    are cheaper and served from the history buffer.
+    """
+    query = ChatMessage.objects.filter(user_id=user_id)
+    if session_id:
+        query = query.filter(session_id=session_id)
+    entries = [serialize_message(message) for message in query.order_by('-id')[offset:offset + limit + 1]]
+    page = entries[:limit]
+    page.reverse()
+    return page, len(entries) > limit
+
+
 class OpenRouterChatView(APIView):
     permission_classes = [IsAuthenticated]  # Remove if you want it public
 
@@ -48,40 +88,48 @@ class ChatHistoryView(APIView):
         try:
             user = require_authenticated_user(request)
             
-            # Get query parameters
-            limit = int(request.query_params.get('limit', 50))
-            offset = int(request.query_params.get('offset', 0))
+            # Get query parameters; pages go back from before_id (keyset)
+            try:
+                params = _history_params(request.query_params)
+            except ValueError:
+                return Response(
+                    {'error': 'limit, offset and before_id must be valid integers'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if params['offset'] and params['before_id']:
+                return Response(
+                    {'error': 'Use either offset or before_id, not both'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             session_id = request.query_params.get('session_id')
             
-            # Base query
-            messages = ChatMessage.objects.filter(user_id=user.id)
-            
-            # Filter by session if provided
-            if session_id:
-                messages = messages.filter(session_id=session_id)
-            
-            # Order by timestamp (newest first)
-            messages = messages.order_by('-timestamp')
-            
-            # Apply pagination
-            messages = messages[offset:offset + limit]
+            if params['offset']:
+                # Deprecated: offset pages skip the buffer; follow next_before_id instead
+                messages, has_more = _load_history_at_offset(
+                    user.id, session_id, params['limit'], params['offset']
+                )
+            else:
+                messages, has_more = load_history(
+                    user.id, session_id, limit=params['limit'], before_id=params['before_id']
+                )
             
-            # Serialize messages
+            # Serialize messages (newest first)
             messages_data = []
-            for message in messages:
+            for message in reversed(messages):
                 messages_data.append({
-                    'id': message.id,
-                    'session_id': str(message.session_id) if message.session_id else None,
-                    'sender_type': message.sender_type,
-                    'content': message.content,
-                    'metadata': message.metadata,
-                    'timestamp': message.timestamp.isoformat()
+                    'id': message['id'],
+                    'session_id': message['session_id'],
+                    'sender_type': message['sender_type'],
+                    'content': message['content'],
+                    'metadata': message['metadata'],
+                    'timestamp': message['timestamp']
                 })
             
             return Response({
                 'messages': messages_data,
                 'count': len(messages_data),
-                'has_more': len(messages_data) == limit
+                'has_more': has_more,
+                'next_before_id': messages_data[-1]['id'] if has_more and messages_data else None
             })
             
         except Exception as e:
@@ -314,12 +362,16 @@ class ActionDetailView(APIView):
             )
 
 
+@transaction.non_atomic_requests
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def send_message(request):
     """
     Send a message to the AI assistant and get a response.
     Simple HTTP endpoint that processes the message and returns AI response.
+    
+    Runs outside ATOMIC_REQUESTS: the AI service manages its own short
+    transactions so no transaction stays open during the LLM call.
     """
     try:
         user = require_authenticated_user(request)
@@ -334,9 +386,36 @@ def send_message(request):
         # Initialize AI service
         ai_service = AIAssistantService()
         
+        # In celery mode the reply is delivered over the chat WebSocket group
+        if settings.AI_ASSISTANT_SETTINGS.get('execution_mode') == 'celery':
+            result = ai_service.enqueue_message(
+                user=user,
+                message_content=message_content,
+                session_id=request.data.get('session_id')
+            )
+            
+            if not result['success']:
+                return Response(
+                    {'error': result.get('error', 'Failed to queue message')},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
+            
+            return Response({
+                'success': True,
+                'queued': True,
+                'task_id': result['task_id'],
+                'user_message': {
+                    'id': result['user_message_id'],
+                    'content': message_content,
+                    'timestamp': timezone.now().isoformat(),
+                    'sender_type': 'user'
+                },
+                'session_id': result['session_id']
+            }, status=status.HTTP_202_ACCEPTED)
+        
         # Process the message
         result = ai_service.process_message(
-            user_id=user.id,
+            user=user,
             message_content=message_content,
             session_id=request.data.get('session_id')
         )
@@ -357,6 +436,7 @@ def send_message(request):
                     'sender_type': 'ai',
                     'metadata': {
                         'processing_time_ms': result.get('processing_time_ms', 0),
+                        'phase_ms': result.get('phase_ms', {}),
                         'entities': result.get('entities', []),
                         'actions_count': len(result.get('actions', []))
                     }
@@ -378,6 +458,87 @@ def send_message(request):
         )
 
 
+@transaction.non_atomic_requests
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def confirm_action(request, action_id):
+    """
+    Confirm or cancel an AI action that is awaiting confirmation.
+    
+    Runs outside ATOMIC_REQUESTS so the booking created on confirmation is
+    committed, and announced, before the response is sent.
+    """
+    try:
+        user = require_authenticated_user(request)
+        try:
+            confirmed = parse_confirmation(request.data.get('confirmed'))
+        except ValueError:
+            return Response(
+                {'error': 'confirmed must be true or false'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        result = AIAssistantService().confirm_action(user, str(action_id), confirmed)
+        
+        if not result.get('success') and not result.get('status'):
+            error = result.get('error', 'Failed to confirm action')
+            return Response(
+                {'error': error},
+                status=status.HTTP_404_NOT_FOUND if error == 'Action not found' else status.HTTP_409_CONFLICT
+            )
+        
+        return Response(result)
+        
+    except Exception as e:
+        logger.error(f"Error in confirm_action: {e}")
+        return Response(
+            {'error': 'Internal server error'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def limits_status(request):
+    """
+    AI usage of the authenticated tenant against its plan, plus the shared
+    queue-wait metrics of the OpenRouter limiter.
+    """
+    try:
+        user = require_authenticated_user(request)
+        
+        return Response({
+            'usage': LLMLimiter().tenant_usage(user.id),
+            'queue': LLMLimiter.stats()
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in limits_status: {e}")
+        return Response(
+            {'error': 'Failed to retrieve AI limits'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@require_http_methods(["GET"])
+def metrics(request):
+    """
+    Prometheus scrape endpoint for LLM latency, token and cache metrics.
+    
+    Authenticated with ``Authorization: Bearer <AI_METRICS_TOKEN>`` rather
+    than a user JWT, since the scraper is not a tenant.
+    """
+    token = getattr(settings, 'AI_METRICS_TOKEN', None)
+    if not token:
+        raise Http404
+    
+    authorization = request.headers.get('Authorization', '')
+    if not constant_time_compare(authorization, f'Bearer {token}'):
+        return HttpResponse(status=401)
+    
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def chat_history(request):
@@ -387,28 +548,32 @@ def chat_history(request):
     try:
         user = require_authenticated_user(request)
         session_id = request.GET.get('session_id')
-        limit = int(request.GET.get('limit', 50))
-        
-        # Get messages from database
-        query = ChatMessage.objects.filter(user_id=user.id)
-        
-        if session_id:
-            query = query.filter(session_id=session_id)
+        try:
+            params = _history_params(request.GET)
+        except ValueError:
+            return Response(
+                {'error': 'limit and before_id must be valid integers'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        messages = query.order_by('-timestamp')[:limit]
-        messages = list(reversed(messages))  # Reverse to get chronological order
+        # Chronological page, from the session's history buffer when possible
+        messages, has_more = load_history(
+            user.id, session_id, limit=params['limit'], before_id=params['before_id']
+        )
         
         return Response({
             'messages': [
                 {
-                    'id': str(msg.id),
-                    'content': msg.content,
-                    'sender_type': msg.sender_type,
-                    'timestamp': msg.timestamp.isoformat(),
-                    'metadata': msg.metadata
+                    'id': str(msg['id']),
+                    'content': msg['content'],
+                    'sender_type': msg['sender_type'],
+                    'timestamp': msg['timestamp'],
+                    'metadata': msg['metadata']
                 }
                 for msg in messages
-            ]
+            ],
+            'has_more': has_more,
+            'next_before_id': str(messages[0]['id']) if has_more and messages else None
         })
         
     except Exception as e:
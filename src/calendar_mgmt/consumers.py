@@ -0,0 +1,124 @@
+"""
+WebSocket Consumer for Live Calendar Updates
+
+Clients authenticate with their Supabase JWT and are subscribed to their
+tenant's calendar group. Booking changes published by
+``CalendarManagementService.publish_booking_update`` are forwarded as
+``calendar.update`` frames, so calendars patch the changed booking instead
+of refetching whole ranges.
+"""
+
+import json
+import logging
+from typing import Dict, Any
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.utils import timezone
+
+from users.authentication import authenticate_token
+from .services import calendar_group_name
+
+logger = logging.getLogger(__name__)
+
+
+class CalendarConsumer(AsyncWebsocketConsumer):
+    """
+    WebSocket consumer that pushes booking deltas to a user's calendars.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user = None
+        self.group_name = None
+    
+    async def connect(self):
+        """Accept the connection; updates start after authentication."""
+        await self.accept()
+        
+        await self.send(text_data=json.dumps({
+            'type': 'connection.established',
+            'message': 'Connected to calendar updates. Please authenticate.',
+            'timestamp': timezone.now().isoformat()
+        }))
+    
+    async def disconnect(self, close_code):
+        """Leave the calendar group."""
+        if self.group_name and self.channel_layer:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        
+        logger.info(f"Calendar WebSocket disconnected, code: {close_code}")
+    
+    async def receive(self, text_data=None, bytes_data=None):
+        """Handle incoming WebSocket messages; only JSON text frames are accepted."""
+        if text_data is None:
+            await self._send_error("Binary frames are not supported")
+            return
+        
+        try:
+            data = json.loads(text_data)
+            message_type = data.get('type', 'unknown')
+            
+            if message_type == 'authenticate':
+                await self._handle_authentication(data)
+            elif message_type == 'ping':
+                await self.send(text_data=json.dumps({
+                    'type': 'pong',
+                    'timestamp': timezone.now().isoformat()
+                }))
+            else:
+                await self._send_error(f"Unknown message type: {message_type}")
+        
+        except json.JSONDecodeError:
+            await self._send_error("Invalid JSON format")
+        except Exception as e:
+            logger.error(f"Error processing calendar WebSocket message: {e}")
+            await self._send_error("Internal server error")
+    
+    async def _handle_authentication(self, data: Dict[str, Any]):
+        """Authenticate the socket and subscribe it to the user's calendar group."""
+        token = data.get('token', '')
+        if not token:
+            await self._send_error("Authentication token required")
+            return
+        
+        user = authenticate_token(token)
+        if not user:
+            await self._send_error("Invalid authentication token")
+            return
+        
+        if self.group_name and self.channel_layer:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        
+        self.user = user
+        self.group_name = calendar_group_name(user.id)
+        if self.channel_layer:
+            await self.channel_layer.group_add(self.group_name, self.channel_name)
+        
+        await self.send(text_data=json.dumps({
+            'type': 'authentication.success',
+            'message': 'Subscribed to calendar updates',
+            'user_id': user.id,
+            'timestamp': timezone.now().isoformat()
+        }))
+        
+        logger.info(f"Calendar WebSocket authenticated for user {user.id}")
+    
+    async def _send_error(self, error_message: str):
+        """Send error message to client."""
+        await self.send(text_data=json.dumps({
+            'type': 'error',
+            'error': error_message,
+            'timestamp': timezone.now().isoformat()
+        }))
+    
+    # Group messaging methods
+    
+    async def calendar_update(self, event):
+        """Forward a booking change published to the user's calendar group."""
+        data = event['data']
+        await self.send(text_data=json.dumps({
+            'type': 'calendar.update',
+            'event': data['type'],
+            'booking': data['booking'],
+            'conflicts': data.get('conflicts', []),
+            'timestamp': data.get('timestamp', timezone.now().isoformat())
+        }))
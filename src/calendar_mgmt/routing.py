@@ -0,0 +1,10 @@
+"""
+WebSocket routing configuration for live calendar updates.
+"""
+
+from django.urls import re_path
+from . import consumers
+
+websocket_urlpatterns = [
+    re_path(r'ws/calendar/$', consumers.CalendarConsumer.as_asgi()),
+]
@@ -7,6 +7,7 @@ booking operations, conflict detection, availability checking, and AI assistant
 
 import logging
 from datetime import datetime, timedelta
+from decimal import Decimal
 from typing import Dict, Any, List, Optional, Tuple
 from django.db import transaction
 from django.utils import timezone
@@ -20,11 +21,18 @@ from .models import (
     CalendarSettings, ConflictLog
 )
 from customer.models import Customer
+from service_catalog.search import get_service_index
 from users.authentication import SupabaseUser
 
 logger = logging.getLogger(__name__)
 
 
+def calendar_group_name(user_id: str) -> str:
+    """Channel layer group that receives a user's live calendar updates."""
+    return f"calendar_{user_id}"
+
+
+
 class ConflictDetectionService:
     """Service for detecting and resolving booking conflicts."""
     
@@ -422,6 +430,100 @@ class CalendarManagementService:
         self.availability_service = AvailabilityService()
         self.channel_layer = get_channel_layer()
     
+    def prepare_booking_from_ai(
+        self, 
+        user: SupabaseUser, 
+        booking_data: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """
+        Validate an AI booking and compute its conflicts and price quote without
+        writing anything.
+        
+        The result can be passed back to ``create_booking_from_ai`` as
+        ``prepared`` to skip this work, as long as the tenant's catalog,
+        customers and calendar have not changed in between.
+        
+        Args:
+            user: SupabaseUser instance
+            booking_data: Dictionary containing booking details
+        
+        Returns:
+            Dictionary with resolved ids, conflicts and the price quote
+        """
+        # Validate required fields
+        required_fields = ['title', 'start_time', 'end_time', 'customer', 'services']
+        for field in required_fields:
+            if field not in booking_data:
+                return {
+                    'success': False,
+                    'error': f"Missing required field: {field}",
+                    'field_errors': {field: 'This field is required'}
+                }
+        
+        # Validate services
+        services = self._validate_services(user.id, booking_data['services'])
+        if not services:
+            return {
+                'success': False,
+                'error': 'No valid services found',
+                'field_errors': {'services': 'At least one valid service is required'}
+            }
+        
+        # Parse datetime strings
+        start_time = self._parse_datetime(booking_data['start_time'])
+        end_time = self._parse_datetime(booking_data['end_time'])
+        
+        if start_time >= end_time:
+            return {
+                'success': False,
+                'error': 'End time must be after start time',
+                'field_errors': {'end_time': 'Must be after start time'}
+            }
+        
+        # Detect conflicts
+        service_ids = [str(service.id) for service in services]
+        conflicts = self.conflict_service.detect_conflicts({
+            'start_time': start_time,
+            'end_time': end_time,
+            'service_ids': service_ids
+        }, user.id)
+        
+        # Existing customer, if any; a new one is only created with the booking.
+        # Without an email, a full name exactly one customer has identifies them
+        email = (booking_data['customer'].get('email') or '').strip().lower()
+        name = (booking_data['customer'].get('name') or '').strip()
+        customer_id = None
+        if email:
+            customer_id = Customer.objects.filter(
+                user_id=user.id, email=email
+            ).values_list('id', flat=True).first()
+        elif ' ' in name:
+            first_name, last_name = name.split(None, 1)
+            matches = list(Customer.objects.filter(
+                user_id=user.id, first_name__iexact=first_name, last_name__iexact=last_name
+            ).values_list('id', flat=True)[:2])
+            customer_id = matches[0] if len(matches) == 1 else None
+        
+        quote = [
+            {
+                'service_id': str(service.id),
+                'name': service.name,
+                'price': str(self._quote_service_price(service, start_time, end_time))
+            }
+            for service in services
+        ]
+        
+        return {
+            'success': True,
+            'service_ids': service_ids,
+            'customer_id': str(customer_id) if customer_id else None,
+            'start_time': start_time.isoformat(),
+            'end_time': end_time.isoformat(),
+            'conflicts': conflicts,
+            'quote': quote,
+            'total_price': float(sum(Decimal(line['price']) for line in quote))
+        }
+    
     @transaction.atomic
     def create_booking_from_ai(
         self, 
@@ -429,7 +531,9 @@ class CalendarManagementService:
         booking_data: Dict[str, Any],
         ai_session_id: str = None,
         ai_message_id: int = None,
-        confidence_score: float = None
+        confidence_score: float = None,
+        calendar_settings: CalendarSettings = None,
+        prepared: Dict[str, Any] = None
     ) -> Dict[str, Any]:
         """
         Create a booking from AI assistant with enhanced validation and conflict resolution.
@@ -440,26 +544,25 @@ class CalendarManagementService:
             ai_session_id: AI chat session ID
             ai_message_id: AI message ID that triggered this booking
             confidence_score: AI confidence in the booking creation
+            calendar_settings: User's calendar settings, if already loaded
+            prepared: Still valid result of ``prepare_booking_from_ai``
         
         Returns:
             Dictionary with booking details and any conflicts/warnings
         """
         try:
-            # Validate required fields
-            required_fields = ['title', 'start_time', 'end_time', 'customer', 'services']
-            for field in required_fields:
-                if field not in booking_data:
-                    return {
-                        'success': False,
-                        'error': f"Missing required field: {field}",
-                        'field_errors': {field: 'This field is required'}
-                    }
-            
-            # Get or create customer
-            customer = self._get_or_create_customer(user.id, booking_data['customer'])
+            if prepared is None:
+                prepared = self.prepare_booking_from_ai(user, booking_data)
+                if not prepared['success']:
+                    return prepared
             
-            # Validate services
-            services = self._validate_services(user.id, booking_data['services'])
+            services_by_id = {
+                str(service.id): service
+                for service in Service.objects.filter(
+                    id__in=prepared['service_ids'], user_id=user.id, is_active=True
+                ).select_related('category')
+            }
+            services = [services_by_id[sid] for sid in prepared['service_ids'] if sid in services_by_id]
             if not services:
                 return {
                     'success': False,
@@ -467,28 +570,20 @@ class CalendarManagementService:
                     'field_errors': {'services': 'At least one valid service is required'}
                 }
             
-            # Parse datetime strings
-            start_time = self._parse_datetime(booking_data['start_time'])
-            end_time = self._parse_datetime(booking_data['end_time'])
-            
-            if start_time >= end_time:
-                return {
-                    'success': False,
-                    'error': 'End time must be after start time',
-                    'field_errors': {'end_time': 'Must be after start time'}
-                }
+            # Get or create customer
+            customer = None
+            if prepared.get('customer_id'):
+                customer = Customer.objects.filter(id=prepared['customer_id'], user_id=user.id).first()
+            if customer is None:
+                customer = self._get_or_create_customer(user.id, booking_data['customer'])
             
-            # Detect conflicts
-            service_ids = [str(service.id) for service in services]
-            conflicts = self.conflict_service.detect_conflicts({
-                'start_time': start_time,
-                'end_time': end_time,
-                'service_ids': service_ids
-            }, user.id)
+            start_time = self._parse_datetime(prepared['start_time'])
+            end_time = self._parse_datetime(prepared['end_time'])
+            conflicts = prepared['conflicts']
             
             # Get calendar settings for auto-confirmation logic
             try:
-                settings = CalendarSettings.objects.get(user_id=user.id)
+                settings = calendar_settings or CalendarSettings.objects.get(user_id=user.id)
                 auto_confirm = (
                     settings.ai_booking_auto_confirm and 
                     confidence_score and 
@@ -515,30 +610,20 @@ class CalendarManagementService:
                 notes=booking_data.get('notes', '')
             )
             
-            # Create booking services
-            total_price = 0
-            for service in services:
-                # Calculate price (simplified - could be more complex based on duration)
-                duration_hours = (end_time - start_time).total_seconds() / 3600
-                
-                if service.price_per_hour:
-                    price = service.price_per_hour * duration_hours
-                elif service.price_per_day:
-                    duration_days = max(1, duration_hours / 24)
-                    price = service.price_per_day * duration_days
-                else:
-                    price = service.base_price
-                
-                BookingService.objects.create(
+            # Create booking services at the quoted prices
+            prices = {line['service_id']: Decimal(line['price']) for line in prepared['quote']}
+            BookingService.objects.bulk_create([
+                BookingService(
                     booking=booking,
                     service=service,
                     quantity=1,  # Default quantity, could be customized
-                    price_per_unit=price,
-                    total_price=price,
+                    price_per_unit=prices[str(service.id)],
+                    total_price=prices[str(service.id)],
                     service_status='reserved'
                 )
-                
-                total_price += price
+                for service in services
+            ])
+            total_price = sum(prices[str(service.id)] for service in services)
             
             # Log conflicts if any
             for conflict in conflicts:
@@ -552,12 +637,13 @@ class CalendarManagementService:
                 )
             
             # Send real-time update
-            self._send_booking_update('booking.created', booking, conflicts)
+            serialized = self._serialize_booking(booking)
+            self.publish_booking_update('booking.created', booking, conflicts, serialized)
             
             return {
                 'success': True,
                 'booking_id': str(booking.id),
-                'booking': self._serialize_booking(booking),
+                'booking': serialized,
                 'conflicts': conflicts,
                 'auto_confirmed': auto_confirm,
                 'total_price': float(total_price),
@@ -572,6 +658,21 @@ class CalendarManagementService:
                 'details': str(e)
             }
     
+    def _quote_service_price(self, service: Service, start_time: datetime, end_time: datetime) -> Decimal:
+        """Price of one unit of a service for the booked period."""
+        # Simplified - could be more complex based on duration
+        duration_hours = Decimal(str((end_time - start_time).total_seconds() / 3600))
+        
+        if service.price_per_hour:
+            price = service.price_per_hour * duration_hours
+        elif service.price_per_day:
+            duration_days = max(Decimal(1), duration_hours / 24)
+            price = service.price_per_day * duration_days
+        else:
+            price = service.base_price
+        
+        return Decimal(price or 0).quantize(Decimal('0.01'))
+    
     def get_calendar_data(
         self, 
         user_id: str, 
@@ -659,30 +760,34 @@ class CalendarManagementService:
     
     def _validate_services(self, user_id: str, services_data: List[Dict[str, Any]]) -> List[Service]:
         """Validate and return service objects from AI-provided data."""
-        services = []
+        service_ids = []
+        index = None
         
         for service_data in services_data:
             service_id = service_data.get('id')
-            service_name = service_data.get('name', '').strip().lower()
+            service_name = (service_data.get('name') or service_data.get('service_name') or '').strip()
             
-            try:
-                if service_id:
-                    # Find by ID
-                    service = Service.objects.get(id=service_id, user_id=user_id, is_active=True)
-                    services.append(service)
-                elif service_name:
-                    # Find by name (case-insensitive partial match)
-                    service = Service.objects.filter(
-                        user_id=user_id,
-                        is_active=True,
-                        name__icontains=service_name
-                    ).first()
-                    if service:
-                        services.append(service)
-            except Service.DoesNotExist:
-                continue
+            if service_id:
+                service_ids.append(str(service_id))
+            elif service_name:
+                # Service the name resolves to in the tenant's service name index
+                index = index or get_service_index(user_id)
+                match = index.best_match(service_name)
+                if match:
+                    service_ids.append(match)
+        
+        if not service_ids:
+            return []
         
-        return services
+        try:
+            services = Service.objects.filter(
+                id__in=service_ids, user_id=user_id, is_active=True
+            ).select_related('category')
+            services_by_id = {str(service.id): service for service in services}
+        except (ValueError, ValidationError):
+            return []
+        
+        return [services_by_id[sid] for sid in service_ids if sid in services_by_id]
     
     def _parse_datetime(self, datetime_str: str) -> datetime:
         """Parse datetime string with timezone awareness."""
@@ -701,6 +806,7 @@ class CalendarManagementService:
     
     def _serialize_booking(self, booking: Booking) -> Dict[str, Any]:
         """Serialize booking object for API response."""
+        booking_services = list(booking.booking_services.select_related('service__category'))
         return {
             'id': str(booking.id),
             'title': booking.title,
@@ -725,14 +831,14 @@ class CalendarManagementService:
                     'price': float(bs.total_price),
                     'status': bs.service_status
                 }
-                for bs in booking.booking_services.all()
+                for bs in booking_services
             ],
             'ai_metadata': {
                 'session_id': str(booking.ai_session_id) if booking.ai_session_id else None,
                 'message_id': booking.ai_message_id,
                 'confidence_score': booking.ai_confidence_score
             } if booking.created_via == 'ai_assistant' else None,
-            'color': booking.color or booking.booking_services.first().service.category.color if booking.booking_services.exists() else '#3B82F6',
+            'color': booking.color or booking_services[0].service.category.color if booking_services else '#3B82F6',
             'created_at': booking.created_at.isoformat(),
             'updated_at': booking.updated_at.isoformat()
         }
@@ -748,22 +854,41 @@ class CalendarManagementService:
             'service_count': category.services.filter(is_active=True).count()
         }
     
-    def _send_booking_update(self, event_type: str, booking: Booking, conflicts: List[Dict] = None):
-        """Send real-time booking update via WebSocket."""
+    def publish_booking_update(
+        self, 
+        event_type: str, 
+        booking: Booking, 
+        conflicts: List[Dict] = None,
+        serialized: Dict[str, Any] = None
+    ):
+        """
+        Send real-time booking update via WebSocket.
+        
+        The booking is serialized now, unless the caller passes it already
+        ``serialized``, but sent once the surrounding transaction commits, so
+        clients never see a change that is rolled back or refetch before it
+        is visible.
+        """
         if not self.channel_layer:
             return
         
         # Send to user's personal calendar channel
-        channel_group = f"calendar_{booking.user_id}"
+        channel_group = calendar_group_name(booking.user_id)
         
         message = {
             'type': 'calendar_update',
             'data': {
                 'type': event_type,
-                'booking': self._serialize_booking(booking),
+                'booking': serialized or self._serialize_booking(booking),
                 'conflicts': conflicts or [],
                 'timestamp': timezone.now().isoformat()
             }
         }
         
-        async_to_sync(self.channel_layer.group_send)(channel_group, message) 
\ No newline at end of file
+        transaction.on_commit(lambda: self._publish_update(channel_group, message))
+    
+    def _publish_update(self, channel_group: str, message: Dict[str, Any]):
+        try:
+            async_to_sync(self.channel_layer.group_send)(channel_group, message)
+        except Exception as e:
+            logger.error(f"Failed to send calendar update to {channel_group}: {e}") 
\ No newline at end of file
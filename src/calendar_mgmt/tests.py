@@ -1,3 +1,38 @@
-from django.test import TestCase
+from channels.testing import WebsocketCommunicator
+from django.test import SimpleTestCase, override_settings
 
-# Create your tests here.
+from .consumers import CalendarConsumer
+
+IN_MEMORY_CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class CalendarConsumerTests(SimpleTestCase):
+    """Frames the calendar socket accepts and rejects."""
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(CalendarConsumer.as_asgi(), "/ws/calendar/")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        established = await communicator.receive_json_from()
+        self.assertEqual(established["type"], "connection.established")
+        return communicator
+
+    async def test_binary_frame_is_rejected(self):
+        communicator = await self.connect()
+
+        await communicator.send_to(bytes_data=b'{"type": "ping"}')
+        reply = await communicator.receive_json_from()
+
+        self.assertEqual(reply["type"], "error")
+        self.assertEqual(reply["error"], "Binary frames are not supported")
+        await communicator.disconnect()
+
+    async def test_ping(self):
+        communicator = await self.connect()
+
+        await communicator.send_json_to({"type": "ping"})
+        reply = await communicator.receive_json_from()
+
+        self.assertEqual(reply["type"], "pong")
+        await communicator.disconnect()
@@ -235,6 +235,15 @@ class BookingDetailView(generics.RetrieveUpdateDestroyAPIView):
     
     def get_queryset(self):
         return Booking.objects.filter(user_id=self.request.user.id)
+    
+    def perform_update(self, serializer):
+        booking = serializer.save()
+        CalendarManagementService().publish_booking_update('booking.updated', booking)
+    
+    def perform_destroy(self, instance):
+        # Serialized before the delete removes its service lines
+        CalendarManagementService().publish_booking_update('booking.deleted', instance)
+        instance.delete()
 
 
 class CalendarEventsView(APIView):
@@ -21,13 +21,14 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
 django_asgi_app = get_asgi_application()
 
 # Import routing after Django is set up
-from ai_assistant.routing import websocket_urlpatterns
+from ai_assistant.routing import websocket_urlpatterns as chat_websocket_urlpatterns
+from calendar_mgmt.routing import websocket_urlpatterns as calendar_websocket_urlpatterns
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": AllowedHostsOriginValidator(
         AuthMiddlewareStack(
-            URLRouter(websocket_urlpatterns)
+            URLRouter(chat_websocket_urlpatterns + calendar_websocket_urlpatterns)
         )
     ),
 })
@@ -349,17 +349,60 @@ CELERY_WORKER_MAX_TASKS_PER_CHILD = 50
 
 # AI Assistant Configuration
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+# Point at a local stand-in (manage.py openrouter_replay) for load tests
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
 OPENROUTER_MODEL = os.getenv("OPENROUTER_MODEL", "anthropic/claude-3-sonnet")
+# Cheap model for turns that need no action planning; empty disables the cascade
+OPENROUTER_LIGHT_MODEL = os.getenv("OPENROUTER_LIGHT_MODEL", "anthropic/claude-3-haiku")
+# Bearer token of the Prometheus scraper; the metrics endpoint is disabled without one
+AI_METRICS_TOKEN = os.getenv("AI_METRICS_TOKEN")
 
 # AI Assistant Settings
 AI_ASSISTANT_SETTINGS = {
     "max_tokens": 1000,
     "temperature": 0.3,
-    "timeout": 30,
-    "retry_attempts": 3,
+    "timeout": 30,  # Read timeout for OpenRouter calls (seconds)
+    "connect_timeout": 5,  # TCP/TLS connect timeout (seconds)
+    "retry_attempts": 3,  # Retries on connection errors and 429/5xx responses
+    "retry_backoff_base": 0.5,  # First retry waits up to this many seconds, doubling after
+    "retry_max_delay": 20,  # Upper bound for any single retry wait, incl. Retry-After
     "context_window_size": 10,  # Number of previous messages to include
+    "history_buffer_size": 50,  # Recent messages per session kept in Redis; 0 reads history from the database
+    "history_buffer_ttl": 86400,  # Buffers of sessions idle this long expire (seconds)
+    "history_token_budget": 1500,  # Max estimated tokens of history per prompt
+    "prompt_cache_control": True,  # Mark the system prompt as a provider cache breakpoint
+    "summary_trigger_messages": 16,  # Unsummarized messages that trigger a summary refresh
+    "summary_keep_recent": 6,  # Newest messages always sent verbatim
     "response_cache_ttl": 3600,  # Cache responses for 1 hour
+    "response_cache_context_messages": 2,  # Prior messages that are part of the cache key
+    "single_flight_timeout": 60,  # Max wait on an identical in-flight request; 0 disables coalescing
+    "stream_responses": True,  # Stream tokens over WebSocket as chat.delta frames
+    "http_pool_size": 20,  # Keep-alive connections to OpenRouter per process
+    "action_concurrency": 4,  # Threads for independent read-only actions of one reply
+    "tool_calling": True,  # Offer actions as tools; off for models without tool support (ACTION_DATA only)
+    # Per-plan OpenRouter limits: concurrent calls and tokens per budget window,
+    # e.g. AI_PLAN_FREEMIUM_CONCURRENCY=2 and AI_PLAN_FREEMIUM_TOKENS=200000 (-1 = unlimited)
+    "plan_limits": {
+        plan: {
+            "concurrency": int(os.getenv(f"AI_PLAN_{plan.upper()}_CONCURRENCY", "-1")),
+            "tokens": int(os.getenv(f"AI_PLAN_{plan.upper()}_TOKENS", "-1")),
+        }
+        for plan in ("freemium", "basic", "professional", "enterprise")
+    },
+    "token_budget_window": 3600,  # Rolling window of the token budgets (seconds)
+    "global_llm_concurrency": int(os.getenv("AI_GLOBAL_LLM_CONCURRENCY", "32")),  # Provider capacity shared by all tenants
+    "llm_queue_timeout": 30,  # Max wait for capacity before a turn fails (seconds)
+    "llm_lease_seconds": 180,  # Capacity held by a crashed worker is freed after this
+    "prepared_action_ttl": 900,  # Keep precomputed checks of unconfirmed actions for 15 minutes
+    "fast_path_enabled": True,  # Answer simple read-only intents without the LLM
+    "fast_path_min_confidence": 0.7,
+    "cascade_enabled": True,  # Answer conversational turns with OPENROUTER_LIGHT_MODEL
+    "cascade_light_max_words": 12,  # Longer messages without entities still go to the full model
+    "retrieval_enabled": True,  # List the services and customers a message mentions in the full model's prompt
+    "retrieval_top_k": 5,  # Max services and max customers listed
+    # "inline" runs turns in the web process; "celery" queues them on ai_processing
+    "execution_mode": os.getenv("AI_EXECUTION_MODE", "inline"),
+    "queued_turn_claim_timeout": 300,  # A queued turn claimed this long ago by a worker that died is run again (seconds)
 }
 
 # WebSocket Settings
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ServiceCatalogConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "service_catalog"
+
+    def ready(self):
+        from . import signals  # noqa: F401
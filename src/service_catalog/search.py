@@ -0,0 +1,273 @@
+"""
+Service Name Search
+
+Per-tenant trigram index over service names, brands, models and search
+tags. Resolves the free-text names the AI assistant produces ("canon g7x",
+"cannon g7x", "sony a7") to ranked catalog entries without a query per name.
+
+Indexes are built with one query and kept in process memory. Each tenant has
+a catalog version in the shared cache, bumped by ``service_catalog.signals``
+on every service, category and package write, so all worker processes drop
+stale indexes. The AI assistant keys its cached replies on the same version.
+"""
+
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Dict, Any, List, Optional, Iterable, FrozenSet, Tuple, Callable
+from django.core.cache import cache
+
+from .models import Service
+
+logger = logging.getLogger(__name__)
+
+# Same defaults as pg_trgm's similarity threshold and a small ranked list
+MATCH_THRESHOLD = 0.3
+SUGGESTION_THRESHOLD = 0.1
+# Resolving a name to the service a booking uses tolerates typos only
+RESOLVE_THRESHOLD = 0.6
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+
+def trigrams(text: str) -> FrozenSet[str]:
+    """Trigrams of ``text`` the way pg_trgm extracts them (words padded with blanks)."""
+    grams = set()
+    for word in _WORD_RE.findall((text or '').lower()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase words of ``text`` joined by single spaces."""
+    return ' '.join(_WORD_RE.findall((text or '').lower()))
+
+
+def catalog_version_key(user_id: str) -> str:
+    """Cache key of a tenant's catalog version."""
+    return f"service_catalog_version:{user_id}"
+
+
+def get_catalog_version(user_id: str) -> int:
+    """Current catalog version of a tenant."""
+    try:
+        return cache.get(catalog_version_key(user_id), 0)
+    except Exception as e:
+        logger.error(f"Failed to read catalog version for tenant {user_id}: {e}")
+        return -1
+
+
+def bump_catalog_version(user_id: str):
+    """Invalidate the service name indexes of a tenant in every process."""
+    key = catalog_version_key(user_id)
+    try:
+        cache.add(key, 0, None)
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+    except Exception as e:
+        logger.error(f"Failed to bump catalog version for tenant {user_id}: {e}")
+
+
+class ServiceNameIndex:
+    """
+    Trigram index of the active services of one tenant.
+
+    Every service is indexed under its name, "brand model" and search tags.
+    A query is scored against each of these terms by averaging trigram
+    similarity and the share of the query's trigrams the term contains, so
+    both typos and partial names ("canon" for "Canon G7X Mark III") rank
+    well. Only services sharing at least one trigram with the query are
+    scored.
+    """
+
+    def __init__(self, user_id: str, rows: Iterable[Any]):
+        self.user_id = str(user_id)
+        self._names = {}
+        self._aliases = {}
+        self._terms = []
+        self._postings = defaultdict(set)
+
+        for service_id, name, brand, model, tags in rows:
+            service_id = str(service_id)
+            self._names[service_id] = name
+
+            terms = [name, f"{brand} {model}" if brand and model else '']
+            self._aliases[service_id] = [normalize_text(term) for term in terms if normalize_text(term)]
+            if isinstance(tags, list):
+                terms.extend(tag for tag in tags if isinstance(tag, str))
+
+            for position, term in enumerate(terms):
+                grams = trigrams(term)
+                if not grams:
+                    continue
+                term_index = len(self._terms)
+                # The first two terms name the service; tags only describe it
+                self._terms.append((service_id, normalize_text(term), len(grams), position < 2))
+                for gram in grams:
+                    self._postings[gram].add(term_index)
+
+    @classmethod
+    def build(cls, user_id: str) -> "ServiceNameIndex":
+        """Load the active services of a tenant with a single query."""
+        rows = Service.objects.filter(user_id=user_id, is_active=True).values_list(
+            'id', 'name', 'brand', 'model', 'search_tags'
+        )
+        return cls(user_id, rows)
+
+    def __len__(self):
+        return len(self._names)
+
+    def search(self, query: str, limit: int = 5, min_score: float = MATCH_THRESHOLD) -> List[Dict[str, Any]]:
+        """
+        Rank services matching ``query``.
+
+        Returns:
+            Up to ``limit`` dictionaries with id, name and score, best first
+        """
+        best = {}
+        for term_index, score in self._score_terms(query):
+            service_id = self._terms[term_index][0]
+            if score > best.get(service_id, 0):
+                best[service_id] = score
+
+        ranked = sorted(
+            (
+                (score, service_id) for service_id, score in best.items()
+                if score >= min_score
+            ),
+            key=lambda match: (-match[0], len(self._names[match[1]]), self._names[match[1]])
+        )
+        return [
+            {'id': service_id, 'name': self._names[service_id], 'score': round(score, 4)}
+            for score, service_id in ranked[:limit]
+        ]
+
+    def _score_terms(self, query: str) -> Iterable[Tuple[int, float]]:
+        """Score of every term sharing a trigram with ``query``."""
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+        normalized = normalize_text(query)
+
+        # Shared trigram counts straight from the posting lists
+        shared_counts = defaultdict(int)
+        for gram in query_grams:
+            for term_index in self._postings.get(gram, ()):
+                shared_counts[term_index] += 1
+
+        scores = []
+        for term_index, shared in shared_counts.items():
+            _, term, size, _ = self._terms[term_index]
+            if term == normalized:
+                score = 1.0
+            else:
+                similarity = shared / (len(query_grams) + size - shared)
+                coverage = shared / len(query_grams)
+                score = (similarity + coverage) / 2
+            scores.append((term_index, score))
+        return scores
+
+    def aliases(self) -> List[Tuple[str, List[str]]]:
+        """
+        Name of every service with the phrases that name it exactly.
+
+        The phrases are the normalized name and "brand model"; search tags
+        are left out as they describe rather than name a service.
+        """
+        return [(self._names[service_id], aliases) for service_id, aliases in self._aliases.items()]
+
+    def best_match(self, query: str) -> Optional[str]:
+        """
+        ID of the service ``query`` names, or None.
+
+        Stricter than ``search``, whose rankings also serve as suggestions:
+        the query must equal or contain, or be contained in, the name or
+        "brand model" of the service as whole words, or be a close typo of
+        one (``RESOLVE_THRESHOLD``) that keeps every model word of the
+        query, i.e. every word with a digit. "Sony A7S" therefore never
+        resolves to "Sony FX3".
+        """
+        normalized = normalize_text(query)
+        if not normalized:
+            return None
+        padded = f" {normalized} "
+        model_words = {word for word in normalized.split() if any(char.isdigit() for char in word)}
+
+        best = None
+        for term_index, score in self._score_terms(query):
+            service_id, term, _, names_service = self._terms[term_index]
+            if not names_service:
+                continue
+            padded_term = f" {term} "
+            contained = padded in padded_term or padded_term in padded
+            close = score >= RESOLVE_THRESHOLD and model_words <= set(term.split())
+            if not (contained or close):
+                continue
+            candidate = (-score, len(self._names[service_id]), self._names[service_id], service_id)
+            if best is None or candidate < best:
+                best = candidate
+        return best[3] if best else None
+
+
+# Tenants whose index is kept per process, and a safety net for catalog
+# writes that bypass signals (queryset.update, raw SQL)
+MAX_CACHED_TENANTS = 256
+INDEX_TTL = 300
+
+
+class VersionedIndexCache:
+    """
+    Per-process LRU of per-tenant indexes, keyed on a data version.
+
+    ``build(user_id)`` loads a tenant's index and ``get_version(user_id)``
+    reads the version of the data it covers from the shared cache, returning
+    -1 when it is unavailable. An index is rebuilt when the version changed,
+    could not be read or the index is older than ``ttl`` seconds.
+    """
+
+    def __init__(
+        self,
+        build: Callable[[str], Any],
+        get_version: Callable[[str], int],
+        max_tenants: int = MAX_CACHED_TENANTS,
+        ttl: float = INDEX_TTL
+    ):
+        self.build = build
+        self.get_version = get_version
+        self.max_tenants = max_tenants
+        self.ttl = ttl
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str) -> Any:
+        """Index of a tenant; a warm lookup costs one cache read for the version."""
+        user_id = str(user_id)
+        version = self.get_version(user_id)
+
+        with self._lock:
+            entry = self._indexes.get(user_id)
+            if entry and entry[0] == version and version != -1 and time.monotonic() - entry[1] < self.ttl:
+                self._indexes.move_to_end(user_id)
+                return entry[2]
+
+        index = self.build(user_id)
+
+        with self._lock:
+            self._indexes[user_id] = (version, time.monotonic(), index)
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_tenants:
+                self._indexes.popitem(last=False)
+
+        return index
+
+
+_service_indexes = VersionedIndexCache(ServiceNameIndex.build, get_catalog_version)
+
+
+def get_service_index(user_id: str) -> ServiceNameIndex:
+    """Service name index of a tenant, rebuilt when its catalog changed."""
+    return _service_indexes.get(user_id)
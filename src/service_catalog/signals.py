@@ -0,0 +1,19 @@
+"""
+Signal handlers that keep the service name indexes consistent with the catalog.
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Service, ServiceCategory, Package
+from .search import bump_catalog_version
+
+
+@receiver([post_save, post_delete], sender=Service)
+@receiver([post_save, post_delete], sender=ServiceCategory)
+@receiver([post_save, post_delete], sender=Package)
+def invalidate_service_index(sender, instance, **kwargs):
+    """Bump the tenant's catalog version after a catalog write commits."""
+    user_id = str(instance.user_id)
+    transaction.on_commit(lambda: bump_catalog_version(user_id))
@@ -59,6 +59,47 @@ class SupabaseUser:
         return True
 
 
+def authenticate_token(token: str) -> Optional[SupabaseUser]:
+    """
+    Validate a Supabase JWT sent over a WebSocket and return its user.
+    
+    Returns None when the token is missing, invalid or expired, so
+    consumers can report the failure without raising.
+    """
+    try:
+        jwt_secret = settings.SUPABASE_JWT_SECRET
+        if not jwt_secret:
+            logger.error("Supabase JWT secret not configured")
+            return None
+        
+        payload = jwt.decode(
+            token,
+            jwt_secret,
+            algorithms=['HS256'],
+            audience='authenticated',
+            options={
+                'verify_signature': True,
+                'verify_exp': True,
+                'verify_aud': True,
+                'require_exp': True,
+                'require_iat': True,
+                'require_sub': True
+            }
+        )
+        
+        return SupabaseUser(payload)
+        
+    except jwt.ExpiredSignatureError:
+        logger.warning("Expired JWT token in WebSocket authentication")
+        return None
+    except jwt.InvalidTokenError as e:
+        logger.warning(f"Invalid JWT token in WebSocket authentication: {e}")
+        return None
+    except Exception as e:
+        logger.error(f"Unexpected error in WebSocket authentication: {e}")
+        return None
+
+
 class SupabaseJWTAuthentication(authentication.BaseAuthentication):
     """
     Custom authentication class that validates Supabase JWT tokens and creates